@@ -0,0 +1,175 @@
+"""
+Terminal X AI - Persistent analysis store
+SQLite table of every completed analysis, indexed by document hash, type, recommendation and date,
+with an FTS5 index over the document text and generated analysis for instant search
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+DEFAULT_STORE_PATH = os.path.join("data", "analyses.sqlite3")
+
+_RECOMMENDATIONS = ["POSITIVE", "NEUTRAL", "NEGATIVE"]
+# Document text indexed for full-text search; long filings are truncated to keep the index small
+MAX_INDEXED_CHARS = 200_000
+_SEARCH_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def document_hash(document: str) -> str:
+    """Stable identifier for a document's text"""
+    return hashlib.sha256(document.strip().encode('utf-8')).hexdigest()
+
+def _recommendation(result: Dict[str, Any]) -> Optional[str]:
+    """POSITIVE/NEUTRAL/NEGATIVE from the metrics or thesis, whichever states one"""
+    for value in ((result.get('metrics') or {}).get('recommendation'),
+                  (result.get('thesis') or {}).get('investment_recommendation')):
+        text = str(value or "").upper()
+        for label in _RECOMMENDATIONS:
+            if label in text:
+                return label
+    return None
+
+def _flatten(value: Any) -> str:
+    """All string leaves of a result section, for indexing"""
+    if isinstance(value, dict):
+        return " ".join(_flatten(item) for key, item in value.items() if not key.startswith('_'))
+    if isinstance(value, list):
+        return " ".join(_flatten(item) for item in value)
+    return "" if value is None else str(value)
+
+class AnalysisStore:
+    """Every analysis result, looked up by document hash or searched by text and filters"""
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS analyses (
+                                id INTEGER PRIMARY KEY,
+                                doc_hash TEXT NOT NULL,
+                                title TEXT NOT NULL,
+                                document_type TEXT,
+                                recommendation TEXT,
+                                risk_level TEXT,
+                                pipeline_mode TEXT,
+                                created_at REAL NOT NULL,
+                                result TEXT NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_doc_hash ON analyses (doc_hash, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_type ON analyses (document_type, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_recommendation ON analyses (recommendation, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_created ON analyses (created_at)")
+            try:
+                conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5(
+                                    title, summary, analysis, document, tokenize = 'porter unicode61')""")
+                self.full_text = True
+            except sqlite3.OperationalError:
+                # SQLite built without FTS5: search falls back to LIKE over the stored JSON
+                self.full_text = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL lets readers in other processes proceed while one process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, document: str, result: Dict[str, Any], title: Optional[str] = None) -> int:
+        """Store an analysis of document and return its id"""
+        doc_hash = result.get('document_hash') or document_hash(document)
+        if not title:
+            title = next((line.strip() for line in document.splitlines() if line.strip()), "Untitled")[:120]
+        analysis = " ".join(_flatten(result.get(key)) for key in ('metrics', 'risks', 'thesis', 'quality_check'))
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "INSERT INTO analyses (doc_hash, title, document_type, recommendation, risk_level, "
+                "pipeline_mode, created_at, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (doc_hash, title, result.get('document_type'), _recommendation(result),
+                 (result.get('risks') or {}).get('overall_risk_level'), result.get('pipeline_mode'),
+                 time.time(), json.dumps(result))
+            )
+            if self.full_text:
+                conn.execute("INSERT INTO analyses_fts (rowid, title, summary, analysis, document) VALUES (?, ?, ?, ?, ?)",
+                             (cursor.lastrowid, title, result.get('summary') or "", analysis,
+                              document[:MAX_INDEXED_CHARS]))
+            return cursor.lastrowid
+
+    def get(self, analysis_id: int) -> Optional[Dict[str, Any]]:
+        """Full stored result by id"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM analyses WHERE id = ?", (analysis_id,)).fetchone()
+        return json.loads(row['result']) if row else None
+
+    def latest_for_document(self, doc_hash: str, pipeline_mode: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Most recent analysis of the document with this hash, or None"""
+        query = "SELECT id, title, created_at, result FROM analyses WHERE doc_hash = ?"
+        params: List[Any] = [doc_hash]
+        if pipeline_mode:
+            query += " AND pipeline_mode = ?"
+            params.append(pipeline_mode)
+        with self._connect() as conn:
+            row = conn.execute(query + " ORDER BY created_at DESC LIMIT 1", params).fetchone()
+        if row is None:
+            return None
+        return {"id": row['id'], "title": row['title'], "created_at": row['created_at'],
+                "result": json.loads(row['result'])}
+
+    def search(self, query: Optional[str] = "", document_type: Optional[str] = None,
+               recommendation: Optional[str] = None, since: Optional[float] = None, until: Optional[float] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """Analyses matching a free-text query and filters, best match (or newest) first
+
+        The query is split into words that must all appear, each matched as a prefix, so user input
+        never needs FTS syntax. Only metadata and a snippet are returned; use get() for the result.
+        """
+        filters, params = [], []
+        for column, value in (("a.document_type", document_type), ("a.recommendation", recommendation)):
+            if value:
+                filters.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            filters.append("a.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            filters.append("a.created_at < ?")
+            params.append(until)
+
+        words = _SEARCH_TOKEN.findall(query or "")
+        columns = ("a.id, a.doc_hash, a.title, a.document_type, a.recommendation, a.risk_level, "
+                   "a.pipeline_mode, a.created_at")
+        if words and self.full_text:
+            match = " ".join(f'"{word}"*' for word in words)
+            sql = (f"SELECT {columns}, snippet(analyses_fts, -1, '**', '**', ' … ', 12) AS snippet "
+                   f"FROM analyses_fts JOIN analyses a ON a.id = analyses_fts.rowid "
+                   f"WHERE analyses_fts MATCH ?{''.join(' AND ' + f for f in filters)} "
+                   f"ORDER BY bm25(analyses_fts) LIMIT ?")
+            params = [match] + params + [limit]
+        else:
+            for word in words:
+                filters.append("(a.title LIKE ? OR a.result LIKE ?)")
+                params.extend([f"%{word}%", f"%{word}%"])
+            where = f"WHERE {' AND '.join(filters)}" if filters else ""
+            sql = f"SELECT {columns}, '' AS snippet FROM analyses a {where} ORDER BY a.created_at DESC LIMIT ?"
+            params.append(limit)
+
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def count(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Terminal X AI - Headless batch analysis
+Fans a directory or glob of filings out over a worker pool and streams one JSONL result per document
+
+Usage:
+    python batch_runner.py data/raw --output results.jsonl --workers 8 --rpm 60
+    python batch_runner.py "filings/**/*.txt" --output results.jsonl
+    python batch_runner.py filings --profile fast --quality-sample 0.05
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Set
+
+from streamlit import logger as st_logger
+
+from analysis_store import AnalysisStore
+from document_ingestion import DocumentIngestor
+from instrumentation import REGISTRY
+from pipeline_profiles import DEFAULT_PROFILE, PIPELINE_PROFILES
+from rate_limiter import RateLimiter
+from terminal_x_gemini import TerminalXGeminiAI
+
+def find_documents(source: str, pattern: str = "*.txt") -> List[str]:
+    """Expand a directory or glob into a sorted list of document paths"""
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, "**", pattern), recursive=True)
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def load_completed(output_path: str) -> Set[str]:
+    """Documents that already have a successful result in the output file"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Partial line left behind by a crash mid-write
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["document"])
+    return completed
+
+def analyze_file(ai: TerminalXGeminiAI, path: str, fused: bool = False,
+                 ingestor: Optional[DocumentIngestor] = None,
+                 store: Optional[AnalysisStore] = None, profile: str = DEFAULT_PROFILE,
+                 quality_sample: Optional[float] = None) -> Dict[str, Any]:
+    """Run the profile's pipeline on one TXT, PDF or DOCX file and wrap the outcome as a JSONL record
+    
+    Completed analyses are also saved to store, so the app's history search finds them.
+    """
+    started = time.perf_counter()
+    try:
+        document = (ingestor or DocumentIngestor()).read_file(path)
+        result = ai.process_document(document, on_progress=lambda stage, status: None, fused=fused,
+                                     profile=profile, quality_sample=quality_sample)
+        # Partial results are kept but not marked ok, so a resumed run retries them
+        record = {"document": path, "status": "partial" if result["errors"] else "ok", "result": result}
+        if store is not None:
+            store.save(document, result, title=os.path.basename(path))
+    except Exception as e:
+        record = {"document": path, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    record["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+def run_batch(paths: List[str], output_path: str, workers: int = 4,
+              requests_per_minute: float = 60, stage_workers: int = 4, fused: bool = False,
+              store: Optional[AnalysisStore] = None, profile: str = DEFAULT_PROFILE,
+              quality_sample: Optional[float] = None) -> Dict[str, Any]:
+    """Analyze documents concurrently, appending each result to output_path as it finishes
+    
+    Besides the per-status counts, returns how many documents stopped early and the aggregate
+    outcome of the sampled quality checks.
+    """
+    completed = load_completed(output_path)
+    todo = [path for path in paths if path not in completed]
+    counts = {"skipped": len(paths) - len(todo), "ok": 0, "partial": 0, "error": 0, "early_exit": 0}
+
+    # One limiter shared by every document and stage keeps the whole run under budget
+    limiter = RateLimiter(requests_per_minute)
+    ai = TerminalXGeminiAI(max_workers=stage_workers, rate_limiter=limiter, concurrent_documents=workers)
+    ingestor = DocumentIngestor()
+
+    with open(output_path, "a") as out, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(analyze_file, ai, path, fused, ingestor, store, profile, quality_sample)
+                   for path in todo]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+            counts["early_exit"] += bool(record.get("result", {}).get("early_exit"))
+            print(f"[{counts['ok'] + counts['partial'] + counts['error']}/{len(todo)}] {record['status']:7} "
+                  f"{record['document']} ({record['elapsed_seconds']}s)", file=sys.stderr)
+
+    counts["quality"] = ai.quality_stats.report()
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a directory of financial documents with Terminal X AI")
+    parser.add_argument("source", help="Directory or glob of documents to analyze")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--pattern", default="*.txt", help="File pattern used when source is a directory (txt, pdf or docx)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Documents analyzed concurrently")
+    parser.add_argument("--stage-workers", type=int, default=4, help="Pipeline stages run concurrently per document")
+    parser.add_argument("--rpm", type=float, default=60, help="Global Gemini requests-per-minute budget")
+    parser.add_argument("--fused", action="store_true", help="Extract metrics, risks and thesis in one call per document")
+    parser.add_argument("--profile", choices=list(PIPELINE_PROFILES), default=DEFAULT_PROFILE,
+                        help="Stages to run: fast (triage), standard or deep (the default: every stage on every document)")
+    parser.add_argument("--quality-sample", type=float,
+                        help="Share of documents to quality check (default: the profile's)")
+    parser.add_argument("--no-store", action="store_true", help="Do not save results to the analysis history store")
+    parser.add_argument("--metrics-file", help="Write Prometheus text metrics for the run to this file")
+    args = parser.parse_args()
+
+    # Pipeline UI calls are no-ops outside `streamlit run`; silence the bare-mode warnings
+    st_logger.set_log_level("error")
+
+    paths = find_documents(args.source, args.pattern)
+    if not paths:
+        print(f"❌ No documents found for {args.source}", file=sys.stderr)
+        sys.exit(1)
+
+    store = None if args.no_store else AnalysisStore()
+    counts = run_batch(paths, args.output, args.workers, args.rpm, args.stage_workers, args.fused, store,
+                       args.profile, args.quality_sample)
+    if args.metrics_file:
+        with open(args.metrics_file, "w") as f:
+            f.write(REGISTRY.to_prometheus())
+    print(f"✅ {counts['ok']} analyzed, {counts['partial']} partial, {counts['error']} failed, "
+          f"{counts['skipped']} already done", file=sys.stderr)
+    quality = counts["quality"]
+    print(f"⏭️ {counts['early_exit']} stopped early as low-value; {quality['passed']} of {quality['checks']} "
+          f"sampled quality checks passed", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Terminal X AI - Offline pipeline benchmark
+Runs process_document against the deterministic StubBackend and reports per-stage and end-to-end
+latency, throughput under N concurrent documents and parse-failure rates
+
+Usage:
+    python benchmark.py --documents 24 --concurrency 4 --latency 0.2 --jitter 0.1
+    python benchmark.py --max-p95 2.0 --max-parse-failure-rate 0.05 --json bench_output.txt
+"""
+
+import argparse
+import glob
+import json
+import math
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from streamlit import logger as st_logger
+
+from llm_backends import StubBackend
+from pipeline_profiles import DEFAULT_PROFILE, PIPELINE_PROFILES
+from rate_limiter import RateLimiter
+from terminal_x_gemini import TerminalXGeminiAI
+
+# Stages whose output is parsed from JSON; a 'raw_response' key marks the text fallback
+PARSED_STAGES = ('metrics', 'risks', 'thesis')
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def _latency_summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+        "max": round(max(values), 4) if values else 0.0
+    }
+
+def run_benchmark(documents: List[str], concurrency: int = 4, fused: bool = False,
+                  backend: Optional[StubBackend] = None, profile: str = DEFAULT_PROFILE) -> Dict[str, Any]:
+    """Analyze documents concurrently on a stub backend and collect timing and parse statistics"""
+    ai = TerminalXGeminiAI(
+        backend=backend or StubBackend(),
+        use_cache=False,
+        # Effectively unlimited: the benchmark measures the pipeline, not the quota
+        rate_limiter=RateLimiter(requests_per_minute=1e9),
+        # Samples are cycled, so identical documents run concurrently; merging them would overstate throughput
+        coalesce=False,
+        concurrent_documents=concurrency
+    )
+    for client in ai.router.clients.values():
+        client.base_delay = 0.01
+
+    stage_times: Dict[str, List[float]] = {}
+    end_to_end: List[float] = []
+    outcomes = {"ok": 0, "partial": 0, "error": 0}
+    early_exits = 0
+    parsed = {"total": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def analyze(document: str):
+        started_stages: Dict[str, float] = {}
+
+        def on_progress(stage: str, status: str):
+            now = time.perf_counter()
+            if status == 'running':
+                started_stages[stage] = now
+            elif status in ('done', 'failed') and stage in started_stages:
+                with lock:
+                    stage_times.setdefault(stage, []).append(now - started_stages[stage])
+
+        started = time.perf_counter()
+        try:
+            result = ai.process_document(document, on_progress=on_progress, fused=fused, profile=profile)
+        except Exception:
+            with lock:
+                outcomes["error"] += 1
+            return
+        elapsed = time.perf_counter() - started
+
+        nonlocal early_exits
+        with lock:
+            end_to_end.append(elapsed)
+            early_exits += result["early_exit"] is not None
+            outcomes["partial" if result["errors"] else "ok"] += 1
+            for stage in PARSED_STAGES:
+                if isinstance(result.get(stage), dict):
+                    parsed["total"] += 1
+                    parsed["failed"] += 'raw_response' in result[stage]
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(analyze, documents))
+    wall = time.perf_counter() - wall_started
+
+    return {
+        "documents": len(documents),
+        "concurrency": concurrency,
+        "pipeline_mode": "fused" if fused else "multi-call",
+        "pipeline_profile": profile,
+        "wall_seconds": round(wall, 4),
+        "throughput_docs_per_minute": round(len(documents) / wall * 60, 2) if wall else 0.0,
+        "end_to_end": _latency_summary(end_to_end),
+        "stages": {stage: _latency_summary(times) for stage, times in sorted(stage_times.items())},
+        "outcomes": outcomes,
+        "early_exits": early_exits,
+        "quality_checks": ai.quality_stats.report()["checks"],
+        "parse_failure_rate": round(parsed["failed"] / parsed["total"], 4) if parsed["total"] else 0.0
+    }
+
+def print_report(report: Dict[str, Any]):
+    print(f"Pipeline: {report['pipeline_mode']} ({report['pipeline_profile']})  documents: {report['documents']}  "
+          f"concurrency: {report['concurrency']}")
+    print(f"Wall time: {report['wall_seconds']}s  throughput: {report['throughput_docs_per_minute']} docs/min")
+    print(f"Outcomes: {report['outcomes']}  parse failure rate: {report['parse_failure_rate']:.1%}")
+    print(f"Early exits: {report['early_exits']}  quality checks: {report['quality_checks']}")
+    print()
+    print(f"{'stage':<16}{'count':>7}{'mean':>9}{'p50':>9}{'p95':>9}{'max':>9}")
+    rows = list(report["stages"].items()) + [("END TO END", report["end_to_end"])]
+    for stage, stats in rows:
+        print(f"{stage:<16}{stats['count']:>7}{stats['mean']:>9.3f}{stats['p50']:>9.3f}"
+              f"{stats['p95']:>9.3f}{stats['max']:>9.3f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Terminal X AI pipeline offline")
+    parser.add_argument("--documents", type=int, default=12, help="Documents to analyze (samples are cycled)")
+    parser.add_argument("--source", default="data/raw/*.txt", help="Glob of sample documents")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="Documents analyzed concurrently")
+    parser.add_argument("--fused", action="store_true", help="Benchmark the fused single-call mode")
+    parser.add_argument("--profile", choices=list(PIPELINE_PROFILES), default=DEFAULT_PROFILE,
+                        help="Pipeline profile to benchmark")
+    parser.add_argument("--latency", type=float, default=0.1, help="Stub latency per call in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Extra uniform random latency per call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls that fail (retryable)")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of JSON responses corrupted")
+    parser.add_argument("--seed", type=int, default=0, help="Stub random seed")
+    parser.add_argument("--json", metavar="PATH", help="Also write the report as JSON")
+    parser.add_argument("--max-p95", type=float, help="Fail if end-to-end p95 latency exceeds this (seconds)")
+    parser.add_argument("--max-parse-failure-rate", type=float, help="Fail if the parse failure rate exceeds this")
+    args = parser.parse_args()
+
+    st_logger.set_log_level("error")
+
+    samples = []
+    for path in sorted(glob.glob(args.source)):
+        with open(path, "r") as f:
+            samples.append(f.read())
+    if not samples:
+        print(f"❌ No sample documents match {args.source}", file=sys.stderr)
+        sys.exit(1)
+    documents = [samples[i % len(samples)] for i in range(args.documents)]
+
+    backend = StubBackend(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                          malformed_rate=args.malformed_rate, seed=args.seed)
+    report = run_benchmark(documents, args.concurrency, args.fused, backend, args.profile)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    if args.max_p95 is not None and report["end_to_end"]["p95"] > args.max_p95:
+        failures.append(f"end-to-end p95 {report['end_to_end']['p95']}s > {args.max_p95}s")
+    if args.max_parse_failure_rate is not None and report["parse_failure_rate"] > args.max_parse_failure_rate:
+        failures.append(f"parse failure rate {report['parse_failure_rate']} > {args.max_parse_failure_rate}")
+    if failures:
+        print("❌ Benchmark budget exceeded: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Terminal X AI - Long document chunking
+Splits filings on section and paragraph boundaries and merges per-chunk stage results
+"""
+
+import re
+from collections import Counter
+from typing import Any, Dict, List
+
+# Headings such as "RISK FACTORS", "Item 7. Management's Discussion", "## Segment Results"
+_HEADING = re.compile(r"^\s*(#{1,6}\s+\S.*|item\s+\d+[a-z]?\.?\s.*|[A-Z0-9][A-Z0-9 &,'()/\-.:]{3,80})\s*$", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+_RISK_LEVELS = ["LOW", "MEDIUM", "HIGH"]
+_RECOMMENDATIONS = ["POSITIVE", "NEUTRAL", "NEGATIVE"]
+
+def _is_heading(line: str) -> bool:
+    stripped = line.strip()
+    if not stripped or len(stripped) > 100:
+        return False
+    if stripped.lower().startswith("item ") or stripped.startswith("#"):
+        return bool(_HEADING.match(stripped))
+    # All-caps lines only; mixed-case sentences are ordinary text
+    return stripped.upper() == stripped and any(c.isalpha() for c in stripped) and bool(_HEADING.match(stripped))
+
+def split_sections(text: str) -> List[str]:
+    """Split text into sections, each starting at a heading line"""
+    sections, current = [], []
+    for line in text.splitlines():
+        if _is_heading(line) and any(l.strip() for l in current):
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if any(l.strip() for l in current):
+        sections.append("\n".join(current).strip())
+    return sections
+
+def _split_oversized(block: str, max_chars: int) -> List[str]:
+    """Break a block larger than max_chars on sentence boundaries, hard-splitting as a last resort"""
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(block):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_document(text: str, max_chars: int = 3000) -> List[str]:
+    """Pack sections and paragraphs into chunks of at most max_chars, never splitting mid-paragraph unless forced"""
+    blocks = []
+    for section in split_sections(text):
+        if len(section) <= max_chars:
+            blocks.append(section)
+            continue
+        for paragraph in re.split(r"\n\s*\n", section):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            blocks.extend([paragraph] if len(paragraph) <= max_chars else _split_oversized(paragraph, max_chars))
+
+    chunks, current = [], ""
+    for block in blocks:
+        if current and len(current) + 2 + len(block) > max_chars:
+            chunks.append(current)
+            current = block
+        else:
+            current = f"{current}\n\n{block}" if current else block
+    if current:
+        chunks.append(current)
+    return chunks
+
+def select_chunks(chunks: List[str], limit: int) -> List[str]:
+    """Keep at most `limit` chunks, spread evenly so the start and end of the document are covered"""
+    if limit <= 0:
+        return []
+    if len(chunks) <= limit:
+        return chunks
+    if limit == 1:
+        return chunks[:1]
+    step = (len(chunks) - 1) / (limit - 1)
+    return [chunks[round(i * step)] for i in range(limit)]
+
+def _usable(parts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop text-fallback results (marked by raw_response) unless nothing else parsed"""
+    parsed = [part for part in parts if isinstance(part, dict) and 'raw_response' not in part]
+    return parsed or [part for part in parts if isinstance(part, dict)][:1]
+
+def _present(value: Any) -> bool:
+    return value not in (None, "", "null", "None", "N/A") and value != []
+
+def _union(lists: List[Any]) -> List[Any]:
+    """Concatenate lists, dropping case-insensitive duplicates while keeping first-seen order"""
+    seen, merged = set(), []
+    for items in lists:
+        if not isinstance(items, list):
+            items = [items] if _present(items) else []
+        for item in items:
+            key = str(item).strip().lower()
+            if key and key not in seen:
+                seen.add(key)
+                merged.append(item)
+    return merged
+
+def _vote(values: List[Any], labels: List[str]) -> Any:
+    """Most common label mentioned in values, or the first present value if none match"""
+    found = []
+    for value in values:
+        text = str(value).upper()
+        found.extend(label for label in labels if label in text)
+    if found:
+        return Counter(found).most_common(1)[0][0]
+    return next((value for value in values if _present(value)), None)
+
+def merge_metrics(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """First reported value per metric wins; recommendation is a majority vote"""
+    parts = _usable(parts)
+    if len(parts) <= 1:
+        return parts[0] if parts else {}
+
+    merged: Dict[str, Any] = {}
+    for part in parts:
+        for key, value in part.items():
+            if key != 'recommendation' and _present(value) and not _present(merged.get(key)):
+                merged[key] = value
+    if any('recommendation' in part for part in parts):
+        merged['recommendation'] = _vote([part.get('recommendation') for part in parts], _RECOMMENDATIONS)
+    return merged
+
+def merge_risks(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Union of risks per category; overall level is the highest level any chunk reported"""
+    parts = _usable(parts)
+    if len(parts) <= 1:
+        return parts[0] if parts else {}
+
+    merged: Dict[str, Any] = {}
+    for key in dict.fromkeys(key for part in parts for key in part):
+        if key != 'overall_risk_level':
+            merged[key] = _union([part.get(key) for part in parts])
+    levels = [str(part.get('overall_risk_level', '')).upper() for part in parts]
+    ranked = [level for level in _RISK_LEVELS if level in levels]
+    merged['overall_risk_level'] = ranked[-1] if ranked else next((l for l in levels if l), None)
+    return merged
+
+def merge_thesis(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Concatenate distinct narratives, union the lists and vote on the recommendation"""
+    parts = _usable(parts)
+    if len(parts) <= 1:
+        return parts[0] if parts else {}
+
+    merged: Dict[str, Any] = {}
+    for key in dict.fromkeys(key for part in parts for key in part):
+        values = [part.get(key) for part in parts if _present(part.get(key))]
+        if key == 'investment_recommendation':
+            votes = _vote(values, _RECOMMENDATIONS)
+            reasons = [str(value) for value in values if votes and str(votes) in str(value).upper()]
+            merged[key] = reasons[0] if reasons else votes
+        elif any(isinstance(value, list) for value in values):
+            merged[key] = _union(values)
+        else:
+            merged[key] = " ".join(dict.fromkeys(str(value).strip() for value in values))
+    return merged
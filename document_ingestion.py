@@ -0,0 +1,229 @@
+"""
+Terminal X AI - Document ingestion
+Page-by-page text extraction for TXT, PDF and DOCX, streamed from the file and cached on disk under
+the file's content hash so re-uploads skip extraction
+"""
+
+import codecs
+import hashlib
+import os
+import uuid
+import zipfile
+from typing import BinaryIO, Callable, Iterator, List, Optional
+from xml.etree import ElementTree
+
+DEFAULT_TEXT_CACHE_DIR = os.path.join("data", "cache", "documents")
+
+# Bumped whenever extraction output changes, so stale cached text is not reused
+EXTRACTOR_VERSION = 1
+# Formats without real pages (TXT, DOCX without page breaks) are cut into pages of about this size
+PAGE_CHARS = 4000
+READ_BLOCK_BYTES = 1024 * 1024
+# Separates pages in cached text files; stripped from extracted text
+PAGE_SEPARATOR = "\f"
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+class IngestionError(ValueError):
+    """The file could not be read as a document"""
+
+def content_hash(stream: BinaryIO) -> str:
+    """SHA-256 of the stream's contents, read in blocks; the stream is rewound afterwards"""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for block in iter(lambda: stream.read(READ_BLOCK_BYTES), b""):
+        digest.update(block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def _file_kind(filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    if extension in ("txt", "md", "text", ""):
+        return "txt"
+    if extension in ("pdf", "docx"):
+        return extension
+    raise IngestionError(f"Unsupported file type: .{extension}")
+
+def _split_pages(text: str, page_chars: int, final: bool) -> List[str]:
+    """Cut text into pages at line breaks; the last partial page is kept back unless final"""
+    pages = []
+    while len(text) > page_chars:
+        cut = text.rfind("\n", 0, page_chars)
+        cut = cut + 1 if cut > 0 else page_chars
+        pages.append(text[:cut])
+        text = text[cut:]
+    if final and text:
+        pages.append(text)
+        text = ""
+    pages.append(text)
+    return pages
+
+def _iter_text_pages(stream: BinaryIO, page_chars: int = PAGE_CHARS) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    for block in iter(lambda: stream.read(READ_BLOCK_BYTES), b""):
+        *pages, buffer = _split_pages(buffer + decoder.decode(block), page_chars, final=False)
+        yield from pages
+    *pages, _ = _split_pages(buffer + decoder.decode(b"", final=True), page_chars, final=True)
+    yield from pages
+
+def _iter_pdf_pages(stream: BinaryIO) -> Iterator[str]:
+    try:
+        # Optional dependency, only needed for PDF uploads
+        from pypdf import PdfReader
+        from pypdf.errors import PdfReadError
+    except ImportError:
+        raise IngestionError("PDF support requires pypdf (pip install pypdf)")
+
+    try:
+        # PdfReader seeks into the stream on demand; each page's content is parsed only when extracted
+        reader = PdfReader(stream)
+        for page in reader.pages:
+            yield page.extract_text() or ""
+    except PdfReadError as e:
+        raise IngestionError(f"Could not read PDF: {e}") from e
+
+def _iter_docx_pages(stream: BinaryIO, page_chars: int = PAGE_CHARS) -> Iterator[str]:
+    """Stream paragraphs from word/document.xml; table rows become "cell | cell" lines"""
+    try:
+        archive = zipfile.ZipFile(stream)
+        xml = archive.open("word/document.xml")
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise IngestionError(f"Could not read DOCX: {e}") from e
+
+    lines: List[str] = []
+    size, table_depth = 0, 0
+    row: List[str] = []
+    cell: List[str] = []
+    page_break = False
+
+    with archive, xml:
+        try:
+            for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+                tag = element.tag
+                if event == "start":
+                    if tag == f"{_W}tbl":
+                        table_depth += 1
+                    continue
+
+                if tag == f"{_W}lastRenderedPageBreak" or (tag == f"{_W}br" and element.get(f"{_W}type") == "page"):
+                    page_break = True
+                elif tag == f"{_W}p":
+                    text = "".join(node.text or "" if node.tag == f"{_W}t" else "\t"
+                                   for node in element.iter() if node.tag in (f"{_W}t", f"{_W}tab"))
+                    element.clear()
+                    if table_depth:
+                        cell.append(text)
+                        continue
+                    # A page starts inside this paragraph: everything before it was the previous page
+                    if page_break and lines:
+                        yield "\n".join(lines)
+                        lines, size = [], 0
+                    page_break = False
+                    lines.append(text)
+                    size += len(text) + 1
+                elif tag == f"{_W}tc":
+                    row.append(" ".join(part for part in cell if part).strip())
+                    cell = []
+                    element.clear()
+                elif tag == f"{_W}tr":
+                    lines.append(" | ".join(row))
+                    size += len(lines[-1]) + 1
+                    row = []
+                    element.clear()
+                elif tag == f"{_W}tbl":
+                    table_depth -= 1
+                    element.clear()
+                else:
+                    continue
+
+                if size >= page_chars and not table_depth:
+                    yield "\n".join(lines)
+                    lines, size = [], 0
+        except ElementTree.ParseError as e:
+            raise IngestionError(f"Could not read DOCX: {e}") from e
+
+    if lines:
+        yield "\n".join(lines)
+
+def iter_pages(stream: BinaryIO, filename: str) -> Iterator[str]:
+    """Yield the text of each page without reading the whole file into memory"""
+    kind = _file_kind(filename)
+    stream.seek(0)
+    if kind == "pdf":
+        return _iter_pdf_pages(stream)
+    if kind == "docx":
+        return _iter_docx_pages(stream)
+    return _iter_text_pages(stream)
+
+class DocumentIngestor:
+    """Extracts document text page by page, caching it on disk by content hash"""
+
+    def __init__(self, cache_dir: Optional[str] = DEFAULT_TEXT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _cache_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}.v{EXTRACTOR_VERSION}.txt")
+
+    def _cached_pages(self, path: str) -> Iterator[str]:
+        with open(path, "r", encoding="utf-8") as f:
+            buffer = ""
+            for block in iter(lambda: f.read(READ_BLOCK_BYTES), ""):
+                *pages, buffer = (buffer + block).split(PAGE_SEPARATOR)
+                yield from pages
+            yield buffer
+
+    def _extract_and_cache(self, stream: BinaryIO, filename: str, path: str) -> Iterator[str]:
+        # Written under a unique name and renamed when complete, so an abandoned or failed
+        # extraction never leaves a truncated cache entry behind
+        partial = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(partial, "w", encoding="utf-8") as out:
+                for index, page in enumerate(iter_pages(stream, filename)):
+                    page = page.replace(PAGE_SEPARATOR, "\n")
+                    out.write(page if index == 0 else PAGE_SEPARATOR + page)
+                    yield page
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    def pages(self, stream: BinaryIO, filename: str) -> Iterator[str]:
+        """Page texts of the document, from the cache when this exact file was seen before"""
+        if not self.cache_dir:
+            yield from iter_pages(stream, filename)
+            return
+
+        path = self._cache_path(content_hash(stream))
+        if os.path.exists(path):
+            self.hits += 1
+            yield from self._cached_pages(path)
+        else:
+            self.misses += 1
+            yield from self._extract_and_cache(stream, filename, path)
+
+    def read_text(self, stream: BinaryIO, filename: str,
+                  on_page: Optional[Callable[[int], None]] = None) -> str:
+        """Whole document text; on_page(pages_done) is called after each page
+        
+        Text files come back exactly as decoded: their pages are cuts of one text, some in the middle
+        of a long line. PDF and DOCX pages that end mid-line are separated by a blank line.
+        """
+        text_file = _file_kind(filename) == "txt"
+        parts = []
+        for count, page in enumerate(self.pages(stream, filename), 1):
+            parts.append(page if text_file or page.endswith("\n") or not page else page + "\n\n")
+            if on_page is not None:
+                on_page(count)
+        if text_file:
+            return "".join(parts)
+        return "".join(parts).rstrip("\n") + "\n" if parts else ""
+
+    def read_file(self, path: str, on_page: Optional[Callable[[int], None]] = None) -> str:
+        """read_text for a file on disk"""
+        with open(path, "rb") as f:
+            return self.read_text(f, path, on_page)
@@ -0,0 +1,137 @@
+"""
+Terminal X AI - Document Q&A sessions
+Follow-up questions about an analyzed document: its context is cached once, with the provider where the
+backend supports context caching and as a reusable local prompt prefix otherwise, and each question then
+sends only itself plus a reference to that context
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from single_flight import SingleFlight
+
+# How long a provider context cache lives; every question within it reuses the upload
+CONTEXT_TTL_SECONDS = 3600.0
+# Provider caches this close to expiry are replaced rather than risk expiring mid-question
+CONTEXT_REFRESH_MARGIN = 60.0
+# Earlier questions and answers repeated in each follow-up prompt
+HISTORY_TURNS = 4
+
+class DocumentContext:
+    """One document's cached context: the prefix text and, if uploaded, the provider cache holding it"""
+
+    def __init__(self, key: str, model: str, text: str, name: Optional[str], tokens: int,
+                 expires_at: Optional[float]):
+        self.key = key
+        self.model = model
+        self.text = text
+        # Provider cache reference (e.g. cachedContents/...), None for a local prefix
+        self.name = name
+        self.tokens = tokens
+        self.created_at = time.time()
+        self.expires_at = expires_at
+        self.questions = 0
+
+    @property
+    def source(self) -> str:
+        return 'provider' if self.name is not None else 'local'
+
+    @property
+    def usable(self) -> bool:
+        return self.expires_at is None or time.time() < self.expires_at - CONTEXT_REFRESH_MARGIN
+
+    def prefixed(self, prompt: str) -> str:
+        """prompt as it must be sent where the provider cache is not available"""
+        # The prefix is byte-identical for every question, which also lets providers that cache
+        # repeated prompt prefixes implicitly bill it at the cached rate
+        return self.text + "\n\n" + prompt
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"source": self.source, "model": self.model, "tokens": self.tokens, "questions": self.questions,
+                "expires_in_seconds": round(self.expires_at - time.time()) if self.expires_at else None}
+
+class ContextCache:
+    """Process-wide document contexts by (model, prefix text), shared by every session on the same document
+
+    Concurrent sessions opening the same filing create its context once.
+    """
+
+    def __init__(self, ttl_seconds: float = CONTEXT_TTL_SECONDS, max_entries: int = 64):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._contexts: "OrderedDict[Tuple[str, str], DocumentContext]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = SingleFlight()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, model: str, text: str,
+            upload: Callable[[str, float], Tuple[Optional[str], int]]) -> DocumentContext:
+        """The live context for text on model, creating it with upload(text, ttl) -> (name, tokens)"""
+        key = hashlib.sha256(f"{model}\n{text}".encode('utf-8')).hexdigest()
+        with self._lock:
+            context = self._contexts.get((model, key))
+            if context is not None and context.usable:
+                self._contexts.move_to_end((model, key))
+                self.reused += 1
+                return context
+
+        def create() -> DocumentContext:
+            name, tokens = upload(text, self.ttl_seconds)
+            expires_at = time.time() + self.ttl_seconds if name is not None else None
+            context = DocumentContext(key, model, text, name, tokens, expires_at)
+            with self._lock:
+                self._contexts[(model, key)] = context
+                while len(self._contexts) > self.max_entries:
+                    self._contexts.popitem(last=False)
+                self.created += 1
+            return context
+
+        return self._flights.do((model, key), create)[0]
+
+    def invalidate(self, context: DocumentContext):
+        """Drop a context the provider no longer has, so the next question re-creates it"""
+        with self._lock:
+            if self._contexts.get((context.model, context.key)) is context:
+                del self._contexts[(context.model, context.key)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            contexts = list(self._contexts.values())
+        return {"contexts": len(contexts), "provider": sum(c.name is not None for c in contexts),
+                "local": sum(c.name is None for c in contexts), "created": self.created, "reused": self.reused}
+
+class DocumentSession:
+    """Questions and answers about one document; see TerminalXGeminiAI.open_session and ask"""
+
+    def __init__(self, document: str, doc_hash: str, analysis: Optional[Dict[str, Any]] = None):
+        self.document = document
+        self.doc_hash = doc_hash
+        self.analysis = analysis
+        # Instructions, analysis and compacted document; built on the first question
+        self.context_text: Optional[str] = None
+        self.turns: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def history(self, turns: int = HISTORY_TURNS) -> List[Tuple[str, str]]:
+        """The latest (question, answer) pairs, oldest first"""
+        with self._lock:
+            return [(turn['question'], turn['answer']) for turn in self.turns[-turns:]]
+
+    def add_turn(self, turn: Dict[str, Any]):
+        with self._lock:
+            self.turns.append(turn)
+
+    def totals(self) -> Dict[str, Any]:
+        """Tokens and cost over every question so far"""
+        with self._lock:
+            turns = list(self.turns)
+        return {
+            "questions": len(turns),
+            "prompt_tokens": sum(turn['prompt_tokens'] for turn in turns),
+            "cached_tokens": sum(turn['cached_tokens'] for turn in turns),
+            "cost_usd": round(sum(turn['cost_usd'] for turn in turns), 6)
+        }
@@ -0,0 +1,217 @@
+"""
+Terminal X AI - Gemini client layer
+Rate limiting, retries with exponential backoff and jitter, per-call deadlines and typed failures
+"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from prompt_compactor import count_tokens
+from rate_limiter import RateLimiter
+
+class GeminiError(Exception):
+    """Base class for Gemini call failures"""
+    retryable = False
+
+class RateLimitError(GeminiError):
+    """Quota or rate limit exhausted (HTTP 429)"""
+    retryable = True
+
+class ServiceUnavailableError(GeminiError):
+    """Transient server or network failure"""
+    retryable = True
+
+class DeadlineExceededError(GeminiError):
+    """The call could not finish within its deadline, including retries"""
+
+class ModelNotFoundError(GeminiError):
+    """The configured model does not exist or is not available to this key"""
+
+class ContentFilteredError(GeminiError):
+    """The prompt or response was blocked by safety settings"""
+
+class ContextExpiredError(GeminiError):
+    """A cached document context (see LLMBackend.create_context) expired or was deleted"""
+
+_shared_limiters: Dict[str, RateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+def get_shared_limiter(model_name: str) -> RateLimiter:
+    """Process-wide limiter per model, shared by every Streamlit session and worker thread
+
+    Limits come from GEMINI_RPM and GEMINI_TPM and should match the project's quota tier.
+    """
+    with _shared_limiters_lock:
+        if model_name not in _shared_limiters:
+            _shared_limiters[model_name] = RateLimiter(
+                requests_per_minute=float(os.environ.get("GEMINI_RPM", 60)),
+                tokens_per_minute=float(os.environ.get("GEMINI_TPM", 1_000_000)),
+                burst=int(os.environ.get("GEMINI_BURST", 4))
+            )
+        return _shared_limiters[model_name]
+
+def estimate_tokens(text: str) -> int:
+    """Local prompt size estimate for rate limiting and for backends that report no usage"""
+    return count_tokens(text)
+
+def classify_error(error: Exception) -> GeminiError:
+    """Map SDK, transport and HTTP errors onto the typed failures above"""
+    if isinstance(error, GeminiError):
+        return error
+    try:
+        # Deferred so importing the app does not pay for google.api_core (and gRPC) up front; absent
+        # when only offline backends are installed, whose errors are GeminiErrors or builtins
+        from google.api_core import exceptions as google_exceptions
+    except ImportError:
+        google_exceptions = None
+
+    if google_exceptions is not None:
+        if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+            return RateLimitError(str(error))
+        if isinstance(error, google_exceptions.NotFound):
+            # Cached contents are looked up like models; a missing one is not a missing model
+            if 'cachedcontent' in str(error).lower().replace(' ', ''):
+                return ContextExpiredError(str(error))
+            return ModelNotFoundError(str(error))
+        if isinstance(error, (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                              google_exceptions.DeadlineExceeded)):
+            return ServiceUnavailableError(str(error))
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return ServiceUnavailableError(str(error))
+    if type(error).__name__ in ('BlockedPromptException', 'StopCandidateException'):
+        return ContentFilteredError(str(error))
+    return GeminiError(f"{type(error).__name__}: {error}")
+
+def response_text(response) -> str:
+    """Extract text from a generate_content response, raising ContentFilteredError when blocked"""
+    feedback = getattr(response, 'prompt_feedback', None)
+    if feedback is not None and getattr(feedback, 'block_reason', 0):
+        raise ContentFilteredError(f"Prompt blocked: {feedback.block_reason}")
+
+    candidates = getattr(response, 'candidates', None)
+    if candidates:
+        candidate = candidates[0]
+        finish_reason = getattr(candidate, 'finish_reason', None)
+        if getattr(finish_reason, 'name', None) == 'SAFETY' or finish_reason == 3:
+            raise ContentFilteredError("Response blocked by safety settings")
+        content = getattr(candidate, 'content', None)
+        parts = getattr(content, 'parts', None)
+        if parts:
+            return "".join(getattr(part, 'text', '') for part in parts)
+
+    try:
+        text = response.text
+    except (AttributeError, ValueError):
+        text = None
+    if text:
+        return text
+    raise GeminiError("Empty response from Gemini")
+
+class GeminiClient:
+    """Wraps an LLM backend (see llm_backends.py) with a shared rate limiter, retries and deadlines"""
+
+    def __init__(self, backend, limiter: Optional[RateLimiter] = None, timeout: float = 120.0,
+                 max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.limiter = limiter if limiter is not None else get_shared_limiter(self.model_name)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _with_retries(self, prompt: str, timeout: Optional[float], stats,
+                      attempt_call: Callable[[float, Dict[str, int]], str]) -> str:
+        """Run attempt_call(remaining_seconds, usage) under the limiter, retrying retryable failures"""
+        deadline = time.monotonic() + (timeout if timeout is not None else self.timeout)
+        usage: Dict[str, int] = {}
+        attempt = 0
+        while True:
+            try:
+                waited = self.limiter.acquire(estimate_tokens(prompt), deadline)
+            except TimeoutError as e:
+                raise DeadlineExceededError(str(e)) from e
+            if stats is not None:
+                stats.wait_seconds += waited
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceededError("Deadline passed before the request was sent")
+
+            try:
+                text = attempt_call(remaining, usage)
+                if stats is not None:
+                    stats.prompt_tokens = usage.get('prompt_tokens') or estimate_tokens(prompt)
+                    stats.response_tokens = usage.get('response_tokens') or estimate_tokens(text)
+                    stats.cached_tokens = usage.get('cached_tokens', 0)
+                return text
+            except Exception as e:
+                error = classify_error(e)
+                if not error.retryable or attempt >= self.max_retries:
+                    raise error from (None if error is e else e)
+
+            # Full jitter spreads retries from concurrent stages instead of re-synchronising them
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            if time.monotonic() + delay >= deadline:
+                raise DeadlineExceededError(f"Deadline reached after {attempt + 1} attempts") from error
+            time.sleep(delay)
+            attempt += 1
+            if stats is not None:
+                stats.wait_seconds += delay
+                stats.retries = attempt
+
+    def create_context(self, text: str, ttl_seconds: float, timeout: Optional[float] = None) -> Optional[str]:
+        """Cache text with the provider for later calls (see LLMBackend.create_context)
+
+        Returns the reference to pass as generate(context=...), or None if the backend has no
+        context caching or text is too short for it.
+        """
+        return self._with_retries(text, timeout, None, lambda remaining, usage: self.backend.create_context(
+            text, ttl_seconds=ttl_seconds, timeout=remaining))
+
+    def generate(self, prompt: str, timeout: Optional[float] = None,
+                 generation_config: Optional[Dict[str, Any]] = None, stats=None,
+                 context: Optional[str] = None) -> str:
+        """Generate a response, retrying retryable failures until the deadline
+
+        When an instrumentation.CallStats is passed, limiter/backoff wait, retries and token
+        usage are recorded on it. context is a reference from create_context that prompt follows
+        on from. Raises a GeminiError subclass when the call cannot succeed.
+        """
+        extra = {'context': context} if context is not None else {}
+        return self._with_retries(prompt, timeout, stats, lambda remaining, usage: self.backend.generate(
+            prompt, generation_config=generation_config, timeout=remaining, usage=usage, **extra))
+
+    def generate_stream(self, prompt: str, on_text: Callable[[str], None], timeout: Optional[float] = None,
+                        generation_config: Optional[Dict[str, Any]] = None, stats=None,
+                        context: Optional[str] = None) -> str:
+        """Stream a response, calling on_text with the text received so far after every chunk
+
+        Returns the complete text. Failures before the first chunk are retried like generate();
+        once text has been shown a failure is raised instead, so output is never duplicated.
+        """
+        extra = {'context': context} if context is not None else {}
+
+        def attempt_call(remaining: float, usage: Dict[str, int]) -> str:
+            started = time.perf_counter()
+            pieces = []
+            try:
+                for piece in self.backend.generate_stream(prompt, generation_config=generation_config,
+                                                          timeout=remaining, usage=usage, **extra):
+                    if not pieces and stats is not None:
+                        stats.first_token_seconds = time.perf_counter() - started
+                    pieces.append(piece)
+                    on_text("".join(pieces))
+            except Exception as e:
+                error = classify_error(e)
+                if pieces:
+                    error.retryable = False
+                raise error from (None if error is e else e)
+            if not pieces:
+                raise GeminiError("Empty response from Gemini")
+            return "".join(pieces)
+
+        return self._with_retries(prompt, timeout, stats, attempt_call)
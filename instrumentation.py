@@ -0,0 +1,245 @@
+"""
+Terminal X AI - Pipeline instrumentation
+Per-call latency, wait time, tokens, retries, cache hits and cost, with Prometheus text export
+"""
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# USD per million (prompt, response) tokens; unknown models are costed at zero
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-flash-lite': (0.10, 0.40),
+    'gemini-1.5-pro': (1.25, 5.00),
+    'gemini-1.5-flash': (0.075, 0.30),
+    'gemini-1.0-pro': (0.50, 1.50),
+    'gemini-pro': (0.50, 1.50)
+}
+
+# Share of the prompt price charged for prompt tokens served from a context cache
+CACHED_PROMPT_PRICE_SHARE = 0.25
+
+_current_metrics: contextvars.ContextVar = contextvars.ContextVar('pipeline_metrics', default=None)
+_current_stage: contextvars.ContextVar = contextvars.ContextVar('pipeline_stage', default=None)
+
+def estimate_cost(model_name: str, prompt_tokens: int, response_tokens: int, cached_tokens: int = 0) -> float:
+    """Estimated USD cost of one call from the MODEL_PRICES table
+
+    cached_tokens are the part of prompt_tokens read from a context cache, charged at the discount.
+    """
+    name = model_name.split('/')[-1]
+    # Longest matching prefix, so versioned names like gemini-1.5-pro-002 resolve
+    matches = [model for model in MODEL_PRICES if name.startswith(model)]
+    if not matches:
+        return 0.0
+    prompt_price, response_price = MODEL_PRICES[max(matches, key=len)]
+    prompt_cost = (prompt_tokens - cached_tokens + cached_tokens * CACHED_PROMPT_PRICE_SHARE) * prompt_price
+    return (prompt_cost + response_tokens * response_price) / 1_000_000
+
+class CallStats:
+    """Measurements for a single _call_gemini invocation"""
+
+    def __init__(self, template: Optional[str] = None, model: str = ""):
+        self.stage = _current_stage.get()
+        self.template = template
+        self.model = model
+        self.wall_seconds = 0.0
+        # Time spent waiting on the rate limiter and retry backoff rather than on the API
+        self.wait_seconds = 0.0
+        self.prompt_tokens = 0
+        # Input tokens prompt compaction removed before sending (see prompt_compactor)
+        self.tokens_saved = 0
+        # Part of prompt_tokens served from a provider context cache
+        self.cached_tokens = 0
+        self.response_tokens = 0
+        self.retries = 0
+        self.cache_hit = False
+        # Streaming calls only: time from sending the request to the first chunk
+        self.first_token_seconds: Optional[float] = None
+        # A backup request to another model was raced against this call (see model_router)
+        self.hedged = False
+        self.error: Optional[str] = None
+
+    @property
+    def cost_usd(self) -> float:
+        if self.cache_hit:
+            return 0.0
+        return estimate_cost(self.model, self.prompt_tokens, self.response_tokens, self.cached_tokens)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "stage": self.stage,
+            "template": self.template,
+            "model": self.model,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "wait_seconds": round(self.wait_seconds, 4),
+            "prompt_tokens": self.prompt_tokens,
+            "tokens_saved": self.tokens_saved,
+            "cached_tokens": self.cached_tokens,
+            "response_tokens": self.response_tokens,
+            "retries": self.retries,
+            "cache_hit": self.cache_hit,
+            "first_token_seconds": round(self.first_token_seconds, 4) if self.first_token_seconds is not None else None,
+            "cost_usd": round(self.cost_usd, 6),
+            "hedged": self.hedged,
+            "error": self.error
+        }
+
+class PipelineMetrics:
+    """Collects CallStats and stage timings for one process_document run"""
+
+    def __init__(self):
+        self.calls: List[CallStats] = []
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add_call(self, stats: CallStats):
+        with self._lock:
+            self.calls.append(stats)
+
+    def add_event(self, kind: str, **details):
+        """Record a notable non-call event, e.g. a response that failed to parse"""
+        with self._lock:
+            self.events.append({"event": kind, "stage": _current_stage.get(), **details})
+
+    def stage_timing(self, stage: str, queue_seconds: float, wall_seconds: float):
+        with self._lock:
+            self.stages[stage] = {"queue_seconds": queue_seconds, "wall_seconds": wall_seconds}
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-stage aggregates and totals, ready to attach to the result JSON"""
+        def aggregate(calls: List[CallStats]) -> Dict[str, Any]:
+            first_tokens = [c.first_token_seconds for c in calls if c.first_token_seconds is not None]
+            return {
+                "calls": len(calls),
+                "call_seconds": round(sum(c.wall_seconds for c in calls), 4),
+                "wait_seconds": round(sum(c.wait_seconds for c in calls), 4),
+                "prompt_tokens": sum(c.prompt_tokens for c in calls),
+                "tokens_saved": sum(c.tokens_saved for c in calls),
+                "cached_tokens": sum(c.cached_tokens for c in calls),
+                "response_tokens": sum(c.response_tokens for c in calls),
+                "retries": sum(c.retries for c in calls),
+                "cache_hits": sum(c.cache_hit for c in calls),
+                "first_token_seconds": round(min(first_tokens), 4) if first_tokens else None,
+                "cost_usd": round(sum(c.cost_usd for c in calls), 6)
+            }
+
+        with self._lock:
+            calls = list(self.calls)
+            stages = dict(self.stages)
+            events = list(self.events)
+
+        per_stage = {}
+        for stage in dict.fromkeys(list(stages) + [c.stage for c in calls if c.stage]):
+            per_stage[stage] = aggregate([c for c in calls if c.stage == stage])
+            timing = stages.get(stage, {})
+            per_stage[stage]["queue_seconds"] = round(timing.get("queue_seconds", 0.0), 4)
+            per_stage[stage]["wall_seconds"] = round(timing.get("wall_seconds", 0.0), 4)
+
+        return {
+            "stages": per_stage,
+            "totals": aggregate(calls),
+            "calls": [c.to_dict() for c in calls],
+            "events": events
+        }
+
+@contextmanager
+def stage_scope(metrics: Optional[PipelineMetrics], stage: str):
+    """Attribute every call made inside this block (on this thread or copied contexts) to stage"""
+    metrics_token = _current_metrics.set(metrics)
+    stage_token = _current_stage.set(stage)
+    try:
+        yield
+    finally:
+        _current_stage.reset(stage_token)
+        _current_metrics.reset(metrics_token)
+
+def record_call(stats: CallStats):
+    """Attach stats to the active pipeline run and the process-wide registry"""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add_call(stats)
+    REGISTRY.observe_call(stats)
+
+def record_event(kind: str, **details):
+    """Record an event on the active pipeline run and count it process-wide"""
+    metrics = _current_metrics.get()
+    if metrics is not None:
+        metrics.add_event(kind, **details)
+    REGISTRY.observe_event(kind, _current_stage.get())
+
+class MetricsRegistry:
+    """Process-wide counters across every document, exported in Prometheus text format"""
+
+    COUNTERS = [
+        ("calls_total", "Gemini calls made", lambda s: 1),
+        ("call_seconds_total", "Wall time spent in Gemini calls", lambda s: s.wall_seconds),
+        ("wait_seconds_total", "Time spent waiting on rate limits and backoff", lambda s: s.wait_seconds),
+        ("prompt_tokens_total", "Prompt tokens sent", lambda s: s.prompt_tokens),
+        ("prompt_tokens_saved_total", "Prompt tokens removed by compaction", lambda s: s.tokens_saved),
+        ("cached_prompt_tokens_total", "Prompt tokens served from a context cache", lambda s: s.cached_tokens),
+        ("response_tokens_total", "Response tokens received", lambda s: s.response_tokens),
+        ("retries_total", "Retried Gemini requests", lambda s: s.retries),
+        ("cache_hits_total", "Calls answered from the response cache", lambda s: int(s.cache_hit)),
+        ("errors_total", "Calls that failed", lambda s: int(s.error is not None)),
+        ("cost_usd_total", "Estimated spend in USD", lambda s: s.cost_usd)
+    ]
+
+    def __init__(self, prefix: str = "terminalx"):
+        self.prefix = prefix
+        self._values: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, name: str, labels: Dict[str, str], amount: float):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe_call(self, stats: CallStats):
+        labels = {"stage": stats.stage or "none", "model": stats.model.split('/')[-1]}
+        for name, _, value in self.COUNTERS:
+            self._add(name, labels, value(stats))
+
+    def observe_event(self, kind: str, stage: Optional[str]):
+        self._add("events_total", {"event": kind, "stage": stage or "none"}, 1)
+
+    def observe_document(self, seconds: float, profile: str = "none", early_exit: bool = False):
+        labels = {"profile": profile}
+        self._add("documents_total", labels, 1)
+        self._add("document_seconds_total", labels, seconds)
+        if early_exit:
+            self._add("early_exits_total", labels, 1)
+
+    def observe_quality(self, document_type: str, passed: bool):
+        self._add("quality_checks_total", {"document_type": document_type,
+                                           "verdict": "pass" if passed else "issues"}, 1)
+
+    def to_prometheus(self) -> str:
+        """Render all counters in the Prometheus text exposition format"""
+        help_text = {name: text for name, text, _ in self.COUNTERS}
+        help_text.update({
+            "events_total": "Pipeline events such as parse failures",
+            "documents_total": "Documents processed",
+            "document_seconds_total": "End-to-end document processing time",
+            "early_exits_total": "Documents whose pipeline stopped early as low-value",
+            "quality_checks_total": "Sampled quality checks by verdict"
+        })
+        with self._lock:
+            values = sorted(self._values.items())
+
+        lines, described = [], set()
+        for (name, labels), value in values:
+            metric = f"{self.prefix}_{name}"
+            if metric not in described:
+                lines.append(f"# HELP {metric} {help_text.get(name, name)}")
+                lines.append(f"# TYPE {metric} counter")
+                described.add(metric)
+            label_text = ",".join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"{metric}{{{label_text}}} {value:.10g}" if label_text else f"{metric} {value:.10g}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,123 @@
+"""
+Terminal X AI - Background jobs
+In-process worker pool for document analyses, so Streamlit reruns only read job state and never
+block on, lose or re-trigger a running analysis
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job statuses after which nothing changes any more
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+class Job:
+    """One submitted analysis; written by its worker thread and read by any session's rerun"""
+
+    def __init__(self, job_id: str, title: str):
+        self.id = job_id
+        self.title = title
+        self.status = 'queued'
+        # Stage name -> waiting/running/done/failed/skipped/cancelled, in pipeline order
+        self.stages: Dict[str, str] = {}
+        # Stage name -> text streamed so far
+        self.streams: Dict[str, str] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Checked between pipeline stages; stages already running are allowed to finish
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the job started (or ran for, once finished)"""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.time()) - self.started_at
+
+    def on_progress(self, stage: str, status: str):
+        self.stages[stage] = status
+
+    def on_stream(self, stage: str, text: str):
+        self.streams[stage] = text
+
+class JobQueue:
+    """Runs submitted jobs on a shared thread pool and keeps the most recent ones for lookup"""
+
+    def __init__(self, max_workers: int = 4, keep_finished: int = 200):
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, run: Callable[[Job], Any], title: str = "") -> Job:
+        """Queue run(job); its return value becomes job.result"""
+        job = Job(uuid.uuid4().hex[:12], title)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, run)
+        return job
+
+    def _run(self, job: Job, run: Callable[[Job], Any]):
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = run(job)
+            job.status = 'cancelled' if job.cancel_event.is_set() else 'done'
+        except Exception as e:
+            # Nobody waits on the future, so the failure is recorded on the job instead
+            logger.exception("Job %s failed", job.id)
+            job.error = f"{type(e).__name__}: {e}"
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond keep_finished"""
+        finished = [job for job in self._jobs.values() if job.finished]
+        for job in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id) if job_id else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job, or stop a running one before its next stage; False if already finished"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = 'cancelled'
+            job.finished_at = time.time()
+        return True
+
+    def jobs(self) -> List[Job]:
+        """All retained jobs, oldest first"""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def active(self) -> int:
+        """Jobs queued or running"""
+        return sum(not job.finished for job in self.jobs())
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
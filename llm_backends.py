@@ -0,0 +1,302 @@
+"""
+Terminal X AI - LLM backends
+GeminiClient talks to a backend; GeminiBackend calls the real API, StubBackend answers offline
+"""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from gemini_client import (ContentFilteredError, ContextExpiredError, GeminiError, RateLimitError,
+                           ServiceUnavailableError, estimate_tokens, response_text)
+
+class LLMBackend(ABC):
+    """Interface for text generation backends used by GeminiClient; subclasses implement generate"""
+    model_name = "unknown"
+
+    @abstractmethod
+    def generate(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+                 context: Optional[str] = None) -> str:
+        """Return the response text for prompt, raising on failure
+
+        If usage is given, backends that know their token counts store them under
+        'prompt_tokens', 'response_tokens' and, for tokens served from a context cache,
+        'cached_tokens'. context is a reference returned by create_context; prompt follows on
+        from the cached text.
+        """
+
+    def generate_stream(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                        timeout: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+                        context: Optional[str] = None) -> Iterator[str]:
+        """Yield the response text incrementally; backends without streaming yield it in one piece"""
+        yield self.generate(prompt, generation_config=generation_config, timeout=timeout, usage=usage,
+                            context=context)
+
+    def create_context(self, text: str, ttl_seconds: float, timeout: Optional[float] = None) -> Optional[str]:
+        """Upload text to the provider's context cache and return a reference to it
+
+        The reference is valid for ttl_seconds. Backends without context caching return None, and
+        callers then send the text with every prompt instead.
+        """
+        return None
+
+def _record_usage(usage: Optional[Dict[str, int]], metadata):
+    if usage is not None and metadata is not None:
+        usage['prompt_tokens'] = getattr(metadata, 'prompt_token_count', 0)
+        usage['response_tokens'] = getattr(metadata, 'candidates_token_count', 0)
+        # Implicit prefix caching reports here too, not only explicit cached contents
+        usage['cached_tokens'] = getattr(metadata, 'cached_content_token_count', 0) or 0
+
+class GeminiBackend(LLMBackend):
+    """Google Gemini via google-generativeai"""
+
+    # Smallest context the API accepts for explicit caching, by model prefix
+    MIN_CONTEXT_TOKENS = {
+        'gemini-2.5-pro': 4096,
+        'gemini-2.5-flash': 1024,
+        'gemini-1.5': 32768
+    }
+
+    def __init__(self, api_key: str, model_name: str = 'gemini-2.5-pro'):
+        # Imported here rather than at module level: the SDK pulls in gRPC and protobuf,
+        # which dominates cold start
+        import google.generativeai as genai
+
+        # Configure Gemini
+        genai.configure(api_key=api_key)
+
+        # Creating the model object makes no request, so availability is only known from the first
+        # call: an unknown model raises ModelNotFoundError there (see model_router for failover)
+        self.model = genai.GenerativeModel(model_name)
+        self.model_name = model_name
+        # Cached context reference -> model bound to it
+        self._context_models: Dict[str, Any] = {}
+        self._context_lock = threading.Lock()
+
+    def create_context(self, text: str, ttl_seconds: float, timeout: Optional[float] = None) -> Optional[str]:
+        minimum = next((tokens for prefix, tokens in self.MIN_CONTEXT_TOKENS.items()
+                        if self.model_name.startswith(prefix)), None)
+        if minimum is None or estimate_tokens(text) < minimum:
+            return None
+        import datetime
+        from google.generativeai import caching
+
+        cache = caching.CachedContent.create(model=f"models/{self.model_name}", contents=[text],
+                                             ttl=datetime.timedelta(seconds=ttl_seconds))
+        return cache.name
+
+    def _model_for(self, context: Optional[str]):
+        if context is None:
+            return self.model
+        with self._context_lock:
+            if context not in self._context_models:
+                import google.generativeai as genai
+                from google.generativeai import caching
+
+                self._context_models[context] = genai.GenerativeModel.from_cached_content(
+                    cached_content=caching.CachedContent.get(context))
+                # Expired contexts are never asked for again; keep only the most recent ones
+                if len(self._context_models) > 64:
+                    self._context_models.pop(next(iter(self._context_models)))
+            return self._context_models[context]
+
+    def generate(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+                 context: Optional[str] = None) -> str:
+        request_options = {"timeout": timeout} if timeout is not None else None
+        response = self._model_for(context).generate_content(prompt, generation_config=generation_config,
+                                                             request_options=request_options)
+        _record_usage(usage, getattr(response, 'usage_metadata', None))
+        return response_text(response)
+
+    def generate_stream(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                        timeout: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+                        context: Optional[str] = None) -> Iterator[str]:
+        request_options = {"timeout": timeout} if timeout is not None else None
+        response = self._model_for(context).generate_content(prompt, generation_config=generation_config,
+                                                             request_options=request_options, stream=True)
+        for chunk in response:
+            try:
+                text = response_text(chunk)
+            except ContentFilteredError:
+                raise
+            except GeminiError:
+                # Chunks without parts, e.g. a trailing usage-only chunk
+                text = ""
+            _record_usage(usage, getattr(chunk, 'usage_metadata', None))
+            if text:
+                yield text
+
+class StubBackend(LLMBackend):
+    """Deterministic offline backend with canned, schema-valid responses
+
+    Latency, failure and malformed-output rates are configurable so pipeline performance can be
+    measured without an API key or network. The same seed always produces the same sequence.
+    """
+
+    METRICS = {
+        "revenue": "$89.5 billion",
+        "net_income": "$22.9 billion",
+        "eps": "$1.46",
+        "pe_ratio": "28.5x",
+        "roe": "147.3%",
+        "debt_to_equity": "1.56",
+        "growth_rate": "8%",
+        "target_price": "$220",
+        "recommendation": "POSITIVE"
+    }
+    RISKS = {
+        "market_risks": ["Intense competition in smartphone market"],
+        "operational_risks": ["Supply chain disruptions"],
+        "financial_risks": ["Economic downturn impact on consumer spending"],
+        "regulatory_risks": ["Regulatory scrutiny"],
+        "overall_risk_level": "MEDIUM"
+    }
+    THESIS = {
+        "investment_thesis": "Services growth and a loyal installed base support durable earnings growth.",
+        "key_drivers": ["Services growth", "iPhone upgrade cycle"],
+        "competitive_advantages": ["Ecosystem lock-in", "Brand strength"],
+        "valuation_analysis": "Trades at a premium multiple justified by margin stability.",
+        "investment_recommendation": "POSITIVE - strong fundamentals at a reasonable premium"
+    }
+    COMPARISON = {
+        "financial_comparison": {
+            "revenue_growth": "A grows faster than B",
+            "profitability": "A has higher margins than B",
+            "valuation": "B trades at a lower multiple than A"
+        },
+        "competitive_position": "A has the stronger moat",
+        "investment_preference": "A, for higher quality earnings"
+    }
+    SUMMARY = ("EXECUTIVE SUMMARY\nThe company shows solid growth with manageable risks.\n\n"
+               "KEY FINDINGS\n- Revenue and earnings growing\n- Medium overall risk\n\n"
+               "RECOMMENDATION\nPOSITIVE - fundamentals support the current valuation.")
+    PORTFOLIO = ("The top-ranked companies combine growth with reasonable valuations; "
+                 "lower-ranked names trade at higher multiples or carry more risk.")
+    ANSWER = "According to the document, revenue was $89.5 billion, up 8% year over year."
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, seed: int = 0, model_name: str = "stub",
+                 context_cache: bool = True):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.model_name = model_name
+        # With context_cache=False the backend behaves like one without provider caching
+        self.context_cache = context_cache
+        self._contexts: Dict[str, str] = {}
+        self._context_ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create_context(self, text: str, ttl_seconds: float, timeout: Optional[float] = None) -> Optional[str]:
+        """In-memory context cache; contexts live until expire_contexts() rather than for ttl_seconds"""
+        if not self.context_cache:
+            return None
+        with self._lock:
+            name = f"cachedContents/stub-{next(self._context_ids)}"
+            self._contexts[name] = text
+        return name
+
+    def expire_contexts(self):
+        """Forget every cached context, as if their TTLs had passed"""
+        with self._lock:
+            self._contexts = {}
+
+    def _in_context(self, prompt: str, context: Optional[str], usage: Optional[Dict[str, int]]) -> str:
+        """The full prompt a cached context stands for, reporting its tokens as cached"""
+        if context is None:
+            return prompt
+        with self._lock:
+            text = self._contexts.get(context)
+        if text is None:
+            raise ContextExpiredError(f"CachedContent not found: {context}")
+        if usage is not None:
+            usage['prompt_tokens'] = estimate_tokens(text) + estimate_tokens(prompt)
+            usage['cached_tokens'] = estimate_tokens(text)
+        return text + "\n\n" + prompt
+
+    def _classify(self, prompt: str) -> str:
+        # Only look at the document itself; the category list in the prompt mentions every label
+        document = prompt.split("Document:", 1)[-1].upper()
+        if not re.search(r"\$|%|REVENUE|EARNINGS|VALUATION", document):
+            return "other"
+        if "EARNINGS" in document or re.search(r"\bQ[1-4]\b", document):
+            return "quarterly_report"
+        if "PROJECTION" in document or "FORECAST" in document:
+            return "financial_model"
+        return "investment_memo"
+
+    def _canned(self, prompt: str, generation_config: Optional[Dict[str, Any]]) -> str:
+        """Pick the response for whichever prompt template produced this prompt"""
+        if generation_config and generation_config.get("response_schema"):
+            return json.dumps({"metrics": self.METRICS, "risks": self.RISKS, "thesis": self.THESIS})
+        # Q&A prompts embed the whole document and earlier analysis, so they are matched first
+        if "follow-up question" in prompt:
+            return self.ANSWER
+        if "financial document classifier" in prompt:
+            return self._classify(prompt)
+        # Quality and summary prompts embed earlier results, so match them before the document stages
+        if "quality assurance expert" in prompt:
+            return "PASS"
+        if "executive summary specialist" in prompt:
+            return self.SUMMARY
+        if "portfolio strategist" in prompt:
+            return self.PORTFOLIO
+        if "comparative analysis expert" in prompt:
+            return json.dumps(self.COMPARISON)
+        if "Extract key financial metrics" in prompt:
+            return json.dumps(self.METRICS)
+        if "risk management expert" in prompt:
+            return "```json\n" + json.dumps(self.RISKS, indent=2) + "\n```"
+        if "investment thesis" in prompt:
+            return json.dumps(self.THESIS)
+        return "Analysis complete."
+
+    def _respond(self, prompt: str, generation_config: Optional[Dict[str, Any]],
+                 timeout: Optional[float], first_share: float) -> Tuple[str, float]:
+        """Draw this call's latency and faults, wait first_share of the latency and return
+        (text, latency still to spend)"""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fail = self._random.random() < self.error_rate
+            malformed = self._random.random() < self.malformed_rate
+            rate_limited = self._random.random() < 0.5
+
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise ServiceUnavailableError("Stub backend timed out")
+        time.sleep(delay * first_share)
+
+        if fail:
+            raise (RateLimitError if rate_limited else ServiceUnavailableError)("Injected stub failure")
+        text = self._canned(prompt, generation_config)
+        if malformed and text.lstrip().startswith(("{", "```")):
+            # Prose with a truncated object: exercises the parse-failure fallbacks
+            text = "Here is my analysis of the document: " + text[:len(text) // 2]
+        return text, delay * (1 - first_share)
+
+    def generate(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+                 context: Optional[str] = None) -> str:
+        text, _ = self._respond(self._in_context(prompt, context, usage), generation_config, timeout,
+                                first_share=1.0)
+        return text
+
+    def generate_stream(self, prompt: str, generation_config: Optional[Dict[str, Any]] = None,
+                        timeout: Optional[float] = None, usage: Optional[Dict[str, int]] = None,
+                        context: Optional[str] = None) -> Iterator[str]:
+        """Same total latency as generate(), but the first piece arrives after a quarter of it"""
+        text, remaining = self._respond(self._in_context(prompt, context, usage), generation_config, timeout,
+                                        first_share=0.25)
+        pieces = [text[i:i + 40] for i in range(0, len(text), 40)]
+        for piece in pieces:
+            yield piece
+            time.sleep(remaining / len(pieces))
@@ -0,0 +1,133 @@
+"""
+Terminal X AI - Local document classifier
+Multinomial naive Bayes over word and bigram features of the first part of a document, so the
+common document types are labelled in milliseconds without a Gemini round-trip
+"""
+
+import glob
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Same window the LLM classifier sees
+CLASSIFY_CHARS = 2000
+
+# Seed vocabulary per label, so labels without training documents can still be recognized
+KEYWORD_PRIORS: Dict[str, List[str]] = {
+    'investment_memo': [
+        "investment memo", "investment thesis", "recommendation", "we recommend", "buy rating",
+        "sell rating", "hold rating", "price target", "analyst", "upside", "catalysts", "risks"
+    ],
+    'quarterly_report': [
+        "earnings report", "quarter", "quarterly", "q1", "q2", "q3", "q4", "eps", "yoy",
+        "guidance", "financial highlights", "segment performance", "fiscal", "earnings call"
+    ],
+    'financial_model': [
+        "financial model", "projection", "projections", "forecast", "base case", "bull case",
+        "bear case", "scenario", "assumptions", "dcf", "discount rate", "terminal value",
+        "wacc", "sensitivity"
+    ],
+    'pitch_deck': [
+        "pitch deck", "slide", "the problem", "our solution", "market opportunity", "traction",
+        "business model", "go to market", "the team", "the ask", "raising", "seed round",
+        "series a", "use of funds", "founders"
+    ],
+    'due_diligence': [
+        "due diligence", "diligence", "findings", "red flags", "legal review", "management interviews",
+        "customer references", "scope of review", "site visit", "background checks",
+        "material contracts", "litigation", "data room"
+    ]
+}
+
+# Weight of the keyword pseudo-document relative to one training document
+KEYWORD_WEIGHT = 3.0
+# Scales mean per-token log-likelihood gaps into posteriors; higher means more decisive
+SHARPNESS = 5.0
+# Distinct known tokens needed for full confidence; sparser text is shrunk toward uniform
+MIN_EVIDENCE = 12
+
+_TOKEN = re.compile(r"[a-z][a-z0-9&'\-]*")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word unigrams and bigrams"""
+    words = _TOKEN.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class LocalClassifier:
+    """Naive Bayes document-type classifier trained from labelled documents and keyword priors"""
+
+    def __init__(self, labels: Iterable[str], keyword_priors: Optional[Dict[str, List[str]]] = None,
+                 max_chars: int = CLASSIFY_CHARS, smoothing: float = 0.5):
+        self.labels = list(labels)
+        self.max_chars = max_chars
+        self.smoothing = smoothing
+        self._counts: Dict[str, Counter] = {label: Counter() for label in self.labels}
+        self._documents: Counter = Counter()
+        for label, phrases in (keyword_priors if keyword_priors is not None else KEYWORD_PRIORS).items():
+            if label in self._counts:
+                for phrase in phrases:
+                    for token in tokenize(phrase):
+                        self._counts[label][token] += KEYWORD_WEIGHT
+        self._finalize()
+
+    def train(self, documents: Iterable[Tuple[str, str]]) -> "LocalClassifier":
+        """Add (text, label) examples; unknown labels are ignored"""
+        for text, label in documents:
+            if label in self._counts:
+                self._counts[label].update(tokenize(text[:self.max_chars]))
+                self._documents[label] += 1
+        self._finalize()
+        return self
+
+    def _finalize(self):
+        self._vocabulary = set().union(*self._counts.values())
+        self._totals = {label: sum(counts.values()) for label, counts in self._counts.items()}
+        # Uniform prior: the sample set says nothing about the real label mix
+        self._log_prior = -math.log(len(self.labels)) if self.labels else 0.0
+
+    @property
+    def trained_labels(self) -> List[str]:
+        return [label for label in self.labels if self._documents[label]]
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Posterior probability per label"""
+        tokens = [token for token in tokenize(text[:self.max_chars]) if token in self._vocabulary]
+        if not tokens or not self.labels:
+            return {label: 1 / len(self.labels) for label in self.labels} if self.labels else {}
+
+        size = len(self._vocabulary)
+        log_likelihood = {}
+        for label in self.labels:
+            counts, denominator = self._counts[label], self._totals[label] + self.smoothing * size
+            total = sum(math.log((counts[token] + self.smoothing) / denominator) for token in tokens)
+            # Average per token so confidence does not saturate on long inputs
+            log_likelihood[label] = self._log_prior + total / len(tokens)
+
+        best = max(log_likelihood.values())
+        weights = {label: math.exp(SHARPNESS * (value - best)) for label, value in log_likelihood.items()}
+        norm = sum(weights.values())
+        evidence = min(1.0, len(set(tokens)) / MIN_EVIDENCE)
+        uniform = 1 / len(self.labels)
+        return {label: evidence * weight / norm + (1 - evidence) * uniform for label, weight in weights.items()}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """Most likely label and its probability"""
+        scores = self.scores(text)
+        label = max(scores, key=scores.get)
+        return label, scores[label]
+
+    @classmethod
+    def from_directory(cls, path: str, labels: Iterable[str], pattern: str = "*.txt") -> "LocalClassifier":
+        """Train from files labelled by their subdirectory (path/<label>/x.txt) or file stem (path/<label>.txt)"""
+        classifier = cls(labels)
+        examples = []
+        for file_path in sorted(glob.glob(os.path.join(path, "**", pattern), recursive=True)):
+            parent = os.path.basename(os.path.dirname(file_path))
+            stem = os.path.splitext(os.path.basename(file_path))[0]
+            label = parent if parent in classifier._counts else stem
+            if label in classifier._counts:
+                with open(file_path, "r", errors="replace") as f:
+                    examples.append((f.read(), label))
+        return classifier.train(examples)
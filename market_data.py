@@ -0,0 +1,330 @@
+"""
+Terminal X AI - Market data
+Daily OHLCV bars stored one column per append-only binary file, loaded as memory-mapped numpy arrays,
+refreshed incrementally through a pluggable fetcher, with vectorized return, volatility and drawdown
+indicators for the thesis stage
+"""
+
+import argparse
+import importlib.util
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+DEFAULT_MARKET_DATA_DIR = os.path.join("data", "cache", "market")
+# JSON fixtures of {ticker: {column: {date: value}}}, as written by pandas' DataFrame.to_json
+DEFAULT_FIXTURE_PATHS = [os.path.join("data", "raw", "market_data.json"),
+                         os.path.join("data", "raw", "stock_data.json")]
+
+# Stored columns and their on-disk dtypes; 'date' is written last, so its length marks complete rows
+COLUMNS = {
+    'open': np.dtype('float64'),
+    'high': np.dtype('float64'),
+    'low': np.dtype('float64'),
+    'close': np.dtype('float64'),
+    'adj_close': np.dtype('float64'),
+    'volume': np.dtype('float64'),
+    'date': np.dtype('datetime64[D]')
+}
+# Column names used by yfinance and the JSON fixtures
+SOURCE_COLUMNS = {'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close',
+                  'Adj Close': 'adj_close', 'Volume': 'volume'}
+
+TRADING_DAYS = 252
+# A ticker is asked for new bars at most once per interval unless a refresh is forced
+REFRESH_INTERVAL = 3600
+
+Bars = Dict[str, np.ndarray]
+
+class MarketDataError(RuntimeError):
+    """Bars could not be fetched"""
+
+def empty_bars() -> Bars:
+    return {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}
+
+def make_bars(dates: Iterable[Any], columns: Dict[str, Iterable[Any]]) -> Bars:
+    """Bars sorted by date from a date sequence and same-length value columns (missing columns are NaN)"""
+    days = np.asarray(list(dates), dtype='datetime64[D]')
+    order = np.argsort(days, kind='stable')
+    bars = {'date': days[order]}
+    for column, dtype in COLUMNS.items():
+        if column != 'date':
+            values = columns.get(column)
+            bars[column] = (np.full(len(days), np.nan) if values is None
+                            else np.asarray(list(values), dtype=dtype))[order]
+    return bars
+
+def _slice(bars: Bars, start: Optional[date], end: Optional[date]) -> Bars:
+    """Bars with start <= date < end"""
+    mask = np.ones(len(bars['date']), dtype=bool)
+    if start is not None:
+        mask &= bars['date'] >= np.datetime64(start, 'D')
+    if end is not None:
+        mask &= bars['date'] < np.datetime64(end, 'D')
+    return {column: values[mask] for column, values in bars.items()}
+
+class FixtureFetcher:
+    """Bars from local JSON fixtures, for offline use and tests"""
+
+    def __init__(self, paths: Optional[List[str]] = None):
+        self.paths = paths if paths is not None else DEFAULT_FIXTURE_PATHS
+        self._bars: Optional[Dict[str, Bars]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse_dates(keys: List[str]) -> np.ndarray:
+        # pandas writes epoch milliseconds by default and ISO strings with date_format='iso'
+        if all(key.lstrip('-').isdigit() for key in keys):
+            return np.asarray([int(key) for key in keys], dtype='datetime64[ms]').astype('datetime64[D]')
+        return np.asarray([key[:10] for key in keys], dtype='datetime64[D]')
+
+    def _load(self) -> Dict[str, Bars]:
+        with self._lock:
+            if self._bars is None:
+                self._bars = {}
+                for path in self.paths:
+                    if not os.path.exists(path):
+                        continue
+                    with open(path, "r") as f:
+                        data = json.load(f)
+                    for ticker, columns in data.items():
+                        keys = sorted(set().union(*(values.keys() for values in columns.values()))) if columns else []
+                        if not keys or ticker.upper() in self._bars:
+                            # Placeholder entries without bars; the first file listing a ticker wins
+                            continue
+                        # Missing and null values become NaN
+                        self._bars[ticker.upper()] = make_bars(self._parse_dates(keys), {
+                            SOURCE_COLUMNS[name]: [values.get(key) for key in keys]
+                            for name, values in columns.items() if name in SOURCE_COLUMNS
+                        })
+            return self._bars
+
+    def fetch(self, ticker: str, start: Optional[date] = None, end: Optional[date] = None) -> Bars:
+        bars = self._load().get(ticker.upper())
+        return _slice(bars, start, end) if bars is not None else empty_bars()
+
+class YFinanceFetcher:
+    """Daily bars from Yahoo Finance via yfinance"""
+
+    def fetch(self, ticker: str, start: Optional[date] = None, end: Optional[date] = None) -> Bars:
+        # Optional dependency, imported on first fetch because it is slow to import
+        import yfinance as yf
+
+        try:
+            frame = yf.download(ticker, start=start, end=end, interval="1d", auto_adjust=False,
+                                actions=False, progress=False, threads=False)
+        except Exception as e:
+            raise MarketDataError(f"Could not download {ticker}: {e}") from e
+        if frame is None or frame.empty:
+            return empty_bars()
+        if frame.columns.nlevels > 1:
+            # Recent yfinance versions return (field, ticker) columns even for one ticker
+            frame.columns = frame.columns.get_level_values(0)
+        return make_bars(frame.index.values.astype('datetime64[D]'), {
+            column: frame[name].to_numpy(dtype=float) for name, column in SOURCE_COLUMNS.items()
+            if name in frame.columns
+        })
+
+def default_fetcher():
+    """yfinance when installed, otherwise the local fixtures"""
+    return YFinanceFetcher() if importlib.util.find_spec("yfinance") else FixtureFetcher()
+
+class MarketDataStore:
+    """Per-ticker OHLCV columns on disk, appended to as new bars arrive
+
+    Each ticker is a directory with one raw binary file per column. Appends only ever add rows
+    after the last stored date, and loading is a memory map per column, so reading years of
+    history costs no parsing.
+    """
+
+    def __init__(self, directory: str = DEFAULT_MARKET_DATA_DIR, fetcher=None,
+                 refresh_interval: float = REFRESH_INTERVAL):
+        self.directory = directory
+        self.fetcher = fetcher if fetcher is not None else default_fetcher()
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _ticker_dir(self, ticker: str) -> str:
+        # Tickers such as ^GSPC or BRK/B are not valid file names as-is
+        return os.path.join(self.directory, quote(ticker.upper(), safe=""))
+
+    def tickers(self) -> List[str]:
+        """Tickers with stored bars"""
+        return sorted(unquote(name) for name in os.listdir(self.directory)
+                      if os.path.exists(os.path.join(self.directory, name, "date.bin")))
+
+    @staticmethod
+    def _map(path: str, dtype: np.dtype, rows: int) -> np.ndarray:
+        with open(path, "rb") as f:
+            # The mapping stays valid after the file is closed
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(buffer, dtype=dtype, count=rows)
+
+    def load(self, ticker: str) -> Bars:
+        """Read-only memory-mapped columns for ticker (empty if nothing is stored)"""
+        directory = self._ticker_dir(ticker)
+        paths = {column: os.path.join(directory, f"{column}.bin") for column in COLUMNS}
+        try:
+            sizes = {column: os.path.getsize(path) for column, path in paths.items()}
+        except OSError:
+            return empty_bars()
+        # A crash mid-append can leave some columns longer; only rows present in all are used
+        rows = min(size // COLUMNS[column].itemsize for column, size in sizes.items())
+        if rows == 0:
+            return empty_bars()
+        return {column: self._map(path, COLUMNS[column], rows) for column, path in paths.items()}
+
+    def last_date(self, ticker: str) -> Optional[date]:
+        dates = self.load(ticker)['date']
+        return dates[-1].item() if len(dates) else None
+
+    def append(self, ticker: str, bars: Bars) -> int:
+        """Store bars dated after the last stored bar; returns the number of rows added"""
+        with self._lock:
+            existing = self.load(ticker)['date']
+            if len(existing):
+                bars = {column: values[bars['date'] > existing[-1]] for column, values in bars.items()}
+            rows = len(bars['date'])
+            if rows == 0:
+                return 0
+
+            directory = self._ticker_dir(ticker)
+            os.makedirs(directory, exist_ok=True)
+            if not len(existing):
+                # Drop any partial rows left behind by an interrupted first write
+                for column in COLUMNS:
+                    open(os.path.join(directory, f"{column}.bin"), "wb").close()
+            for column, dtype in COLUMNS.items():
+                with open(os.path.join(directory, f"{column}.bin"), "ab") as f:
+                    np.ascontiguousarray(bars[column], dtype=dtype).tofile(f)
+            return rows
+
+    def refresh(self, ticker: str, end: Optional[date] = None, force: bool = False) -> int:
+        """Fetch only the bars after the last stored date, up to end (exclusive); returns the number of new rows
+
+        end is at most today: today's bar is still changing during market hours, and once stored it
+        would never be corrected, since appends only add later dates.
+        """
+        marker = os.path.join(self._ticker_dir(ticker), ".checked")
+        if not force and os.path.exists(marker) and time.time() - os.path.getmtime(marker) < self.refresh_interval:
+            return 0
+
+        end = min(end, date.today()) if end is not None else date.today()
+        last = self.last_date(ticker)
+        start = last + timedelta(days=1) if last is not None else None
+        if start is not None and start >= end:
+            return 0
+        bars = self.fetcher.fetch(ticker, start, end)
+        # Fetchers may include a bar on end itself
+        added = self.append(ticker, _slice(bars, None, end))
+
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        with open(marker, "w"):
+            pass
+        return added
+
+    def frame(self, ticker: str):
+        """Bars as a pandas DataFrame indexed by date"""
+        import pandas as pd
+        bars = self.load(ticker)
+        return pd.DataFrame({column: np.asarray(bars[column]) for column in COLUMNS if column != 'date'},
+                            index=pd.DatetimeIndex(np.asarray(bars['date']), name='date'))
+
+def daily_returns(prices: np.ndarray) -> np.ndarray:
+    return prices[1:] / prices[:-1] - 1
+
+def drawdowns(prices: np.ndarray) -> np.ndarray:
+    """Fall from the running peak at each bar (0 at a new high, -0.2 when 20% below it)"""
+    return prices / np.maximum.accumulate(prices) - 1
+
+def rolling_volatility(prices: np.ndarray, window: int = 21) -> np.ndarray:
+    """Annualized volatility of log returns over each trailing window, from cumulative sums"""
+    returns = np.diff(np.log(prices))
+    if len(returns) < window:
+        return np.empty(0)
+    sums = np.concatenate(([0.0], np.cumsum(returns)))
+    squares = np.concatenate(([0.0], np.cumsum(returns ** 2)))
+    total, total_sq = sums[window:] - sums[:-window], squares[window:] - squares[:-window]
+    variance = np.maximum(total_sq - total ** 2 / window, 0) / (window - 1)
+    return np.sqrt(variance * TRADING_DAYS)
+
+def price_indicators(bars: Bars) -> Optional[Dict[str, Any]]:
+    """Trailing returns, volatility, drawdowns and 52-week range from daily bars (None without prices)"""
+    prices = np.asarray(bars['adj_close'], dtype=float)
+    if np.isnan(prices).all():
+        prices = np.asarray(bars['close'], dtype=float)
+    valid = ~np.isnan(prices) & (prices > 0)
+    prices, dates = prices[valid], np.asarray(bars['date'])[valid]
+    if len(prices) < 2:
+        return None
+
+    def trailing_return(days: int) -> Optional[float]:
+        return round(float(prices[-1] / prices[-days - 1] - 1) * 100, 2) if len(prices) > days else None
+
+    def volatility(days: int) -> Optional[float]:
+        window = min(days, len(prices) - 1)
+        return round(float(rolling_volatility(prices[-window - 1:], window)[-1]) * 100, 2) if window > 1 else None
+
+    year = prices[-TRADING_DAYS:]
+    return {
+        "as_of": str(dates[-1]),
+        "last_price": round(float(prices[-1]), 4),
+        "return_1m_pct": trailing_return(21),
+        "return_3m_pct": trailing_return(63),
+        "return_1y_pct": trailing_return(TRADING_DAYS),
+        "volatility_3m_pct": volatility(63),
+        "volatility_1y_pct": volatility(TRADING_DAYS),
+        "max_drawdown_1y_pct": round(float(drawdowns(year).min()) * 100, 2),
+        "drawdown_from_high_pct": round(float(drawdowns(year)[-1]) * 100, 2),
+        "high_52w": round(float(year.max()), 4),
+        "low_52w": round(float(year.min()), 4),
+        "bars": int(len(prices))
+    }
+
+def format_price_context(ticker: str, indicators: Dict[str, Any]) -> str:
+    """Indicators as short text lines for a prompt"""
+    def pct(value: Optional[float], sign: str = "+") -> str:
+        return "n/a" if value is None else f"{value:{sign}.1f}%"
+
+    return "\n".join([
+        f"{ticker.upper()} last price {indicators['last_price']:g} as of {indicators['as_of']}",
+        f"Returns: 1M {pct(indicators['return_1m_pct'])}, 3M {pct(indicators['return_3m_pct'])}, "
+        f"1Y {pct(indicators['return_1y_pct'])}",
+        f"Annualized volatility: 3M {pct(indicators['volatility_3m_pct'], '')}, "
+        f"1Y {pct(indicators['volatility_1y_pct'], '')}",
+        f"52-week range {indicators['low_52w']:g}-{indicators['high_52w']:g}; "
+        f"{pct(indicators['drawdown_from_high_pct'], '')} from high, "
+        f"max drawdown {pct(indicators['max_drawdown_1y_pct'], '')}"
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the local market data cache and print price indicators")
+    parser.add_argument("tickers", nargs="*", help="Tickers to refresh (default: every stored ticker)")
+    parser.add_argument("--directory", default=DEFAULT_MARKET_DATA_DIR, help="Market data cache directory")
+    parser.add_argument("--fixtures", action="store_true", help="Read bars from the JSON fixtures instead of yfinance")
+    parser.add_argument("--force", action="store_true", help="Fetch even if the ticker was checked recently")
+    args = parser.parse_args()
+
+    store = MarketDataStore(args.directory, fetcher=FixtureFetcher() if args.fixtures else None)
+    for ticker in args.tickers or store.tickers():
+        try:
+            added = store.refresh(ticker, force=args.force)
+        except MarketDataError as e:
+            print(f"❌ {ticker}: {e}", file=sys.stderr)
+            continue
+        indicators = price_indicators(store.load(ticker))
+        print(f"{ticker}: {added} new bars")
+        if indicators:
+            print(format_price_context(ticker, indicators))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Terminal X AI - Deterministic metric extraction
+Pulls headline metrics written as "Label: value" lines, table rows and a few fixed phrasings straight
+from the document, normalizing units and recording the character span each value came from
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+METRIC_FIELDS = ['revenue', 'net_income', 'eps', 'pe_ratio', 'roe', 'debt_to_equity',
+                 'growth_rate', 'target_price', 'recommendation']
+
+# Row labels per field, matched at the start of a line (after any bullet)
+_LABELS = {
+    'revenue': r"(?:total\s+)?(?:net\s+)?(?:revenues?|sales)",
+    'net_income': r"net\s+(?:income|earnings|profit)",
+    'eps': r"(?:diluted\s+|basic\s+)?(?:eps|earnings\s+per\s+(?:diluted\s+)?share)",
+    'pe_ratio': r"(?:p\s*/\s*e|price[\s-]+to[\s-]+earnings)(?:\s+ratio)?",
+    'roe': r"roe|return\s+on\s+(?:average\s+)?(?:shareholders'?\s+)?equity",
+    'debt_to_equity': r"debt[\s-]+to[\s-]+equity(?:\s+ratio)?|d\s*/\s*e(?:\s+ratio)?",
+    'growth_rate': r"(?:revenue\s+|sales\s+)?growth(?:\s+rate)?",
+    'target_price': r"(?:12[\s-]+month\s+)?(?:price\s+target|target\s+price)",
+    'recommendation': r"recommendation|rating"
+}
+
+# Kind of value each field accepts: money, percent, ratio, per_share or rating
+_KINDS = {
+    'revenue': 'money', 'net_income': 'money', 'eps': 'per_share', 'pe_ratio': 'ratio',
+    'roe': 'percent', 'debt_to_equity': 'ratio', 'growth_rate': 'percent',
+    'target_price': 'per_share', 'recommendation': 'rating'
+}
+
+_MULTIPLIERS = {
+    'thousand': 1e3, 'k': 1e3,
+    'million': 1e6, 'mn': 1e6, 'mm': 1e6, 'm': 1e6,
+    'billion': 1e9, 'bn': 1e9, 'b': 1e9,
+    'trillion': 1e12, 'tn': 1e12, 't': 1e12
+}
+
+_RATINGS = {
+    'POSITIVE': ["STRONG BUY", "BUY", "OUTPERFORM", "OVERWEIGHT", "ACCUMULATE", "POSITIVE"],
+    'NEUTRAL': ["HOLD", "NEUTRAL", "MARKET PERFORM", "EQUAL WEIGHT", "EQUAL-WEIGHT"],
+    'NEGATIVE': ["STRONG SELL", "SELL", "UNDERPERFORM", "UNDERWEIGHT", "REDUCE", "NEGATIVE"]
+}
+
+_CURRENCIES = {'$': 'USD', '€': 'EUR', '£': 'GBP'}
+
+# A number with optional currency (symbol or ISO code) and unit. A minus before the currency or
+# accounting parentheses, around the whole amount ("($120 million)") or the number ("$(0.12)"),
+# make it negative; a parenthesis only counts when it is closed
+_VALUE = re.compile(
+    r"(?P<outer>\()?\s?(?P<minus>[-−])?\s?(?P<currency>[$€£]|\b(?:USD|EUR|GBP)\b)?\s?(?P<inner>\()?"
+    r"(?P<number>-?\d[\d,]*(?:\.\d+)?)(?(inner)\))"
+    r"(?:\s?(?P<unit>trillion|billion|million|thousand|bn|mn|mm|tn|[kmbt](?![a-z])|%|x(?![a-z])))?"
+    r"(?:\s(?P<code>USD|EUR|GBP)\b)?(?(outer)\s?\))",
+    re.IGNORECASE
+)
+_RATING = re.compile(r"\b(" + "|".join(sorted((r for rs in _RATINGS.values() for r in rs), key=len, reverse=True))
+                     + r")\b", re.IGNORECASE)
+# "Label: value", "Label (TTM): value", "Label | value", "Label<tab>value" or "Label ..... value"
+_ROW = re.compile(r"^[\s\-*•|]*(?P<label>[A-Za-z][A-Za-z0-9/&'\s\-]*?)\s*(?:\([^)]*\))?\s*(?::|\||\t|\s{2,}|\.{3,})\s*(?P<rest>.+)$")
+_UNIT_HINT = re.compile(r"\(\s*(?:in\s+|\$\s*)?(thousands|millions|billions|trillions)\b", re.IGNORECASE)
+# Headings of forward-looking sections; their rows are estimates, not reported figures
+_FORWARD_LOOKING = re.compile(r"guidance|projection|forecast|outlook|estimate|assumption", re.IGNORECASE)
+_PROSE = {
+    'target_price': re.compile(r"(?:price\s+target|target\s+price)\s+(?:of\s+|is\s+|at\s+)?(?=(?:[$€£]|(?:USD|EUR|GBP)\s)?\d)", re.IGNORECASE),
+    'recommendation': re.compile(r"\b(?:recommend(?:s|ed)?|rate[sd]?|reiterate[sd]?)\s+(?:a\s+|an\s+|the\s+)?(?=[A-Za-z])", re.IGNORECASE),
+    'growth_rate': re.compile(r"^\s*(?:total\s+|net\s+)?revenues?\b[^\n]*?(?=-?\d[\d.]*\s?%\s*(?:yoy|y/y|year[\s-]over[\s-]year)\b)",
+                              re.IGNORECASE | re.MULTILINE)
+}
+_LABEL_PATTERNS = {field: re.compile(rf"^(?:{pattern})$", re.IGNORECASE) for field, pattern in _LABELS.items()}
+
+class ExtractedMetric:
+    """One value found in the document, with its normalized form and where it came from"""
+
+    def __init__(self, field: str, text: str, value: Any, unit: Optional[str], span: Tuple[int, int]):
+        self.field = field
+        self.text = text
+        self.value = value
+        self.unit = unit
+        self.span = span
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": "local",
+            "text": self.text,
+            "value": self.value,
+            "unit": self.unit,
+            "span": list(self.span)
+        }
+
+def _number(match: "re.Match") -> float:
+    """Signed value of a _VALUE match, before any unit"""
+    number = float(match.group('number').replace(',', ''))
+    negative = match.group('minus') or match.group('outer') or match.group('inner')
+    return -abs(number) if negative else number
+
+def _currency(match: "re.Match") -> Optional[str]:
+    """ISO code of the currency written with a _VALUE match, or None"""
+    currency = match.group('currency') or match.group('code')
+    return _CURRENCIES.get(currency, currency.upper()) if currency else None
+
+def _parse_value(match: "re.Match", kind: str, scale: float) -> Optional[Tuple[Any, Optional[str]]]:
+    """Normalized (value, unit) for a matched number, or None if it is the wrong kind for the field
+
+    Amounts are in the currency they were written in, USD when none was.
+    """
+    number = _number(match)
+    unit = (match.group('unit') or '').lower()
+    currency = _currency(match)
+
+    if kind == 'percent':
+        return (number, 'percent') if unit == '%' else None
+    if kind == 'ratio':
+        return (number, 'ratio') if unit in ('', 'x') and not currency else None
+    if kind == 'per_share':
+        return (number, currency or 'USD') if unit in ('',) and (currency or abs(number) < 100000) else None
+    if kind == 'money':
+        if unit in ('%', 'x'):
+            return None
+        multiplier = _MULTIPLIERS.get(unit, scale if not unit else 1.0)
+        # A bare small number with no currency, unit or table scale is not an amount
+        if not currency and not unit and scale == 1.0:
+            return None
+        return (number * multiplier, currency or 'USD')
+    return None
+
+def _rating(text: str) -> Optional["re.Match"]:
+    return _RATING.search(text)
+
+def _normalize_rating(word: str) -> str:
+    upper = word.upper()
+    return next(label for label, words in _RATINGS.items() if upper in words)
+
+def _match_value(field: str, text: str, offset: int, scale: float) -> Optional[ExtractedMetric]:
+    """First value in text that fits field, as an ExtractedMetric with document offsets"""
+    if _KINDS[field] == 'rating':
+        match = _rating(text)
+        if match is None:
+            return None
+        return ExtractedMetric(field, _normalize_rating(match.group(1)), _normalize_rating(match.group(1)),
+                               'rating', (offset + match.start(1), offset + match.end(1)))
+
+    for match in _VALUE.finditer(text):
+        parsed = _parse_value(match, _KINDS[field], scale)
+        if parsed is not None:
+            start, end = match.span()
+            while text[start].isspace():
+                start += 1
+            return ExtractedMetric(field, text[start:end], parsed[0], parsed[1], (offset + start, offset + end))
+        # Only the value directly after the label counts; later numbers belong to commentary
+        if _KINDS[field] != 'percent':
+            return None
+    return None
+
+def parse_metric_value(field: str, text: Any) -> Optional[Any]:
+    """Normalized value of a metric given as text, e.g. "$89.5 billion" -> 89.5e9; None if unreadable
+    
+    Used for values that came from Gemini rather than from the document.
+    """
+    if text is None or field not in _KINDS:
+        return None
+    if isinstance(text, (int, float)) and not isinstance(text, bool):
+        return float(text)
+    if _KINDS[field] == 'money':
+        match = _VALUE.search(str(text))
+        if match is None:
+            return None
+        # Model answers are isolated values, so a bare number is read at face value
+        parsed = _parse_value(match, 'money', 1.0)
+        if parsed is None and not match.group('unit'):
+            parsed = (_number(match), 'USD')
+        return parsed[0] if parsed else None
+    metric = _match_value(field, str(text), 0, 1.0)
+    return metric.value if metric else None
+
+def _is_heading(line: str) -> bool:
+    """All-caps line (ignoring parentheticals such as "(in billions)") or a markdown heading"""
+    if line.startswith("#"):
+        return True
+    text = re.sub(r"\([^)]*\)", "", line).strip()
+    return bool(text) and text.upper() == text and any(c.isalpha() for c in text) and ":" not in text
+
+def _lines(document: str) -> List[Tuple[int, str]]:
+    """(offset, line) pairs"""
+    offset, lines = 0, []
+    for line in document.splitlines(keepends=True):
+        lines.append((offset, line.rstrip("\r\n")))
+        offset += len(line)
+    return lines
+
+def extract_metrics_locally(document: str, fields: Optional[List[str]] = None) -> Dict[str, ExtractedMetric]:
+    """Metrics stated explicitly in the document, keyed by field
+
+    Labelled rows win over prose; within each, the first occurrence in the document wins. Rows under
+    forward-looking headings (guidance, projections, ...) are skipped except for target price and
+    rating, and "(in millions)"-style headings scale bare amounts in the rows below them.
+    """
+    fields = [field for field in (fields or METRIC_FIELDS) if field in _LABELS]
+    found: Dict[str, ExtractedMetric] = {}
+    scale, forward_looking = 1.0, False
+
+    for offset, line in _lines(document):
+        stripped = line.strip()
+        if not stripped:
+            continue
+        hint = _UNIT_HINT.search(stripped)
+        if hint and stripped.startswith("("):
+            # "(in millions, except per share data)" on its own line under a heading
+            scale = _MULTIPLIERS[hint.group(1).lower()[:-1]]
+            continue
+        if _is_heading(stripped):
+            # Section heading: sets the context for the rows below it
+            scale = _MULTIPLIERS[hint.group(1).lower()[:-1]] if hint else 1.0
+            forward_looking = bool(_FORWARD_LOOKING.search(stripped))
+            continue
+        row = _ROW.match(line)
+        if row is None:
+            continue
+        label = " ".join(row.group('label').split())
+        for field in fields:
+            if field in found or not _LABEL_PATTERNS[field].match(label):
+                continue
+            if forward_looking and field not in ('target_price', 'recommendation'):
+                continue
+            rest_offset = offset + row.start('rest')
+            metric = _match_value(field, row.group('rest'), rest_offset, scale)
+            if metric is not None:
+                found[field] = metric
+            break
+
+    for field, pattern in _PROSE.items():
+        if field in fields and field not in found:
+            for match in pattern.finditer(document):
+                tail = document[match.end():match.end() + 80].split("\n", 1)[0]
+                metric = _match_value(field, tail, match.end(), 1.0)
+                if metric is not None:
+                    found[field] = metric
+                    break
+    return found
@@ -0,0 +1,344 @@
+"""
+Terminal X AI - Model routing
+Per-template model choice from a live health and latency table, failover to the next model, and hedged
+requests that race a backup model once a call runs past the primary model's observed p95 latency
+"""
+
+import contextvars
+import copy
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from gemini_client import (ContextExpiredError, GeminiClient, GeminiError, ModelNotFoundError, RateLimitError,
+                           ServiceUnavailableError)
+from instrumentation import record_call
+
+if TYPE_CHECKING:
+    from document_session import DocumentContext
+
+# Models per tier, preferred first; the others are failover and hedge targets
+MODEL_TIERS: Dict[str, List[str]] = {
+    'fast': ['gemini-2.5-flash', 'gemini-2.5-flash-lite', 'gemini-1.5-flash'],
+    'strong': ['gemini-2.5-pro', 'gemini-1.5-pro', 'gemini-2.5-flash']
+}
+# Prompt template -> tier. Short answers (a label, PASS or a list of issues) do not need a pro model
+TEMPLATE_TIERS: Dict[str, str] = {
+    'classifier': 'fast',
+    'quality_checker': 'fast',
+    'thesis_generator': 'strong',
+    'fused_analyzer': 'strong'
+}
+DEFAULT_TIER = 'strong'
+
+# Latest latencies kept per (model, template)
+LATENCY_WINDOW = 200
+# Samples needed before a p95 is trusted as a hedge trigger
+MIN_LATENCY_SAMPLES = 20
+HEDGE_PERCENTILE = 0.95
+# Hedges allowed as a share of routed calls, so a slow model cannot double the load on the quota
+HEDGE_BUDGET = 0.1
+# Calls a router expects to route at once unless told otherwise
+DEFAULT_CONCURRENCY = 16
+# Consecutive failures after which a model is skipped for UNHEALTHY_SECONDS
+FAILURE_THRESHOLD = 3
+UNHEALTHY_SECONDS = 60.0
+
+# Failures that say nothing about the request itself, so another model may well succeed
+_FAILOVER_ERRORS = (ModelNotFoundError, RateLimitError, ServiceUnavailableError)
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+class HealthTable:
+    """Per-model health and per-(model, template) latency, updated from every routed call"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._latencies: Dict[Tuple[str, str], Deque[float]] = {}
+        self._models: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model: str) -> Dict[str, Any]:
+        return self._models.setdefault(model, {"calls": 0, "errors": 0, "consecutive_failures": 0,
+                                               "unhealthy_until": 0.0, "last_error": None})
+
+    def record_success(self, model: str, template: Optional[str], seconds: float):
+        with self._lock:
+            health = self._model(model)
+            health["calls"] += 1
+            health["consecutive_failures"] = 0
+            health["unhealthy_until"] = 0.0
+            self._latencies.setdefault((model, template or ""), deque(maxlen=self.window)).append(seconds)
+
+    def record_failure(self, model: str, error: GeminiError):
+        with self._lock:
+            health = self._model(model)
+            health["calls"] += 1
+            health["errors"] += 1
+            health["consecutive_failures"] += 1
+            health["last_error"] = type(error).__name__
+            if isinstance(error, ModelNotFoundError):
+                # Not available to this key at all; no point asking again in this process
+                health["unhealthy_until"] = math.inf
+            elif health["consecutive_failures"] >= FAILURE_THRESHOLD:
+                health["unhealthy_until"] = time.monotonic() + UNHEALTHY_SECONDS
+
+    def available(self, model: str) -> bool:
+        with self._lock:
+            return self._model(model)["unhealthy_until"] <= time.monotonic()
+
+    def percentile(self, model: str, template: Optional[str], q: float,
+                   min_samples: int = MIN_LATENCY_SAMPLES) -> Optional[float]:
+        """Latency percentile for model on template, or None with too few samples"""
+        with self._lock:
+            samples = list(self._latencies.get((model, template or ""), ()))
+        return _percentile(samples, q) if len(samples) >= min_samples else None
+
+    def report(self) -> List[Dict[str, Any]]:
+        """One row per model: calls, errors, availability and latency percentiles over all templates"""
+        with self._lock:
+            models = {model: dict(health) for model, health in self._models.items()}
+            latencies: Dict[str, List[float]] = {}
+            for (model, _), samples in self._latencies.items():
+                latencies.setdefault(model, []).extend(samples)
+        now = time.monotonic()
+        return [{
+            "model": model,
+            "available": health["unhealthy_until"] <= now,
+            "calls": health["calls"],
+            "errors": health["errors"],
+            "last_error": health["last_error"],
+            "p50_seconds": round(_percentile(latencies[model], 0.5), 3) if latencies.get(model) else None,
+            "p95_seconds": round(_percentile(latencies[model], 0.95), 3) if latencies.get(model) else None
+        } for model, health in models.items()]
+
+class ModelRouter:
+    """Sends each call to the model routed for its prompt template through that model's GeminiClient
+
+    Unhealthy models are skipped, failures such as an unavailable model or exhausted quota fail over
+    to the next model in the route, and non-streaming calls still running at the primary model's p95
+    are hedged with a second request to the fastest healthy alternative; the first answer wins.
+    concurrency is how many calls may be routed at once, which sizes the threads hedged calls run on.
+    """
+
+    def __init__(self, clients: Dict[str, GeminiClient], routes: Optional[Dict[str, List[str]]] = None,
+                 default_route: Optional[List[str]] = None, hedging: bool = True,
+                 hedge_budget: float = HEDGE_BUDGET, concurrency: int = DEFAULT_CONCURRENCY):
+        self.clients = clients
+        self.routes = routes or {}
+        self.default_route = default_route or list(clients)
+        self.hedging = hedging
+        self.hedge_budget = hedge_budget
+        self.health = HealthTable()
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        # A hedged call runs its primary and backup requests here while the caller waits, so every
+        # call in flight needs two threads; fewer would queue calls behind other documents' requests
+        self._executor = ThreadPoolExecutor(max_workers=2 * concurrency, thread_name_prefix="model-router")
+
+    @classmethod
+    def single(cls, client: GeminiClient, concurrency: int = DEFAULT_CONCURRENCY) -> "ModelRouter":
+        """Every template on one client (e.g. an injected test backend)"""
+        return cls({client.model_name: client}, concurrency=concurrency)
+
+    @classmethod
+    def for_gemini(cls, api_key: str, limiter=None, tiers: Optional[Dict[str, List[str]]] = None,
+                   template_tiers: Optional[Dict[str, str]] = None, default_tier: str = DEFAULT_TIER,
+                   concurrency: int = DEFAULT_CONCURRENCY) -> "ModelRouter":
+        """Router over the Gemini models in tiers, each with its own process-wide rate limiter
+        unless one limiter is passed in for all of them"""
+        from llm_backends import GeminiBackend
+
+        tiers = tiers if tiers is not None else MODEL_TIERS
+        template_tiers = template_tiers if template_tiers is not None else TEMPLATE_TIERS
+        names = dict.fromkeys(name for models in tiers.values() for name in models)
+        clients = {name: GeminiClient(GeminiBackend(api_key, model_name=name), limiter=limiter) for name in names}
+        routes = {template: tiers[tier] for template, tier in template_tiers.items()}
+        return cls(clients, routes, default_route=tiers[default_tier], concurrency=concurrency)
+
+    def _configured(self, template: Optional[str]) -> List[str]:
+        return [model for model in self.routes.get(template, self.default_route) if model in self.clients] \
+            or list(self.clients)
+
+    def primary_model(self, template: Optional[str]) -> str:
+        """The model a template is routed to when every model is healthy"""
+        return self._configured(template)[0]
+
+    def route(self, template: Optional[str]) -> List[str]:
+        """Models to try for template, in order; unhealthy ones are left out while any is healthy"""
+        models = self._configured(template)
+        return [model for model in models if self.health.available(model)] or models
+
+    def _attempt(self, model: str, template: Optional[str],
+                 call: Callable[[GeminiClient, Any], str], stats) -> str:
+        started = time.perf_counter()
+        if stats is not None:
+            stats.model = model
+        try:
+            text = call(self.clients[model], stats)
+        except ContextExpiredError:
+            # The cached context is gone, not the model
+            raise
+        except GeminiError as e:
+            self.health.record_failure(model, e)
+            raise
+        self.health.record_success(model, template, time.perf_counter() - started)
+        return text
+
+    def _hedge_plan(self, models: List[str], template: Optional[str]) -> Optional[Tuple[float, str]]:
+        """(delay, backup model) if this call may be hedged"""
+        if not self.hedging or len(models) < 2:
+            return None
+        with self._lock:
+            if self.hedges >= self.hedge_budget * self.calls:
+                return None
+        delay = self.health.percentile(models[0], template, HEDGE_PERCENTILE)
+        if delay is None:
+            return None
+        # The alternative expected to answer soonest; untried models keep their route order
+        backups = models[1:]
+        backup = min(backups, key=lambda model: (self.health.percentile(model, template, 0.5, min_samples=1)
+                                                 or math.inf, backups.index(model)))
+        return delay, backup
+
+    def _failover(self, models: List[str], template: Optional[str], call, stats,
+                  can_failover: Callable[[], bool]) -> str:
+        error = None
+        for model in models:
+            try:
+                return self._attempt(model, template, call, stats)
+            except _FAILOVER_ERRORS as e:
+                error = e
+                if not can_failover():
+                    raise
+        raise error
+
+    def _hedged(self, models: List[str], template: Optional[str], call, stats, delay: float, backup: str) -> str:
+        # Each request records into its own copy; the winner's measurements are kept
+        copies = {models[0]: copy.copy(stats), backup: copy.copy(stats)}
+        primary = self._executor.submit(self._attempt, models[0], template, call, copies[models[0]])
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            try:
+                text = primary.result()
+            except _FAILOVER_ERRORS:
+                return self._failover(models[1:], template, call, stats, lambda: True)
+            if stats is not None:
+                stats.__dict__.update(copies[models[0]].__dict__)
+            return text
+
+        with self._lock:
+            self.hedges += 1
+        hedge_started = time.perf_counter()
+        futures = {primary: models[0], self._executor.submit(self._attempt, backup, template, call, copies[backup]): backup}
+        started = {models[0]: hedge_started - delay, backup: hedge_started}
+        # The losing request is still paid for; it is recorded once it finishes, on the caller's pipeline
+        caller_context = contextvars.copy_context()
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    text = future.result()
+                except GeminiError as e:
+                    error = e
+                    continue
+                # The slower request is left to finish in the background and its answer dropped
+                if stats is not None:
+                    stats.__dict__.update(copies[futures[future]].__dict__)
+                    stats.hedged = True
+                    loser = next(other for other in futures if other is not future)
+                    loser_stats = copies[futures[loser]]
+                    loser.add_done_callback(lambda f: caller_context.run(
+                        self._record_loser, loser_stats, f, started[futures[f]]))
+                if futures[future] == backup:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return text
+        raise error
+
+    @staticmethod
+    def _record_loser(stats, future, started: float):
+        """Instrument the request that lost a hedge: its tokens and cost were spent all the same"""
+        stats.wall_seconds = time.perf_counter() - started
+        stats.hedged = True
+        # Compaction savings belong to the winning call
+        stats.tokens_saved = 0
+        error = future.exception()
+        if error is not None:
+            stats.error = type(error).__name__
+        record_call(stats)
+
+    def _in_context(self, models: List[str], context: Optional["DocumentContext"]) -> List[str]:
+        """Models in the order to try them, with the one holding context's cache first"""
+        if context is None or context.model not in models:
+            return models
+        return [context.model] + [model for model in models if model != context.model]
+
+    @staticmethod
+    def _context_prompt(client: GeminiClient, prompt: str,
+                        context: Optional["DocumentContext"]) -> Tuple[str, Optional[str]]:
+        """(prompt, cache reference) for client: the bare prompt on the model that holds the cached
+        context, the context text followed by the prompt everywhere else"""
+        if context is None:
+            return prompt, None
+        if context.name is not None and client.model_name == context.model:
+            return prompt, context.name
+        return context.prefixed(prompt), None
+
+    def generate(self, template: Optional[str], prompt: str,
+                 generation_config: Optional[Dict[str, Any]] = None, stats=None,
+                 context: Optional["DocumentContext"] = None) -> str:
+        """GeminiClient.generate on the routed model, with failover and hedging
+
+        With a document context (see document_session) prompt follows on from the context; calls
+        using it are not hedged, since only one model holds the cached copy.
+        """
+        models = self._in_context(self.route(template), context)
+        with self._lock:
+            self.calls += 1
+
+        def call(client: GeminiClient, call_stats) -> str:
+            text, reference = self._context_prompt(client, prompt, context)
+            return client.generate(text, generation_config=generation_config, stats=call_stats, context=reference)
+
+        plan = self._hedge_plan(models, template) if context is None else None
+        if plan is not None:
+            return self._hedged(models, template, call, stats, *plan)
+        return self._failover(models, template, call, stats, lambda: True)
+
+    def generate_stream(self, template: Optional[str], prompt: str, on_text: Callable[[str], None],
+                        generation_config: Optional[Dict[str, Any]] = None, stats=None,
+                        context: Optional["DocumentContext"] = None) -> str:
+        """GeminiClient.generate_stream on the routed model
+
+        Streams are not hedged, since two responses cannot be shown in one place, and only fail
+        over to another model if nothing has been shown yet.
+        """
+        models = self._in_context(self.route(template), context)
+        with self._lock:
+            self.calls += 1
+        shown = {'any': False}
+
+        def relay(text: str):
+            shown['any'] = True
+            on_text(text)
+
+        def call(client: GeminiClient, call_stats) -> str:
+            text, reference = self._context_prompt(client, prompt, context)
+            return client.generate_stream(text, relay, generation_config=generation_config, stats=call_stats,
+                                          context=reference)
+
+        return self._failover(models, template, call, stats, lambda: not shown['any'])
+
+    def report(self) -> Dict[str, Any]:
+        """Health table plus hedging counters, for display"""
+        return {"models": self.health.report(), "calls": self.calls, "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins}
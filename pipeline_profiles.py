@@ -0,0 +1,113 @@
+"""
+Terminal X AI - Pipeline profiles
+Named stage selections that trade analysis depth for quota: which stages a document gets, whether
+low-value documents stop after triage, and what share of documents is quality checked
+"""
+
+import threading
+from typing import Any, Dict, List
+
+# Profile used when none is chosen: every stage, as before profiles existed; the others are opt-in
+DEFAULT_PROFILE = 'deep'
+# Document types whose sampled quality checks pass less often than this are checked every time...
+QUALITY_ALERT_PASS_RATE = 0.8
+# ...once at least this many of their checks have come back
+MIN_QUALITY_SAMPLES = 10
+
+class PipelineProfile:
+    """Stages and sampling for one kind of run; see PIPELINE_PROFILES"""
+
+    def __init__(self, name: str, label: str, description: str, thesis: bool, summary: bool,
+                 early_exit: bool, quality_sample: float):
+        self.name = name
+        self.label = label
+        self.description = description
+        # Multi-call thesis (and its market data); fused mode always returns one
+        self.thesis = thesis
+        self.summary = summary
+        # Skip the analysis stages for documents triage finds low-value, and the quality check and
+        # summary for documents nothing could be extracted from
+        self.early_exit = early_exit
+        # Share of documents, chosen by document hash, that get a quality check
+        self.quality_sample = quality_sample
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "thesis": self.thesis, "summary": self.summary,
+                "early_exit": self.early_exit, "quality_sample": self.quality_sample}
+
+PIPELINE_PROFILES = {profile.name: profile for profile in [
+    PipelineProfile('fast', "Fast triage",
+                    "Classification, metrics and risks only; low-value documents stop after local triage",
+                    thesis=False, summary=False, early_exit=True, quality_sample=0.0),
+    PipelineProfile('standard', "Standard",
+                    "Full analysis with early exit for low-value documents; a quarter of documents are "
+                    "quality checked",
+                    thesis=True, summary=True, early_exit=True, quality_sample=0.25),
+    PipelineProfile('deep', "Deep",
+                    "Every stage on every document, including the quality check",
+                    thesis=True, summary=True, early_exit=False, quality_sample=1.0)
+]}
+
+def get_profile(name: str) -> PipelineProfile:
+    try:
+        return PIPELINE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown pipeline profile {name!r}; expected one of {', '.join(PIPELINE_PROFILES)}")
+
+def in_sample(doc_hash: str, rate: float) -> bool:
+    """Whether a document falls in a rate-sized sample
+
+    Decided by document hash, so re-analyzing a document (or coalescing it with a concurrent run)
+    makes the same choice.
+    """
+    return rate >= 1 or (rate > 0 and int(doc_hash[:8], 16) / 0x100000000 < rate)
+
+def quality_passed(verdict: str) -> bool:
+    """Whether a quality check response is the checker's PASS rather than a list of issues"""
+    return verdict.strip().strip('"*.').upper() == "PASS"
+
+class QualityStats:
+    """Running quality check outcomes by document type, shared by every pipeline in the process
+
+    Sampling is only safe while the sampled checks keep passing: a document type whose pass rate
+    drops below alert_pass_rate is checked on every document until it recovers.
+    """
+
+    def __init__(self, alert_pass_rate: float = QUALITY_ALERT_PASS_RATE,
+                 min_samples: int = MIN_QUALITY_SAMPLES):
+        self.alert_pass_rate = alert_pass_rate
+        self.min_samples = min_samples
+        # Document type -> [checks, passes]
+        self._counts: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, document_type: str, passed: bool):
+        with self._lock:
+            counts = self._counts.setdefault(document_type, [0, 0])
+            counts[0] += 1
+            counts[1] += int(passed)
+
+    def _alert(self, checks: int, passes: int) -> bool:
+        return checks >= self.min_samples and passes / checks < self.alert_pass_rate
+
+    def sample_rate(self, document_type: str, rate: float) -> float:
+        """rate, or 1.0 while document_type's checks are failing too often"""
+        with self._lock:
+            checks, passes = self._counts.get(document_type, (0, 0))
+        return 1.0 if self._alert(checks, passes) else rate
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {document_type: tuple(values) for document_type, values in self._counts.items()}
+        checks = sum(values[0] for values in counts.values())
+        passes = sum(values[1] for values in counts.values())
+        return {
+            "checks": checks,
+            "passed": passes,
+            "pass_rate": round(passes / checks, 4) if checks else None,
+            "by_document_type": {
+                document_type: {"checks": c, "passed": p, "pass_rate": round(p / c, 4),
+                                "checked_always": self._alert(c, p)}
+                for document_type, (c, p) in sorted(counts.items())
+            }
+        }
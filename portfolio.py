@@ -0,0 +1,111 @@
+"""
+Terminal X AI - Portfolio comparison
+Ranks N companies from their extracted profiles with vectorized pandas/numpy operations, so comparing
+a watchlist needs one profile per company instead of one LLM call per pair
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from metric_extractor import parse_metric_value
+
+# +1: higher is better, -1: lower is better. Columns missing for a company are ignored for it.
+METRIC_DIRECTIONS = {
+    'revenue': 1,
+    'net_income': 1,
+    'eps': 1,
+    'roe': 1,
+    'growth_rate': 1,
+    'recommendation_score': 1,
+    'pe_ratio': -1,
+    'debt_to_equity': -1,
+    'risk_score': -1
+}
+
+_RECOMMENDATION_SCORES = {'POSITIVE': 1.0, 'NEUTRAL': 0.0, 'NEGATIVE': -1.0}
+_RISK_SCORES = {'LOW': 0.0, 'MEDIUM': 1.0, 'HIGH': 2.0}
+
+def profile_row(profile: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """Numeric metric values for one company profile (metrics, optional risks and metric_sources)"""
+    metrics = profile.get('metrics') or {}
+    sources = profile.get('metric_sources') or {}
+    row: Dict[str, Optional[float]] = {}
+    for field in ('revenue', 'net_income', 'eps', 'roe', 'growth_rate', 'pe_ratio', 'debt_to_equity',
+                  'target_price', 'recommendation'):
+        # Locally extracted values are already normalized; Gemini's are parsed from their text
+        local = sources.get(field) or {}
+        row[field] = local['value'] if local.get('source') == 'local' else parse_metric_value(field, metrics.get(field))
+
+    row['recommendation_score'] = _RECOMMENDATION_SCORES.get(row.pop('recommendation') or "")
+    level = str((profile.get('risks') or {}).get('overall_risk_level') or "").upper()
+    row['risk_score'] = _RISK_SCORES.get(level)
+    return row
+
+def metric_table(profiles: Dict[str, Dict[str, Any]]) -> pd.DataFrame:
+    """One row per company, one float column per metric (NaN where unknown)"""
+    table = pd.DataFrame.from_dict({name: profile_row(profile) for name, profile in profiles.items()},
+                                   orient='index', dtype=float)
+    return table.reindex(columns=[column for column in list(METRIC_DIRECTIONS) + ['target_price']
+                                  if column in table.columns])
+
+def _oriented(table: pd.DataFrame) -> pd.DataFrame:
+    """Ranked metric columns flipped so that higher is always better"""
+    columns = [column for column in METRIC_DIRECTIONS if column in table.columns]
+    return table[columns] * pd.Series(METRIC_DIRECTIONS)[columns]
+
+def rank_companies(table: pd.DataFrame, weights: Optional[Dict[str, float]] = None) -> pd.DataFrame:
+    """Composite score and rank per company
+
+    Each metric is turned into a percentile rank across the companies that report it, from 0 for
+    the worst to 1 for the best, and the score is the weighted mean of a company's available
+    percentiles, so missing metrics neither help nor hurt. A metric fewer than two companies report
+    compares nothing and is left out.
+    """
+    oriented = _oriented(table)
+    reported = oriented.notna().sum()
+    oriented = oriented.loc[:, reported >= 2]
+    percentiles = (oriented.rank() - 1) / (reported[oriented.columns] - 1)
+    weight = pd.Series({column: (weights or {}).get(column, 1.0) for column in oriented.columns})
+    available = percentiles.notna()
+    score = (percentiles.fillna(0) * weight).sum(axis=1) / (available * weight).sum(axis=1).replace(0, np.nan)
+
+    ranking = pd.DataFrame({
+        'score': score.round(4),
+        'metrics_compared': available.sum(axis=1).astype(int),
+        # Strongest metric relative to the other companies; None when nothing was comparable
+        'best_metric': percentiles[available.any(axis=1)].fillna(-1).idxmax(axis=1).reindex(table.index)
+    })
+    ranking['rank'] = ranking['score'].rank(ascending=False, method='min')
+    return ranking.sort_values(['rank', 'metrics_compared'], ascending=[True, False])
+
+def win_matrix(table: pd.DataFrame) -> pd.DataFrame:
+    """Share of commonly reported metrics on which the row company beats the column company
+
+    Computed in one broadcast over a (companies x companies x metrics) array instead of pairwise loops.
+    """
+    values = _oriented(table).to_numpy(dtype=float)
+    rows, columns = values[:, None, :], values[None, :, :]
+    comparable = ~np.isnan(rows) & ~np.isnan(columns)
+    wins = (rows > columns) & comparable
+    with np.errstate(invalid='ignore', divide='ignore'):
+        share = wins.sum(axis=2) / comparable.sum(axis=2)
+    np.fill_diagonal(share, np.nan)
+    return pd.DataFrame(share, index=table.index, columns=table.index).round(2)
+
+def narrative_context(table: pd.DataFrame, ranking: pd.DataFrame, top: int = 10) -> str:
+    """Compact text of the ranking and metric table for the single narrative prompt"""
+    ordered = table.loc[ranking.index[:top]]
+    lines = ["company," + ",".join(ordered.columns) + ",score"]
+    for name, row in ordered.iterrows():
+        cells = ["" if pd.isna(value) else f"{value:.4g}" for value in row]
+        lines.append(",".join([str(name)] + cells + [f"{ranking.loc[name, 'score']:.2f}"]))
+    if len(ranking) > top:
+        lines.append(f"... and {len(ranking) - top} lower-ranked companies: {', '.join(map(str, ranking.index[top:]))}")
+    return "\n".join(lines)
+
+def records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """DataFrame rows as JSON-friendly dicts with NaN as None"""
+    return [{"company": name, **{key: (None if pd.isna(value) else value) for key, value in row.items()}}
+            for name, row in frame.astype(object).iterrows()]
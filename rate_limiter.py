@@ -0,0 +1,60 @@
+"""
+Terminal X AI - API rate limiting
+Thread-safe token buckets shared by every pipeline stage and batch worker
+"""
+
+import threading
+import time
+from typing import Optional
+
+class RateLimiter:
+    """Token buckets for requests per minute and, optionally, prompt tokens per minute"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: Optional[float] = None, burst: int = 1):
+        if requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be positive")
+        if tokens_per_minute is not None and tokens_per_minute <= 0:
+            raise ValueError("tokens_per_minute must be positive")
+        self.request_rate = requests_per_minute / 60.0
+        self.request_capacity = float(max(1, burst))
+        self.token_rate = tokens_per_minute / 60.0 if tokens_per_minute else None
+        # A full minute of token budget may be spent in one burst
+        self.token_capacity = float(tokens_per_minute) if tokens_per_minute else None
+        self._requests = self.request_capacity
+        self._tokens = self.token_capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.request_capacity, self._requests + elapsed * self.request_rate)
+        if self.token_rate:
+            self._tokens = min(self.token_capacity, self._tokens + elapsed * self.token_rate)
+
+    def acquire(self, tokens: int = 0, deadline: Optional[float] = None) -> float:
+        """Block until a request of `tokens` prompt tokens may be sent; returns the seconds spent waiting
+
+        Raises TimeoutError if the wait would run past `deadline` (a time.monotonic() value).
+        """
+        if self.token_capacity:
+            # Oversized prompts would otherwise wait forever
+            tokens = min(tokens, self.token_capacity)
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(0.0, (1 - self._requests) / self.request_rate)
+                if self.token_rate and tokens:
+                    delay = max(delay, (tokens - self._tokens) / self.token_rate)
+                if delay <= 0:
+                    self._requests -= 1
+                    if self.token_rate:
+                        self._tokens -= tokens
+                    return waited
+            if deadline is not None and now + delay > deadline:
+                raise TimeoutError(f"Rate limit wait of {delay:.1f}s exceeds the call deadline")
+            time.sleep(delay)
+            waited += delay
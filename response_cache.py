@@ -0,0 +1,121 @@
+"""
+Terminal X AI - Gemini response cache
+Content-addressed SQLite cache shared across Streamlit sessions and worker processes
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_CACHE_PATH = os.path.join("data", "cache", "gemini_responses.sqlite3")
+
+class ResponseCache:
+    """Disk-backed LRU cache for Gemini responses with TTL and hit/miss counters"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 5000,
+                 max_bytes: int = 200 * 1024 * 1024, ttl_seconds: float = 7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                created_at REAL NOT NULL,
+                                last_access REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL lets readers in other processes proceed while one process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model_name: str, template: str, prompt: str) -> str:
+        """Hash model name, prompt template and prompt text into a cache key"""
+        payload = json.dumps([model_name, template, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss"""
+        found = self.get_first([key])
+        return found[1] if found is not None else None
+
+    def get_first(self, keys: List[str]) -> Optional[Tuple[str, str]]:
+        """(key, response) for the first of keys that is cached, or None; counts one hit or miss"""
+        now = time.time()
+        with self._connect() as conn:
+            for key in keys:
+                row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[1] > self.ttl_seconds:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                    conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+                    return key, row[0]
+
+            conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+            return None
+
+    def put(self, key: str, value: str):
+        """Store a response and evict least recently used entries beyond the size bounds"""
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                         (key, value, size, now, now))
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if entries <= self.max_entries and total <= self.max_bytes:
+                return
+
+            # Walk from the least recently used end until both bounds hold again
+            evict = []
+            for old_key, old_size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                if entries <= self.max_entries and total <= self.max_bytes:
+                    break
+                evict.append((old_key,))
+                entries -= 1
+                total -= old_size
+            conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size, aggregated over every process using this file"""
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {
+            "hits": counters.get('hits', 0),
+            "misses": counters.get('misses', 0),
+            "entries": entries,
+            "bytes": total
+        }
+
+    def clear(self):
+        """Drop every cached response and reset the counters"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("UPDATE counters SET value = 0")
@@ -0,0 +1,248 @@
+"""
+Terminal X AI - Tolerant JSON response parsing
+Finds the JSON object in a model response in one scan, tolerating code fences, surrounding prose and
+common syntax slop, parses incrementally while a response streams, and validates against typed schemas
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Python literals models sometimes emit instead of JSON ones
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+_MAX_ATTEMPTS = 4
+
+class ResponseParseError(ValueError):
+    """A response held no usable JSON, or it did not match the expected schema"""
+
+class IncrementalJSONParser:
+    """Scan text for the first JSON object or array, one chunk at a time
+
+    Prose and code fences before the value are skipped and anything after it is ignored. Inside the
+    value, single-quoted strings, Python literals and trailing commas are normalized as they stream
+    past, so each character is looked at exactly once however the response is chunked.
+    """
+
+    def __init__(self, start_chars: str = "{["):
+        self.start_chars = start_chars
+        self.start_offset: Optional[int] = None
+        self._seen = 0
+        self._out: List[str] = []
+        self._stack: List[str] = []
+        self._quote: Optional[str] = None
+        self._escape = False
+        self._word: List[str] = []
+        # (output length, open containers) after which the output is a valid prefix to close off
+        self._checkpoint: Tuple[int, Tuple[str, ...]] = (0, ())
+        self.done = False
+
+    def feed(self, chunk: str) -> bool:
+        """Consume the next piece of the response; returns True once the value is complete"""
+        for ch in chunk:
+            if self.done:
+                break
+            self._seen += 1
+            if self.start_offset is None:
+                if ch in self.start_chars:
+                    self.start_offset = self._seen - 1
+                    self._open(ch)
+                continue
+            if self._quote is not None:
+                self._string_char(ch)
+            else:
+                self._structural_char(ch)
+        return self.done
+
+    def _open(self, ch: str):
+        self._stack.append(ch)
+        self._out.append(ch)
+        self._checkpoint = (len(self._out), tuple(self._stack))
+
+    def _string_char(self, ch: str):
+        if self._escape:
+            self._escape = False
+            # \' is not a JSON escape; inside a string it is just a quote
+            if ch == "'":
+                self._out[-1] = "'"
+            else:
+                self._out.append(ch)
+        elif ch == "\\":
+            self._escape = True
+            self._out.append(ch)
+        elif ch == self._quote:
+            self._quote = None
+            self._out.append('"')
+        elif ch == '"':
+            # Double quote inside a single-quoted string
+            self._out.append('\\"')
+        else:
+            self._out.append(ch)
+
+    def _structural_char(self, ch: str):
+        if ch.isalnum() or ch in "_.+-":
+            self._word.append(ch)
+            return
+        self._flush_word()
+        if ch in "\"'":
+            self._quote = ch
+            self._out.append('"')
+        elif ch in "{[":
+            self._open(ch)
+        elif ch in "}]":
+            self._drop_trailing_comma()
+            self._stack.pop()
+            self._out.append(ch)
+            if not self._stack:
+                self.done = True
+        elif ch == ",":
+            self._checkpoint = (len(self._out), tuple(self._stack))
+            self._out.append(ch)
+        elif ch in "“”":
+            # Curly quotes from word processors and chat front ends
+            self._quote = "”"
+            self._out.append('"')
+        else:
+            self._out.append(ch)
+
+    def _flush_word(self):
+        if self._word:
+            word = "".join(self._word)
+            self._out.append(_LITERALS.get(word, word))
+            self._word = []
+
+    def _drop_trailing_comma(self):
+        index = len(self._out) - 1
+        while index >= 0 and self._out[index].isspace():
+            index -= 1
+        if index >= 0 and self._out[index] == ",":
+            del self._out[index]
+
+    @property
+    def text(self) -> str:
+        """The normalized JSON text scanned so far"""
+        return "".join(self._out)
+
+    def value(self) -> Any:
+        """Decode the completed value; raises ResponseParseError if it is missing or truncated"""
+        if self.start_offset is None:
+            raise ResponseParseError("no JSON value found")
+        if not self.done:
+            raise ResponseParseError("JSON value is truncated")
+        try:
+            return json.loads(self.text, strict=False)
+        except json.JSONDecodeError as e:
+            raise ResponseParseError(f"invalid JSON: {e}") from e
+
+    def partial(self) -> Any:
+        """Best-effort decode of the value so far, closing any open strings and containers
+
+        Returns None before the value starts. Used to render a streaming response as it arrives.
+        """
+        if self.start_offset is None:
+            return None
+        if self.done:
+            try:
+                return self.value()
+            except ResponseParseError:
+                return None
+
+        word = "".join(self._word)
+        candidate = self.text + _LITERALS.get(word, word) + ('"' if self._quote is not None else "")
+        closers = "".join(_CLOSERS[c] for c in reversed(self._stack))
+        length, stack = self._checkpoint
+        fallback = "".join(self._out[:length]) + "".join(_CLOSERS[c] for c in reversed(stack))
+        for text in (candidate.rstrip().rstrip(",") + closers, fallback):
+            try:
+                return json.loads(text, strict=False)
+            except json.JSONDecodeError:
+                continue
+        return None
+
+def extract_json(text: str, start_chars: str = "{[") -> Any:
+    """Decode the first JSON value in text
+
+    Usually a single scan. If the first candidate is not JSON (e.g. "{placeholder}" in leading
+    prose), scanning resumes just after it, up to a few times.
+    """
+    offset, error = 0, ResponseParseError("no JSON value found")
+    for _ in range(_MAX_ATTEMPTS):
+        parser = IncrementalJSONParser(start_chars)
+        parser.feed(text[offset:])
+        try:
+            return parser.value()
+        except ResponseParseError as e:
+            error = e
+            if parser.start_offset is None or not parser.done:
+                break
+            offset += parser.start_offset + 1
+    raise error
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> Tuple[Any, List[str]]:
+    """Check value against a Gemini-style response schema, coercing where it is unambiguous
+
+    Returns (coerced value, soft issues). Structural problems such as a missing required field or
+    an object where a list belongs raise ResponseParseError. Enum values are matched case-insensitively
+    and by contained label ("POSITIVE - strong growth" is POSITIVE); a value matching no label is
+    kept as-is and reported as an issue rather than discarding the whole response.
+    """
+    kind = schema.get("type", "STRING")
+    if value is None:
+        if schema.get("nullable") or kind == "ARRAY":
+            return ([] if kind == "ARRAY" else None), []
+        raise ResponseParseError(f"{path}: expected {kind.lower()}, got null")
+
+    if kind == "OBJECT":
+        if not isinstance(value, dict):
+            raise ResponseParseError(f"{path}: expected object, got {type(value).__name__}")
+        missing = [key for key in schema.get("required", []) if value.get(key) is None]
+        if missing:
+            raise ResponseParseError(f"{path}: missing required {', '.join(missing)}")
+        result, issues = dict(value), []
+        for key, field in schema.get("properties", {}).items():
+            if key in value:
+                result[key], field_issues = validate(value[key], field, f"{path}.{key}")
+                issues.extend(field_issues)
+        return result, issues
+
+    if kind == "ARRAY":
+        if isinstance(value, dict):
+            raise ResponseParseError(f"{path}: expected list, got object")
+        items = value if isinstance(value, list) else [value]
+        result, issues = [], []
+        for index, item in enumerate(items):
+            coerced, item_issues = validate(item, schema.get("items", {}), f"{path}[{index}]")
+            result.append(coerced)
+            issues.extend(item_issues)
+        return result, issues
+
+    if kind in ("NUMBER", "INTEGER"):
+        if isinstance(value, bool):
+            raise ResponseParseError(f"{path}: expected number, got boolean")
+        try:
+            number = float(str(value).replace(",", "")) if isinstance(value, str) else float(value)
+        except (TypeError, ValueError):
+            raise ResponseParseError(f"{path}: expected number, got {value!r}")
+        return (int(number) if kind == "INTEGER" else number), []
+
+    if kind == "BOOLEAN":
+        if isinstance(value, bool):
+            return value, []
+        raise ResponseParseError(f"{path}: expected boolean, got {value!r}")
+
+    # STRING
+    if isinstance(value, (dict, list)):
+        raise ResponseParseError(f"{path}: expected string, got {type(value).__name__}")
+    text = str(value).strip()
+    labels = schema.get("enum")
+    if labels:
+        upper = text.upper()
+        matches = [label for label in labels if label == upper] or [label for label in labels if label in upper]
+        if len(matches) == 1 or (matches and matches[0] == upper):
+            return matches[0], []
+        return text, [f"{path}: {text!r} is not one of {', '.join(labels)}"]
+    return text, []
+
+def parse_response(text: str, schema: Dict[str, Any]) -> Tuple[Any, List[str]]:
+    """Extract the JSON value from a model response and validate it; returns (value, soft issues)"""
+    start_chars = "[" if schema.get("type") == "ARRAY" else "{"
+    return validate(extract_json(text, start_chars), schema)
@@ -0,0 +1,61 @@
+"""
+Terminal X AI - Request coalescing
+Single-flight execution: while a computation for a key is running, identical requests wait for it and
+share its result instead of repeating the same Gemini calls
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Deduplicates concurrent calls by key across threads (and so across Streamlit sessions)
+
+    Only calls that overlap in time are merged; once a flight lands the next call for its key runs
+    again, leaving longer-term reuse to the response cache. Shared results are handed to every
+    waiter as the same object, so callers must not mutate them.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn() unless a call with the same key is in flight; returns (result, shared)
+
+        A failure of the in-flight call is raised in every caller waiting on it.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
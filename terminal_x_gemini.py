@@ -1,30 +1,215 @@
+import time
+_SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
-import google.generativeai as genai
 import json
-import pandas as pd
-import plotly.graph_objects as go
-import plotly.express as px
+import hashlib
 from datetime import datetime
 import os
-from typing import Dict, List, Any
-import time
+import logging
+from typing import TYPE_CHECKING, Dict, List, Any, Callable, Optional
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from response_cache import ResponseCache
+from rate_limiter import RateLimiter
+from gemini_client import GeminiClient, GeminiError, ContextExpiredError
+from llm_backends import LLMBackend
+from model_router import ModelRouter
+from instrumentation import CallStats, PipelineMetrics, REGISTRY, record_call, record_event, stage_scope
+from local_classifier import LocalClassifier
+from analysis_store import AnalysisStore, document_hash
+from document_ingestion import DocumentIngestor, IngestionError
+from job_queue import Job, JobQueue
+from single_flight import SingleFlight
+from document_session import ContextCache, DocumentContext, DocumentSession
+from metric_extractor import METRIC_FIELDS, extract_metrics_locally
+from response_parser import IncrementalJSONParser, ResponseParseError, parse_response
+from document_chunker import split_document, select_chunks, merge_metrics, merge_risks, merge_thesis
+from prompt_compactor import (Compaction, compact_document, compact_json, compact_text, count_figures,
+                               count_tokens, fit_to_budget)
+from pipeline_profiles import (DEFAULT_PROFILE, PIPELINE_PROFILES, PipelineProfile, QualityStats, get_profile,
+                               in_sample, quality_passed)
+
+if TYPE_CHECKING:
+    from market_data import MarketDataStore
+
+# Time spent importing this script's dependencies; on reruns these come from sys.modules
+IMPORT_SECONDS = time.perf_counter() - _SCRIPT_STARTED
+
+# Startup budgets in seconds; overruns are logged and flagged in the sidebar
+IMPORT_TIME_BUDGET = 0.5
+RERUN_TIME_BUDGET = 0.3
+
+SAMPLE_DOCUMENTS = {
+    "Investment Memo": "data/raw/investment_memo.txt",
+    "Quarterly Report": "data/raw/quarterly_report.txt",
+    "Financial Model": "data/raw/financial_model.txt"
+}
+
+# Status icons for pipeline stage progress lines
+STAGE_ICONS = {'waiting': '⏸️', 'running': '⏳', 'done': '✅', 'failed': '❌', 'skipped': '⏭️', 'cancelled': '🛑'}
+
+# Concurrent background analyses per server process, shared by all sessions
+JOB_WORKERS = 4
+# Seconds between progress refreshes while a session's analysis job runs
+JOB_POLL_SECONDS = 1.0
+
+# Document tokens per prompt for stages that only need the gist of a document
+CLASSIFIER_DOCUMENT_TOKENS = 500
+COMPARISON_DOCUMENT_TOKENS = 400
+# Company profiles kept in memory for portfolio comparison, most recently used first
+PROFILE_CACHE_SIZE = 256
+# Document tokens kept in a Q&A session's cached context
+SESSION_DOCUMENT_TOKENS = 200000
+# Result entries a Q&A session's context carries alongside the document
+SESSION_ANALYSIS_KEYS = ('document_type', 'metrics', 'risks', 'thesis', 'market_data', 'quality_check', 'summary')
+
+# Early exit (see triage): classifier labels that are not worth analyzing, the fewest tokens left after
+# compaction for a document to be worth it, and the currency amounts or percentages a document
+# with no locally readable metric needs
+LOW_VALUE_DOCUMENT_TYPES = ('other',)
+MIN_DOCUMENT_TOKENS = 60
+MIN_DOCUMENT_FIGURES = 3
+# Skip reason of a quality check left out of the sample; every other skip is an early exit
+QUALITY_NOT_SAMPLED = "Not in the quality check sample"
+
+# Labelled documents (data/raw/<label>.txt or <dir>/<label>/*.txt) the local classifier trains on
+CLASSIFIER_TRAINING_DIR = "data/raw"
+
+logger = logging.getLogger(__name__)
+
+_NULLABLE_STRING = {"type": "STRING", "nullable": True}
+_STRING_LIST = {"type": "ARRAY", "items": {"type": "STRING"}}
 
-# Configure Gemini
-genai.configure(api_key=st.secrets.get("GEMINI_API_KEY", "your-gemini-api-key-here"))
+# Typed result schemas per stage; parsed responses are validated against these
+METRICS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "revenue": _NULLABLE_STRING,
+        "net_income": _NULLABLE_STRING,
+        "eps": _NULLABLE_STRING,
+        "pe_ratio": _NULLABLE_STRING,
+        "roe": _NULLABLE_STRING,
+        "debt_to_equity": _NULLABLE_STRING,
+        "growth_rate": _NULLABLE_STRING,
+        "target_price": _NULLABLE_STRING,
+        "recommendation": {"type": "STRING", "enum": ["POSITIVE", "NEUTRAL", "NEGATIVE"], "nullable": True}
+    }
+}
+
+RISKS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "market_risks": _STRING_LIST,
+        "operational_risks": _STRING_LIST,
+        "financial_risks": _STRING_LIST,
+        "regulatory_risks": _STRING_LIST,
+        "overall_risk_level": {"type": "STRING", "enum": ["LOW", "MEDIUM", "HIGH"]}
+    },
+    "required": ["overall_risk_level"]
+}
+
+THESIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "investment_thesis": {"type": "STRING"},
+        "key_drivers": _STRING_LIST,
+        "competitive_advantages": _STRING_LIST,
+        "valuation_analysis": _NULLABLE_STRING,
+        "investment_recommendation": {"type": "STRING"}
+    },
+    "required": ["investment_thesis", "investment_recommendation"]
+}
+
+COMPARISON_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "financial_comparison": {
+            "type": "OBJECT",
+            "properties": {
+                "revenue_growth": _NULLABLE_STRING,
+                "profitability": _NULLABLE_STRING,
+                "valuation": _NULLABLE_STRING
+            }
+        },
+        "competitive_position": _NULLABLE_STRING,
+        "investment_preference": _NULLABLE_STRING
+    },
+    "required": ["financial_comparison"]
+}
+
+# Response schema enforced by Gemini in fused mode; mirrors the multi-call result shapes
+FUSED_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "metrics": METRICS_SCHEMA,
+        "risks": RISKS_SCHEMA,
+        "thesis": THESIS_SCHEMA
+    },
+    "required": ["metrics", "risks", "thesis"]
+}
+
+def _get_api_key() -> str:
+    """Read the Gemini API key from the environment or Streamlit secrets"""
+    if os.environ.get("GEMINI_API_KEY"):
+        return os.environ["GEMINI_API_KEY"]
+    try:
+        return st.secrets.get("GEMINI_API_KEY", "your-gemini-api-key-here")
+    except Exception:
+        # No secrets.toml, e.g. when running headless from batch_runner.py
+        return "your-gemini-api-key-here"
+
+def _public(result: Any) -> Any:
+    """Stage result without bookkeeping entries such as '_sources', for feeding into later prompts"""
+    if isinstance(result, dict):
+        return {key: value for key, value in result.items() if not key.startswith('_')}
+    return result
+
+def _attach_script_run_ctx(ctx):
+    """Let pipeline worker threads write to the calling Streamlit session"""
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+def _parses(response: str, schema: Dict[str, Any]) -> bool:
+    """Whether a response holds a JSON object parse_response can read against schema"""
+    try:
+        parse_response(response, schema)
+    except ResponseParseError:
+        return False
+    return True
+
+def _profiled(result: Dict[str, Any]) -> bool:
+    """Whether a stored analysis has the metrics and risks a company profile needs
+    
+    Not when those stages failed ('analysis' in fused mode) or never ran because the run exited early.
+    """
+    errors = result.get('errors') or {}
+    return (not any(stage in errors for stage in ('metrics', 'risks', 'analysis'))
+            and result.get('metrics') is not None and result.get('risks') is not None)
 
 class TerminalXGeminiAI:
-    def __init__(self):
-        # Use the latest and most powerful model
-        try:
-            self.model = genai.GenerativeModel('gemini-2.5-pro')
-        except:
-            try:
-                self.model = genai.GenerativeModel('gemini-1.5-pro')
-            except:
-                try:
-                    self.model = genai.GenerativeModel('gemini-1.0-pro')
-                except:
-                    self.model = genai.GenerativeModel('gemini-pro')
+    def __init__(self, max_workers: int = 4, use_cache: bool = True,
+                 rate_limiter: Optional[RateLimiter] = None, chunk_tokens: int = 1000,
+                 chunk_workers: int = 4, max_document_tokens: int = 60000,
+                 backend: Optional[LLMBackend] = None,
+                 classifier: Optional[LocalClassifier] = None, classifier_threshold: float = 0.8,
+                 market_data: Optional["MarketDataStore"] = None, coalesce: bool = True,
+                 router: Optional[ModelRouter] = None, concurrent_documents: int = JOB_WORKERS):
+        # Each prompt template goes to its routed Gemini model (fast models for classification and
+        # quality checks) with failover and hedging; an injected backend (e.g. llm_backends.StubBackend)
+        # serves every template. Rate limits are per model and process-wide unless a limiter is passed in.
+        # Up to concurrent_documents pipelines each run max_workers stages of chunk_workers calls
+        concurrency = concurrent_documents * max_workers * chunk_workers
+        if router is not None:
+            self.router = router
+        elif backend is not None:
+            self.router = ModelRouter.single(GeminiClient(backend, limiter=rate_limiter), concurrency=concurrency)
+        else:
+            self.router = ModelRouter.for_gemini(_get_api_key(), limiter=rate_limiter, concurrency=concurrency)
+        self.model_name = self.router.primary_model(None)
         
         self.prompts = self._initialize_prompts()
         self.document_types = {
@@ -34,6 +219,34 @@ class TerminalXGeminiAI:
             'pitch_deck': 'Investment presentations and business plans',
             'due_diligence': 'Comprehensive company analysis reports'
         }
+        # Documents the local classifier labels with at least classifier_threshold confidence
+        # skip the Gemini classification call; a threshold above 1 always asks Gemini
+        self.local_classifier = classifier if classifier is not None else \
+            LocalClassifier.from_directory(CLASSIFIER_TRAINING_DIR, self.document_types)
+        self.classifier_threshold = classifier_threshold
+        # Upper bound on concurrently running pipeline stages
+        self.max_workers = max_workers
+        # Documents are compacted (see prompt_compactor) and each prompt gets at most chunk_tokens of
+        # document text. Longer ones are split into chunk_tokens pieces analyzed chunk_workers at a
+        # time, keeping at most max_document_tokens of chunk text per document
+        self.chunk_tokens = chunk_tokens
+        self.chunk_workers = chunk_workers
+        self.max_document_tokens = max_document_tokens
+        # Identical prompts are answered from disk instead of the API
+        self.cache = ResponseCache() if use_cache else None
+        # Daily price history for the thesis' market context; opened on first use (see price_context)
+        self._market_data = market_data
+        self._market_data_lock = threading.Lock()
+        # Identical stages running concurrently in several pipelines (e.g. sessions opening the same
+        # filing) share one execution; None disables coalescing
+        self.single_flight = SingleFlight() if coalesce else None
+        # Company profiles for portfolio comparison, by document hash
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._profiles_lock = threading.Lock()
+        # Q&A session contexts, shared by sessions asking about the same document (see open_session)
+        self.contexts = ContextCache()
+        # Sampled quality check outcomes; document types that keep failing are checked every time
+        self.quality_stats = QualityStats()
     
     def _initialize_prompts(self) -> Dict[str, str]:
         """Initialize the sophisticated prompt library"""
@@ -45,6 +258,7 @@ class TerminalXGeminiAI:
             - financial_model: Financial projections and valuation models
             - pitch_deck: Investment presentations
             - due_diligence: Comprehensive company analysis
+            - other: Anything else, e.g. not about a company's finances or investment case
             
             Document: {document}
             
@@ -55,6 +269,8 @@ class TerminalXGeminiAI:
 
                    Document: {document}
 
+                   Metrics needed: {fields}
+
                    Analyze the document and extract financial metrics. You can respond in ANY format - JSON, text, or structured analysis. The system will handle any format you provide.
 
                    If you prefer JSON format:
@@ -108,6 +324,20 @@ class TerminalXGeminiAI:
 
                    Or provide your investment thesis in any other format that works best for you.""",
             
+            # Fused Metrics + Risks + Thesis Prompt (single call, JSON schema enforced)
+            'fused_analyzer': """You are a senior financial analyst and risk management expert. Analyze this financial document in one pass:
+            
+            Document: {document}
+            
+            Return a single JSON object with three sections:
+            - "metrics": revenue, net_income, eps, pe_ratio, roe, debt_to_equity, growth_rate, target_price as written in the document (null if absent), and recommendation as POSITIVE/NEUTRAL/NEGATIVE
+            - "risks": market_risks, operational_risks, financial_risks and regulatory_risks as lists, plus overall_risk_level as LOW/MEDIUM/HIGH
+            - "thesis": investment_thesis, key_drivers, competitive_advantages, valuation_analysis and investment_recommendation (POSITIVE/NEUTRAL/NEGATIVE with reasoning)""",
+            
+            # Market Context (appended to thesis prompts when a ticker is given)
+            'market_context': """Recent market data for the company, computed from daily prices. Reflect it in the valuation analysis:
+            {context}""",
+            
             # Comparative Analysis Prompt
                                'comparative_analyzer': """You are a comparative analysis expert. Compare the following companies:
 
@@ -128,6 +358,18 @@ class TerminalXGeminiAI:
                    }}
 
                    Or provide your comparison in any other format that works best for you.""",
+
+            # Portfolio Narrative Prompt (one call for the whole comparison)
+            'portfolio_analyzer': """You are a portfolio strategist. These {count} companies were ranked on their reported metrics (score is 0-1, higher is better; risk_score 0=LOW, 2=HIGH; recommendation_score 1=POSITIVE, -1=NEGATIVE):
+
+            {companies}
+
+            Write a short comparative narrative:
+            1. Why the leaders rank where they do
+            2. The main weaknesses of the lowest-ranked companies
+            3. Key trade-offs an investor should weigh across the group
+
+            Base every statement on the figures above.""",
             
             # Executive Summary Generator
             'summary_generator': """You are an executive summary specialist. Create a concise executive summary from this analysis:
@@ -155,83 +397,172 @@ class TerminalXGeminiAI:
             3. Complete analysis
             4. Professional presentation
             
-            Return issues found or "PASS" if analysis is high quality."""
+            Return issues found or "PASS" if analysis is high quality.""",
+            
+            # Document Q&A Context (cached once per document, see open_session)
+            'document_context': """You are a senior financial analyst answering follow-up questions about one financial document. Answer only from the document and the earlier analysis below, quote figures as written, and say so when the document does not contain the answer.
+            
+            Earlier analysis: {analysis}
+            
+            Document:
+            {document}""",
+            
+            # Document Q&A Question (sent after the cached context)
+            'document_qa': """Answer this follow-up question about the document above in a few sentences.
+            {history}
+            Question: {question}"""
         }
     
-    def _call_gemini(self, prompt: str) -> str:
-        """Make API call to Gemini"""
+    def _call_gemini(self, prompt: str, template: Optional[str] = None,
+                     generation_config: Optional[Dict[str, Any]] = None,
+                     on_text: Optional[Callable[[str], None]] = None,
+                     compaction: Optional[Compaction] = None,
+                     context: Optional[DocumentContext] = None,
+                     schema: Optional[Dict[str, Any]] = None) -> str:
+        """Make API call to Gemini, answering repeated prompts from the response cache
+        
+        With on_text the response is streamed and on_text receives the text so far after every
+        chunk; the complete text is still returned. compaction is the compacted input embedded in
+        prompt, whose savings are recorded on the call. With a document context, prompt follows on
+        from it (see open_session). With a schema, only responses that parse against it are cached,
+        so a malformed answer is asked for again rather than replayed. Raises a GeminiError subclass
+        when the call fails, so stages never see placeholder text.
+        """
+        model_name = self.router.primary_model(template)
+        stats = CallStats(template, model_name)
+        started = time.perf_counter()
+        cache_prompt = prompt if context is None else context.key + prompt
         try:
-            response = self.model.generate_content(prompt)
-            
-            # Check if response was blocked/filtered
-            if hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'finish_reason') and candidate.finish_reason == 1:
-                    st.warning("⚠️ Response was filtered by safety settings. Trying with modified prompt...")
-                    # Try with a simpler, safer prompt
-                    safe_prompt = "Analyze this financial document and provide a brief summary: " + prompt[:500]
-                    safe_response = self.model.generate_content(safe_prompt)
-                    if hasattr(safe_response, 'text') and safe_response.text:
-                        return safe_response.text
-                    else:
-                        return "Analysis completed - response was filtered for safety."
+            if self.cache is not None:
+                # Answers are cached under the model that gave them, which after failover or a won
+                # hedge is not the primary; any model the template is routed to may answer
+                models = self.router.route(template)
+                keys = [self.cache.make_key(model, self.prompts.get(template, ''), cache_prompt) for model in models]
+                found = self.cache.get_first(keys)
+                if found is not None:
+                    stats.cache_hit = True
+                    stats.model = models[keys.index(found[0])]
+                    if on_text is not None:
+                        on_text(found[1])
+                    return found[1]
             
-            # Normal response handling
-            if hasattr(response, 'text') and response.text:
-                return response.text
-            elif hasattr(response, 'candidates') and response.candidates:
-                candidate = response.candidates[0]
-                if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                    if candidate.content.parts:
-                        return candidate.content.parts[0].text
-            else:
-                return str(response)
-                
-        except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg or "quota" in error_msg.lower():
-                st.error("⚠️ Rate limit reached. Please wait a moment and try again.")
-                return "Rate limit reached - please try again in a few minutes."
-            elif "404" in error_msg:
-                st.error("❌ Model not found. Please check the model configuration.")
-                return "Model configuration error."
-            elif "Invalid operation" in error_msg or "finish_reason" in error_msg:
-                st.warning("⚠️ Response was filtered. Using fallback analysis.")
-                return "Analysis completed - response filtered for safety."
+            # Only prompts actually sent count as savings; cache hits cost nothing either way
+            if compaction is not None:
+                stats.tokens_saved = compaction.tokens_saved
+            # A filtered response raises ContentFilteredError like any other failure: answering a
+            # different prompt instead would be cached and parsed as this one's answer
+            if on_text is not None:
+                text = self.router.generate_stream(template, prompt, on_text, generation_config=generation_config,
+                                                   stats=stats, context=context)
             else:
-                st.error(f"Gemini API Error: {e}")
-                return "Analysis error - please try again."
+                text = self.router.generate(template, prompt, generation_config=generation_config, stats=stats,
+                                            context=context)
+            if stats.hedged:
+                record_event('hedged', model=stats.model)
+            
+            if self.cache is not None and (schema is None or _parses(text, schema)):
+                self.cache.put(self.cache.make_key(stats.model, self.prompts.get(template, ''), cache_prompt), text)
+            return text
+        except GeminiError as e:
+            stats.error = type(e).__name__
+            raise
+        finally:
+            stats.wall_seconds = time.perf_counter() - started
+            record_call(stats)
+    
+    def _parse_json(self, response: str, schema: Dict[str, Any], template: str) -> Optional[Dict[str, Any]]:
+        """Extract and validate the JSON object in a response, or None if it has none
+        
+        Failures and schema issues are recorded as 'parse_failure' / 'schema_issue' events so they
+        show up in the run's instrumentation instead of disappearing into placeholder text.
+        """
+        try:
+            result, issues = parse_response(response, schema)
+        except ResponseParseError as e:
+            logger.warning("Could not parse %s response: %s", template, e)
+            record_event('parse_failure', template=template, reason=str(e), response_chars=len(response))
+            return None
+        
+        for issue in issues:
+            record_event('schema_issue', template=template, reason=issue)
+        return result
     
     def classify_document(self, document: str) -> str:
-        """Classify document type using AI"""
-        prompt = self.prompts['classifier'].format(document=document[:2000])
-        response = self._call_gemini(prompt)
-        return response.strip().lower() if response else "unknown"
+        """Classify document type, locally when confident and with Gemini otherwise"""
+        return self.classify_document_with_source(document)['label']
+    
+    def classify_document_with_source(self, document: str) -> Dict[str, Any]:
+        """Document type plus the path that produced it ('local' or 'llm') and the local confidence"""
+        label, confidence = self.local_classifier.predict(document)
+        if confidence >= self.classifier_threshold:
+            record_event('local_classification', label=label, confidence=round(confidence, 4))
+            return {"label": label, "source": "local", "confidence": confidence}
+        
+        compaction = compact_document(document, CLASSIFIER_DOCUMENT_TOKENS)
+        prompt = self.prompts['classifier'].format(document=compaction.text)
+        response = self._call_gemini(prompt, 'classifier', compaction=compaction)
+        return {
+            "label": response.strip().lower() if response else "unknown",
+            "source": "llm",
+            "confidence": confidence
+        }
+    
+    def triage(self, document: str, classification: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """Why document is not worth a full analysis, or None if it is
+        
+        Low-value documents are those with almost no text left after compaction, those with no metric
+        readable locally and hardly any figures and, once a classification is available, those
+        classified as none of the known types. Runs locally.
+        """
+        if classification is not None and classification['label'] in LOW_VALUE_DOCUMENT_TYPES:
+            return f"Classified as {classification['label']}"
+        tokens = count_tokens(compact_text(document))
+        if tokens < MIN_DOCUMENT_TOKENS:
+            return f"Only {tokens} tokens of content"
+        if not extract_metrics_locally(document) and count_figures(document) < MIN_DOCUMENT_FIGURES:
+            return "No financial metrics or figures found"
+        return None
     
     def extract_metrics(self, document: str) -> Dict[str, Any]:
-        """Extract financial metrics from document"""
-        prompt = self.prompts['metrics_extractor'].format(document=document[:3000])
-        response = self._call_gemini(prompt)
-        
-        # Try multiple parsing strategies
-        parsing_strategies = [
-            # Strategy 1: Direct JSON
-            lambda r: json.loads(r.strip()),
-            # Strategy 2: JSON in markdown code blocks
-            lambda r: json.loads(r.strip().replace('```json', '').replace('```', '').strip()),
-            # Strategy 3: Extract JSON from text
-            lambda r: json.loads(r[r.find('{'):r.rfind('}')+1]),
-            # Strategy 4: Try to find any JSON-like structure
-            lambda r: json.loads(r[r.find('['):r.rfind(']')+1]) if '[' in r and ']' in r else json.loads(r[r.find('{'):r.rfind('}')+1])
-        ]
-        
-        for strategy in parsing_strategies:
+        """Extract financial metrics from document
+        
+        Values written out in the document are read locally; Gemini is asked only for the rest,
+        map-reducing over chunks when the document is long. If that fails, the local values are
+        returned with the rest left None; only a document with no local values fails the stage. The
+        '_sources' entry maps each field to where its value came from: the local span and normalized
+        value, or {"source": "llm"}.
+        """
+        local = extract_metrics_locally(document)
+        missing = [field for field in METRIC_FIELDS if field not in local]
+        answered = {}
+        if missing:
             try:
-                result = strategy(response)
-                if isinstance(result, dict):
-                    return result
-            except:
-                continue
+                answered = self._map_chunks(document, lambda part: self._extract_metrics_chunk(part, missing),
+                                            merge_metrics, 'metrics_extractor', budget_share=1 / 3)
+            except GeminiError as e:
+                if not local:
+                    raise
+                record_event('metrics_fallback_failed', fields=missing, error=f"{type(e).__name__}: {e}")
+                logger.warning("Gemini metrics extraction failed, keeping %d local values: %s", len(local), e)
+        
+        metrics = {field: local[field].text if field in local else answered.get(field) for field in METRIC_FIELDS}
+        # Keep anything else Gemini returned, e.g. raw_response when its answer did not parse
+        metrics.update({key: value for key, value in answered.items() if key not in metrics})
+        metrics['_sources'] = {
+            field: local[field].to_dict() if field in local else {"source": "llm"}
+            for field in METRIC_FIELDS if field in local or answered.get(field) is not None
+        }
+        return metrics
+    
+    def _extract_metrics_chunk(self, part: Compaction, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Extract financial metrics from document chunk"""
+        prompt = self.prompts['metrics_extractor'].format(document=part.text,
+                                                          fields=", ".join(fields or METRIC_FIELDS))
+        response = self._call_gemini(prompt, 'metrics_extractor', compaction=part, schema=METRICS_SCHEMA)
+        
+        result = self._parse_json(response, METRICS_SCHEMA, 'metrics_extractor')
+        if result is not None:
+            return result
         
         # If all parsing fails, create structured response from text
         st.info("📝 Creating structured analysis from text response...")
@@ -249,29 +580,17 @@ class TerminalXGeminiAI:
         }
     
     def analyze_risks(self, document: str) -> Dict[str, Any]:
-        """Analyze risks in the document"""
-        prompt = self.prompts['risk_analyzer'].format(document=document[:3000])
-        response = self._call_gemini(prompt)
-        
-        # Try multiple parsing strategies
-        parsing_strategies = [
-            # Strategy 1: Direct JSON
-            lambda r: json.loads(r.strip()),
-            # Strategy 2: JSON in markdown code blocks
-            lambda r: json.loads(r.strip().replace('```json', '').replace('```', '').strip()),
-            # Strategy 3: Extract JSON from text
-            lambda r: json.loads(r[r.find('{'):r.rfind('}')+1]),
-            # Strategy 4: Try to find any JSON-like structure
-            lambda r: json.loads(r[r.find('['):r.rfind(']')+1]) if '[' in r and ']' in r else json.loads(r[r.find('{'):r.rfind('}')+1])
-        ]
-        
-        for strategy in parsing_strategies:
-            try:
-                result = strategy(response)
-                if isinstance(result, dict):
-                    return result
-            except:
-                continue
+        """Analyze risks in the document, map-reducing over chunks when it is long"""
+        return self._map_chunks(document, self._analyze_risks_chunk, merge_risks, 'risk_analyzer', budget_share=1 / 3)
+    
+    def _analyze_risks_chunk(self, part: Compaction) -> Dict[str, Any]:
+        """Analyze risks in the document chunk"""
+        prompt = self.prompts['risk_analyzer'].format(document=part.text)
+        response = self._call_gemini(prompt, 'risk_analyzer', compaction=part, schema=RISKS_SCHEMA)
+        
+        result = self._parse_json(response, RISKS_SCHEMA, 'risk_analyzer')
+        if result is not None:
+            return result
         
         # If all parsing fails, create structured response from text
         st.info("📝 Creating structured risk analysis from text response...")
@@ -284,30 +603,59 @@ class TerminalXGeminiAI:
             "raw_response": response[:500] + "..." if len(response) > 500 else response
         }
     
-    def generate_thesis(self, document: str) -> Dict[str, Any]:
-        """Generate investment thesis"""
-        prompt = self.prompts['thesis_generator'].format(document=document[:3000])
-        response = self._call_gemini(prompt)
-        
-        # Try multiple parsing strategies
-        parsing_strategies = [
-            # Strategy 1: Direct JSON
-            lambda r: json.loads(r.strip()),
-            # Strategy 2: JSON in markdown code blocks
-            lambda r: json.loads(r.strip().replace('```json', '').replace('```', '').strip()),
-            # Strategy 3: Extract JSON from text
-            lambda r: json.loads(r[r.find('{'):r.rfind('}')+1]),
-            # Strategy 4: Try to find any JSON-like structure
-            lambda r: json.loads(r[r.find('['):r.rfind(']')+1]) if '[' in r and ']' in r else json.loads(r[r.find('{'):r.rfind('}')+1])
-        ]
-        
-        for strategy in parsing_strategies:
-            try:
-                result = strategy(response)
-                if isinstance(result, dict):
-                    return result
-            except:
-                continue
+    def price_context(self, ticker: str) -> Optional[Dict[str, Any]]:
+        """Price indicators for ticker from the local market data store, refreshed incrementally
+        
+        Returns None when no bars are available; a failed refresh falls back to the stored bars.
+        """
+        # numpy is only needed once a ticker is given
+        from market_data import MarketDataError, MarketDataStore, format_price_context, price_indicators
+        
+        with self._market_data_lock:
+            if self._market_data is None:
+                self._market_data = MarketDataStore()
+        try:
+            self._market_data.refresh(ticker)
+        except MarketDataError as e:
+            record_event('market_data_unavailable', ticker=ticker, error=str(e))
+            logger.warning("Market data refresh failed for %s: %s", ticker, e)
+        
+        indicators = price_indicators(self._market_data.load(ticker))
+        if indicators is None:
+            return None
+        return {"ticker": ticker.upper(), **indicators, "context": format_price_context(ticker, indicators)}
+    
+    def _with_market_context(self, prompt: str, market_context: Optional[str]) -> str:
+        if not market_context:
+            return prompt
+        return prompt + "\n\n" + self.prompts['market_context'].format(context=market_context)
+    
+    def generate_thesis(self, document: str,
+                        on_text: Optional[Callable[[str], None]] = None,
+                        market_context: Optional[str] = None) -> Dict[str, Any]:
+        """Generate investment thesis, map-reducing over chunks when it is long
+        
+        on_text streams the raw response for single-chunk documents; chunked results are merged,
+        so there is no single response to show. market_context (see price_context) is added to
+        every chunk's prompt.
+        """
+        if count_tokens(compact_text(document)) > self.chunk_tokens:
+            on_text = None
+        return self._map_chunks(document, lambda part: self._generate_thesis_chunk(part, on_text, market_context),
+                                merge_thesis, 'thesis_generator', budget_share=1 / 3)
+    
+    def _generate_thesis_chunk(self, part: Compaction,
+                               on_text: Optional[Callable[[str], None]] = None,
+                               market_context: Optional[str] = None) -> Dict[str, Any]:
+        """Generate investment thesis chunk"""
+        prompt = self._with_market_context(
+            self.prompts['thesis_generator'].format(document=part.text), market_context)
+        response = self._call_gemini(prompt, 'thesis_generator', on_text=on_text, compaction=part,
+                                     schema=THESIS_SCHEMA)
+        
+        result = self._parse_json(response, THESIS_SCHEMA, 'thesis_generator')
+        if result is not None:
+            return result
         
         # If all parsing fails, create structured response from text
         st.info("📝 Creating structured thesis from text response...")
@@ -320,33 +668,88 @@ class TerminalXGeminiAI:
             "raw_response": response[:500] + "..." if len(response) > 500 else response
         }
     
+    def fused_analysis(self, document: str, market_context: Optional[str] = None) -> Dict[str, Any]:
+        """Extract metrics, risks and thesis in a single schema-constrained call per chunk"""
+        return self._map_chunks(document, lambda part: self._fused_analysis_chunk(part, market_context), lambda parts: {
+            "metrics": merge_metrics([part['metrics'] for part in parts]),
+            "risks": merge_risks([part['risks'] for part in parts]),
+            "thesis": merge_thesis([part['thesis'] for part in parts])
+        }, 'fused_analyzer')
+    
+    def _fused_analysis_chunk(self, part: Compaction, market_context: Optional[str] = None) -> Dict[str, Any]:
+        """Fused metrics, risks and thesis for one document chunk"""
+        prompt = self._with_market_context(
+            self.prompts['fused_analyzer'].format(document=part.text), market_context)
+        response = self._call_gemini(prompt, 'fused_analyzer', generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": FUSED_RESPONSE_SCHEMA
+        }, compaction=part, schema=FUSED_RESPONSE_SCHEMA)
+        
+        result = self._parse_json(response, FUSED_RESPONSE_SCHEMA, 'fused_analyzer')
+        if result is None:
+            raise GeminiError("Fused response did not match the analysis schema")
+        
+        return {
+            "metrics": result['metrics'],
+            "risks": result['risks'],
+            "thesis": result['thesis']
+        }
+    
+    def _map_chunks(self, document: str, analyze: Callable[[Compaction], Dict[str, Any]],
+                    merge: Callable[[List[Dict[str, Any]]], Dict[str, Any]], template: str,
+                    budget_share: float = 1.0) -> Dict[str, Any]:
+        """Run a stage over compacted document chunks in parallel and merge the partial results
+        
+        The document is compacted first (boilerplate, duplicates, tables), and if it then fits in
+        chunk_tokens it goes straight through. Longer ones are split on section and paragraph
+        boundaries, only as many chunks as budget_share of max_document_tokens allows are analyzed,
+        and a chunk still over chunk_tokens keeps the sections that matter most to template.
+        Failed chunks are dropped; the stage fails only if every chunk fails.
+        """
+        original_tokens = count_tokens(document)
+        compacted = compact_text(document)
+        compacted_tokens = count_tokens(compacted)
+        if compacted_tokens <= self.chunk_tokens:
+            return analyze(Compaction(compacted, original_tokens, compacted_tokens))
+        
+        # Splitting works in characters; this document's own density converts the token budget
+        chunks = split_document(compacted, max(1, self.chunk_tokens * len(compacted) // compacted_tokens))
+        limit = int(self.max_document_tokens * budget_share) // self.chunk_tokens
+        chunks = [fit_to_budget(chunk, self.chunk_tokens, template) for chunk in select_chunks(chunks, max(1, limit))]
+        # What the same text would have cost before cleanup
+        chunks = [Compaction(chunk, round(count_tokens(chunk) * original_tokens / compacted_tokens)) for chunk in chunks]
+        
+        parts, errors = [], []
+        with ThreadPoolExecutor(max_workers=self.chunk_workers,
+                                initializer=_attach_script_run_ctx,
+                                initargs=(get_script_run_ctx(),)) as executor:
+            # Copy the context so chunk calls are still attributed to the calling stage
+            futures = [executor.submit(contextvars.copy_context().run, analyze, chunk) for chunk in chunks]
+            for future in futures:
+                try:
+                    parts.append(future.result())
+                except GeminiError as e:
+                    errors.append(e)
+        
+        if not parts:
+            raise errors[0]
+        return merge(parts)
+    
     def compare_companies(self, company_a: str, company_b: str) -> Dict[str, Any]:
         """Compare two companies"""
+        part_a = compact_document(company_a, COMPARISON_DOCUMENT_TOKENS, 'metrics_extractor')
+        part_b = compact_document(company_b, COMPARISON_DOCUMENT_TOKENS, 'metrics_extractor')
         prompt = self.prompts['comparative_analyzer'].format(
-            company_a=company_a[:1500], 
-            company_b=company_b[:1500]
+            company_a=part_a.text, 
+            company_b=part_b.text
         )
-        response = self._call_gemini(prompt)
-        
-        # Try multiple parsing strategies
-        parsing_strategies = [
-            # Strategy 1: Direct JSON
-            lambda r: json.loads(r.strip()),
-            # Strategy 2: JSON in markdown code blocks
-            lambda r: json.loads(r.strip().replace('```json', '').replace('```', '').strip()),
-            # Strategy 3: Extract JSON from text
-            lambda r: json.loads(r[r.find('{'):r.rfind('}')+1]),
-            # Strategy 4: Try to find any JSON-like structure
-            lambda r: json.loads(r[r.find('['):r.rfind(']')+1]) if '[' in r and ']' in r else json.loads(r[r.find('{'):r.rfind('}')+1])
-        ]
-        
-        for strategy in parsing_strategies:
-            try:
-                result = strategy(response)
-                if isinstance(result, dict):
-                    return result
-            except:
-                continue
+        response = self._call_gemini(prompt, 'comparative_analyzer', compaction=Compaction(
+            part_a.text + part_b.text, part_a.original_tokens + part_b.original_tokens, part_a.tokens + part_b.tokens),
+            schema=COMPARISON_SCHEMA)
+        
+        result = self._parse_json(response, COMPARISON_SCHEMA, 'comparative_analyzer')
+        if result is not None:
+            return result
         
         # If all parsing fails, create structured response from text
         st.info("📝 Creating structured comparison from text response...")
@@ -361,66 +764,795 @@ class TerminalXGeminiAI:
             "raw_response": response[:500] + "..." if len(response) > 500 else response
         }
     
-    def generate_summary(self, analysis: Dict[str, Any]) -> str:
-        """Generate executive summary"""
-        analysis_text = json.dumps(analysis, indent=2)
-        prompt = self.prompts['summary_generator'].format(analysis=analysis_text)
-        return self._call_gemini(prompt)
+    def company_profile(self, document: str, store: Optional[AnalysisStore] = None) -> Dict[str, Any]:
+        """Metrics and risks of one company document for portfolio comparison
+        
+        The most recent PROFILE_CACHE_SIZE profiles are kept per document hash, and a document
+        already in the analysis store is profiled from its stored result without any Gemini call,
+        as long as that run's metrics and risks both succeeded; otherwise it is extracted again.
+        """
+        doc_hash = document_hash(document)
+        with self._profiles_lock:
+            if doc_hash in self._profiles:
+                self._profiles.move_to_end(doc_hash)
+                return self._profiles[doc_hash]
+        
+        def build() -> Dict[str, Any]:
+            stored = store.latest_for_document(doc_hash) if store is not None else None
+            if stored is not None and _profiled(stored['result']):
+                result = stored['result']
+                return {"metrics": result.get('metrics') or {}, "metric_sources": result.get('metric_sources') or {},
+                        "risks": result.get('risks') or {}, "source": "history"}
+            metrics = self.extract_metrics(document)
+            return {"metric_sources": metrics.pop('_sources', {}), "metrics": metrics,
+                    "risks": self.analyze_risks(document), "source": "analysis"}
+        
+        # Comparisons running at the same time share the profiling of companies they have in common
+        profile = self.single_flight.do(('profile', doc_hash), build)[0] if self.single_flight is not None else build()
+        with self._profiles_lock:
+            self._profiles[doc_hash] = profile
+            while len(self._profiles) > PROFILE_CACHE_SIZE:
+                self._profiles.popitem(last=False)
+        return profile
+    
+    def compare_portfolio(self, companies: Dict[str, str], store: Optional[AnalysisStore] = None,
+                          narrative: bool = True) -> Dict[str, Any]:
+        """Rank and compare any number of companies, given as {name: document}
+        
+        Each company is profiled once (see company_profile) and the ranking and head-to-head matrix
+        are computed locally, so the Gemini calls grow linearly with the number of companies plus
+        one narrative call, instead of one call per pair.
+        """
+        # pandas is only needed for portfolio comparison
+        from portfolio import metric_table, narrative_context, rank_companies, records, win_matrix
+        
+        start_time = time.time()
+        metrics = PipelineMetrics()
+        profiles, errors = {}, {}
+        with stage_scope(metrics, 'profiles'):
+            with ThreadPoolExecutor(max_workers=self.max_workers,
+                                    initializer=_attach_script_run_ctx,
+                                    initargs=(get_script_run_ctx(),)) as executor:
+                futures = {name: executor.submit(contextvars.copy_context().run, self.company_profile, document, store)
+                           for name, document in companies.items()}
+                for name, future in futures.items():
+                    try:
+                        profiles[name] = future.result()
+                    except GeminiError as e:
+                        errors[name] = str(e)
+        
+        table = metric_table(profiles)
+        ranking = rank_companies(table)
+        matrix = win_matrix(table)
+        
+        summary = None
+        if narrative and len(profiles) > 1:
+            with stage_scope(metrics, 'narrative'):
+                prompt = self.prompts['portfolio_analyzer'].format(
+                    count=len(profiles), companies=narrative_context(table, ranking))
+                try:
+                    summary = self._call_gemini(prompt, 'portfolio_analyzer')
+                except GeminiError as e:
+                    errors['narrative'] = str(e)
+        
+        return {
+            "companies": list(profiles),
+            "profile_sources": {name: profile['source'] for name, profile in profiles.items()},
+            "metric_table": records(table),
+            "ranking": records(ranking),
+            "win_matrix": records(matrix),
+            "narrative": summary,
+            "errors": errors,
+            "instrumentation": metrics.summary(),
+            "processing_seconds": round(time.time() - start_time, 3)
+        }
+    
+    def open_session(self, document: str, analysis: Optional[Dict[str, Any]] = None) -> DocumentSession:
+        """Start follow-up Q&A on a document, optionally carrying its process_document result
+        
+        Nothing is sent until the first question; see ask.
+        """
+        return DocumentSession(document, document_hash(document), analysis)
+    
+    def _session_context(self, session: DocumentSession) -> DocumentContext:
+        """The session's cached context on the model Q&A is routed to, created on first use
+        
+        The context is uploaded to the provider's context cache when the backend supports it; a
+        failed or unsupported upload leaves a local prefix that is sent with every question.
+        """
+        model = self.router.route('document_qa')[0]
+        if session.context_text is None:
+            analysis = {key: session.analysis.get(key) for key in SESSION_ANALYSIS_KEYS} if session.analysis else {}
+            session.context_text = self.prompts['document_context'].format(
+                analysis=compact_json(analysis).text,
+                document=fit_to_budget(compact_text(session.document), SESSION_DOCUMENT_TOKENS))
+        
+        def upload(text: str, ttl_seconds: float):
+            stats = CallStats('document_context', model)
+            started = time.perf_counter()
+            name = None
+            try:
+                name = self.router.clients[model].create_context(text, ttl_seconds)
+            except GeminiError as e:
+                logger.warning("Context caching failed, sending the document with each question: %s", e)
+                stats.error = type(e).__name__
+            if name is not None:
+                # Caching the text bills it once; every question then reads it at the cached rate
+                stats.prompt_tokens = count_tokens(text)
+            stats.wall_seconds = time.perf_counter() - started
+            if name is not None or stats.error is not None:
+                record_call(stats)
+            return name, count_tokens(text)
+        
+        return self.contexts.get(model, session.context_text, upload)
+    
+    def ask(self, session: DocumentSession, question: str,
+            on_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Answer a follow-up question about the session's document
+        
+        Only the question and the last few turns are sent with a reference to the cached context,
+        so the document is not paid for again on every question. A context the provider has
+        expired is re-created once. on_text streams the answer.
+        """
+        start_time = time.time()
+        metrics = PipelineMetrics()
+        history = "".join(f"\nQ: {asked}\nA: {fit_to_budget(answer, 200)}\n" for asked, answer in session.history())
+        prompt = self.prompts['document_qa'].format(
+            history=f"\nEarlier questions:{history}" if history else "", question=question.strip())
+        with stage_scope(metrics, 'document_qa'):
+            for attempt in range(2):
+                context = self._session_context(session)
+                try:
+                    answer = self._call_gemini(prompt, 'document_qa', on_text=on_text, context=context)
+                    break
+                except ContextExpiredError:
+                    self.contexts.invalidate(context)
+                    if attempt:
+                        raise
+        context.questions += 1
+        
+        totals = metrics.summary()['totals']
+        turn = {
+            "question": question,
+            "answer": answer,
+            "context": context.to_dict(),
+            "prompt_tokens": totals['prompt_tokens'],
+            "cached_tokens": totals['cached_tokens'],
+            "cost_usd": totals['cost_usd'],
+            "instrumentation": metrics.summary(),
+            "processing_seconds": round(time.time() - start_time, 3)
+        }
+        session.add_turn(turn)
+        return turn
+    
+    def generate_summary(self, analysis: Dict[str, Any],
+                         on_text: Optional[Callable[[str], None]] = None) -> str:
+        """Generate executive summary, optionally streaming it to on_text"""
+        compaction = compact_json(analysis)
+        prompt = self.prompts['summary_generator'].format(analysis=compaction.text)
+        return self._call_gemini(prompt, 'summary_generator', on_text=on_text, compaction=compaction)
     
     def quality_check(self, analysis: Dict[str, Any]) -> str:
         """Quality check the analysis"""
-        analysis_text = json.dumps(analysis, indent=2)
-        prompt = self.prompts['quality_checker'].format(analysis=analysis_text)
-        return self._call_gemini(prompt)
+        compaction = compact_json(analysis)
+        prompt = self.prompts['quality_checker'].format(analysis=compaction.text)
+        return self._call_gemini(prompt, 'quality_checker', compaction=compaction)
     
-    def process_document(self, document: str) -> Dict[str, Any]:
-        """Complete document processing pipeline"""
-        st.info("🔄 Processing document with Terminal X AI (Gemini)...")
+    def _pipeline_stages(self, fused: bool = False,
+                         on_stream: Optional[Callable[[str, str], None]] = None,
+                         ticker: Optional[str] = None,
+                         profile: Optional[PipelineProfile] = None,
+                         quality_sample: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """Stage dependency graph used by process_document
         
-        # Step 1: Classify document
-        with st.spinner("Classifying document type..."):
-            doc_type = self.classify_document(document)
+        profile (default: every stage, no early exit) chooses the stages. A stage's optional 'skip'
+        returns why it should not run, given the document and the finished stages; its dependants are
+        skipped with it unless they list it under 'optional'.
+        """
+        profile = profile or PIPELINE_PROFILES['deep']
+        quality_sample = profile.quality_sample if quality_sample is None else quality_sample
         
-        # Step 2: Extract metrics
-        with st.spinner("Extracting financial metrics..."):
-            metrics = self.extract_metrics(document)
+        def stream_to(stage: str) -> Optional[Callable[[str], None]]:
+            return (lambda text: on_stream(stage, text)) if on_stream is not None else None
         
-        # Step 3: Analyze risks
-        with st.spinner("Analyzing risks..."):
-            risks = self.analyze_risks(document)
+        stages = {
+            'document_type': {
+                'label': 'Document classification',
+                'deps': [],
+                'run': lambda document, done: self.classify_document_with_source(document)
+            }
+        }
         
-        # Step 4: Generate investment thesis
-        with st.spinner("Generating investment thesis..."):
-            thesis = self.generate_thesis(document)
+        # With early exit, stages are skipped for documents triage finds low-value. Classification is
+        # not waited for: it is only used once it has finished (the analysis stages start alongside it,
+        # the quality check and summary usually after it), and a failed one means no classification
+        # triage. Skip checks run on the scheduling thread, so each triage runs once per pipeline
+        triaged: Dict[bool, Optional[str]] = {}
         
-        # Step 5: Quality check
-        with st.spinner("Quality checking analysis..."):
-            quality = self.quality_check({
-                "metrics": metrics,
-                "risks": risks,
-                "thesis": thesis
-            })
+        def low_value(document: str, done: Dict[str, Any]) -> Optional[str]:
+            classified = 'document_type' in done
+            if classified not in triaged:
+                triaged[classified] = self.triage(document, done.get('document_type'))
+            return triaged[classified]
         
-        # Step 6: Generate summary
-        with st.spinner("Generating executive summary..."):
-            summary = self.generate_summary({
-                "metrics": metrics,
-                "risks": risks,
-                "thesis": thesis,
-                "quality_check": quality
+        # With a ticker the thesis waits for the price indicators, read from local bars after the first refresh
+        thesis_deps = []
+        market_context = lambda done: None
+        if ticker and (fused or profile.thesis):
+            stages['market_data'] = {
+                'label': 'Market data',
+                'deps': [],
+                'config': ticker.upper(),
+                'run': lambda document, done: self.price_context(ticker)
+            }
+            thesis_deps = ['market_data']
+            market_context = lambda done: (done['market_data'] or {}).get('context')
+        
+        if fused:
+            stages['analysis'] = {
+                'label': 'Metrics, risks & thesis (single call)',
+                'deps': thesis_deps,
+                'run': lambda document, done: self.fused_analysis(document, market_context(done))
+            }
+            analysis_deps = ['analysis']
+            analysis = lambda done: dict(done['analysis'])
+            extracted = lambda done: _public((done['analysis'] or {}).get('metrics'))
+        else:
+            stages.update({
+                'metrics': {
+                    'label': 'Financial metrics extraction',
+                    'deps': [],
+                    'run': lambda document, done: self.extract_metrics(document)
+                },
+                'risks': {
+                    'label': 'Risk analysis',
+                    'deps': [],
+                    'run': lambda document, done: self.analyze_risks(document)
+                }
             })
+            analysis_deps = ['metrics', 'risks']
+            if profile.thesis:
+                stages['thesis'] = {
+                    'label': 'Investment thesis',
+                    'deps': thesis_deps,
+                    'run': lambda document, done: self.generate_thesis(document, on_text=stream_to('thesis'),
+                                                                       market_context=market_context(done))
+                }
+                analysis_deps.append('thesis')
+            analysis = lambda done: {key: _public(done[key]) for key in analysis_deps}
+            extracted = lambda done: _public(done['metrics'])
+        if profile.early_exit:
+            for name in analysis_deps:
+                stages[name]['skip'] = low_value
+        
+        # Nor is an analysis without a single metric worth reviewing or summarizing
+        def nothing_extracted(document: str, done: Dict[str, Any]) -> Optional[str]:
+            if not profile.early_exit:
+                return None
+            if not any(value for value in (extracted(done) or {}).values()):
+                return "No metrics could be extracted"
+            return low_value(document, done)
+        
+        def sampled_out(document: str, done: Dict[str, Any]) -> Optional[str]:
+            reason = nothing_extracted(document, done)
+            if reason:
+                return reason
+            label = (done.get('document_type') or {}).get('label', 'unknown')
+            rate = self.quality_stats.sample_rate(label, quality_sample)
+            return None if in_sample(document_hash(document), rate) else QUALITY_NOT_SAMPLED
+        
+        if quality_sample > 0:
+            stages['quality_check'] = {
+                'label': 'Quality check',
+                'deps': analysis_deps,
+                'skip': sampled_out,
+                'run': lambda document, done: self.quality_check(analysis(done))
+            }
+        if profile.summary:
+            stages['summary'] = {
+                'label': 'Executive summary',
+                'deps': analysis_deps + (['quality_check'] if 'quality_check' in stages else []),
+                'optional': ['quality_check'],
+                'skip': nothing_extracted,
+                'run': lambda document, done: self.generate_summary({
+                    **analysis(done),
+                    "quality_check": done.get('quality_check')
+                }, on_text=stream_to('summary'))
+            }
+        return stages
+    
+    def _stage_key(self, name: str, stage: Dict[str, Any], doc_hash: str, done: Dict[str, Any]) -> str:
+        """Identity of one stage run: model, stage, its own settings, the document and its inputs"""
+        inputs = {dep: done.get(dep) for dep in stage['deps']}
+        payload = json.dumps([self.model_name, name, stage.get('config'), doc_hash, inputs],
+                             sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def _run_stage(self, metrics: PipelineMetrics, name: str, stage: Dict[str, Any],
+                   document: str, done: Dict[str, Any], queued_at: float, doc_hash: str) -> Any:
+        """Run one stage on a worker thread, timing it and attributing its Gemini calls
+        
+        An identical stage already running in another pipeline (same document, settings and
+        inputs) is waited for instead of repeated; its calls are attributed to that pipeline.
+        """
+        started = time.perf_counter()
+        try:
+            with stage_scope(metrics, name):
+                if self.single_flight is None:
+                    return stage['run'](document, done)
+                result, shared = self.single_flight.do(self._stage_key(name, stage, doc_hash, done),
+                                                       lambda: stage['run'](document, done))
+                if shared:
+                    record_event('coalesced')
+                return result
+        finally:
+            metrics.stage_timing(name, started - queued_at, time.perf_counter() - started)
+    
+    def _run_stages(self, document: str, stages: Dict[str, Dict[str, Any]],
+                    on_progress: Callable[[str, str], None],
+                    metrics: Optional[PipelineMetrics] = None,
+                    cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        """Run pipeline stages concurrently, starting each one as soon as its dependencies finish
+        
+        A stage that raises GeminiError is recorded in the returned '_errors' dict and every
+        stage depending on it is skipped instead of being fed placeholder text. Stages whose 'skip'
+        gives a reason, and their dependants, are recorded in '_skipped' without being an error.
+        Once cancel is set no further stages start; stages already running finish normally.
+        """
+        metrics = metrics if metrics is not None else PipelineMetrics()
+        done: Dict[str, Any] = {}
+        errors: Dict[str, str] = {}
+        skipped: Dict[str, str] = {}
+        pending = dict(stages)
+        running = {}
+        doc_hash = document_hash(document)
+        for name in stages:
+            on_progress(name, 'waiting')
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers,
+                                initializer=_attach_script_run_ctx,
+                                initargs=(get_script_run_ctx(),)) as executor:
+            while pending or running:
+                if cancel is not None and cancel.is_set():
+                    for name in pending:
+                        errors[name] = "Cancelled"
+                        on_progress(name, 'cancelled')
+                    pending.clear()
+                
+                for name, stage in list(pending.items()):
+                    failed = [dep for dep in stage['deps'] if dep in errors]
+                    if failed:
+                        pending.pop(name)
+                        errors[name] = f"Skipped: {', '.join(failed)} failed"
+                        on_progress(name, 'skipped')
+                        continue
+                    left_out = [dep for dep in stage['deps']
+                                if dep in skipped and dep not in stage.get('optional', [])]
+                    if left_out:
+                        pending.pop(name)
+                        skipped[name] = skipped[left_out[0]]
+                        on_progress(name, 'skipped')
+                
+                ready = [name for name, stage in pending.items()
+                         if all(dep in done or dep in skipped for dep in stage['deps'])]
+                if not ready and not running:
+                    if pending:
+                        raise ValueError(f"Unsatisfiable stage dependencies: {sorted(pending)}")
+                    break
+                
+                for name in ready:
+                    stage = pending.pop(name)
+                    reason = stage['skip'](document, done) if 'skip' in stage else None
+                    if reason:
+                        skipped[name] = reason
+                        on_progress(name, 'skipped')
+                        continue
+                    on_progress(name, 'running')
+                    running[executor.submit(self._run_stage, metrics, name, stage, document,
+                                            dict(done), time.perf_counter(), doc_hash)] = name
+                
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        done[name] = future.result()
+                        on_progress(name, 'done')
+                    except GeminiError as e:
+                        errors[name] = f"{type(e).__name__}: {e}"
+                        on_progress(name, 'failed')
+        
+        done['_errors'] = errors
+        done['_skipped'] = skipped
+        return done
+    
+    def _streamlit_progress(self, stages: Dict[str, Dict[str, Any]]) -> Callable[[str, str], None]:
+        """Render one status line per stage and return a callback that updates them"""
+        lines = {name: st.empty() for name in stages}
+        
+        def on_progress(name: str, status: str):
+            lines[name].markdown(f"{STAGE_ICONS[status]} {stages[name]['label']}")
+        
+        return on_progress
+    
+    def process_document(self, document: str,
+                         on_progress: Optional[Callable[[str, str], None]] = None,
+                         fused: bool = False,
+                         on_stream: Optional[Callable[[str, str], None]] = None,
+                         ticker: Optional[str] = None,
+                         cancel: Optional[threading.Event] = None,
+                         profile: str = DEFAULT_PROFILE,
+                         quality_sample: Optional[float] = None) -> Dict[str, Any]:
+        """Complete document processing pipeline
+        
+        Classification, metrics, risks and thesis only need the raw document and
+        run in parallel; quality check and summary start once their inputs are ready.
+        With fused=True metrics, risks and thesis come from one schema-constrained call.
+        With on_stream, thesis and summary are streamed as on_stream(stage, text_so_far).
+        With a ticker, price indicators from local market data are added to the thesis prompt.
+        Setting cancel stops stages that have not started yet (see _run_stages).
+        profile (see pipeline_profiles) chooses the stages, early exit for low-value documents
+        and the share of documents quality checked; quality_sample overrides that share.
+        """
+        st.info("🔄 Processing document with Terminal X AI (Gemini)...")
+        
+        started = time.perf_counter()
+        metrics = PipelineMetrics()
+        pipeline_profile = get_profile(profile)
+        stages = self._pipeline_stages(fused, on_stream, ticker, pipeline_profile, quality_sample)
+        if on_progress is None:
+            on_progress = self._streamlit_progress(stages)
+        results = self._run_stages(document, stages, on_progress, metrics, cancel)
+        elapsed = time.perf_counter() - started
+        skipped = results['_skipped']
+        early_exit = next((reason for reason in skipped.values() if reason != QUALITY_NOT_SAMPLED), None)
+        REGISTRY.observe_document(elapsed, pipeline_profile.name, early_exit is not None)
+        if fused:
+            # Split the single fused response into the usual result shape
+            results.update(results.pop('analysis', {}))
+        classification = results.get('document_type') or {"label": "unknown", "source": None, "confidence": None}
+        if isinstance(results.get('quality_check'), str):
+            passed = quality_passed(results['quality_check'])
+            self.quality_stats.record(classification['label'], passed)
+            REGISTRY.observe_quality(classification['label'], passed)
+        # Stage results may be shared with coalesced pipelines, so they are copied rather than modified
+        metrics_result = results.get('metrics')
+        metric_sources = metrics_result.get('_sources') if isinstance(metrics_result, dict) else None
+        instrumentation = metrics.summary()
         
         return {
-            "document_type": doc_type,
-            "metrics": metrics,
-            "risks": risks,
-            "thesis": thesis,
-            "quality_check": quality,
-            "summary": summary,
+            "document_hash": document_hash(document),
+            "document_type": classification['label'],
+            "document_type_source": classification['source'],
+            "document_type_confidence": classification['confidence'],
+            "metrics": _public(metrics_result),
+            "metric_sources": metric_sources,
+            "risks": results.get('risks'),
+            "thesis": results.get('thesis'),
+            "quality_check": results.get('quality_check'),
+            "summary": results.get('summary'),
+            "market_data": results.get('market_data'),
+            "errors": results['_errors'],
+            "skipped": skipped,
+            "early_exit": early_exit,
+            "pipeline_mode": "fused" if fused else "multi-call",
+            "pipeline_profile": pipeline_profile.name,
+            "instrumentation": instrumentation,
+            "processing_seconds": round(elapsed, 3),
             "processing_time": datetime.now().isoformat(),
-                               "ai_model": "Gemini 2.5 Pro"
+            # Templates are routed to different models, and calls may fail over or be hedged
+            "ai_models": sorted({call['model'] for call in instrumentation['calls'] if call['model']})
         }
 
+@st.cache_resource
+def get_ai() -> TerminalXGeminiAI:
+    """Process-wide AI client shared by every session and rerun"""
+    return TerminalXGeminiAI()
+
+@st.cache_resource
+def get_store() -> AnalysisStore:
+    """Process-wide store of past analyses"""
+    return AnalysisStore()
+
+@st.cache_resource
+def get_ingestor() -> DocumentIngestor:
+    """Process-wide document ingestor; extracted text is cached on disk by content hash"""
+    return DocumentIngestor()
+
+def read_upload(uploaded_file) -> str:
+    """Extract an uploaded TXT/PDF/DOCX page by page, showing progress for long files"""
+    progress = st.empty()
+    
+    def on_page(pages: int):
+        if pages % 10 == 0:
+            progress.caption(f"📄 Extracted {pages} pages...")
+    
+    try:
+        return get_ingestor().read_text(uploaded_file, uploaded_file.name, on_page=on_page)
+    finally:
+        progress.empty()
+
+@st.cache_data
+def load_sample(path: str) -> str:
+    """Read a bundled sample document once per process"""
+    with open(path, "r") as f:
+        return f.read()
+
+@st.cache_resource
+def get_jobs() -> JobQueue:
+    """Process-wide background analysis queue shared by every session"""
+    return JobQueue(max_workers=JOB_WORKERS)
+
+def _analysis_job(ai: TerminalXGeminiAI, store: AnalysisStore, document: str, title: Optional[str],
+                  fused: bool, stream: bool, ticker: Optional[str],
+                  profile: str = DEFAULT_PROFILE) -> Callable[[Job], Dict[str, Any]]:
+    """Job body: run the pipeline and save the result to the history store unless cancelled"""
+    def run(job: Job) -> Dict[str, Any]:
+        results = ai.process_document(
+            document,
+            on_progress=job.on_progress,
+            fused=fused,
+            on_stream=job.on_stream if stream else None,
+            ticker=ticker,
+            cancel=job.cancel_event,
+            profile=profile
+        )
+        if not job.cancel_event.is_set():
+            store.save(document, results, title=title)
+        return results
+    return run
+
+def _render_job_progress(job: Job):
+    """Stage status lines, plus thesis and summary text as it streams in"""
+    st.markdown(f"**🔄 Analyzing {job.title}** · {job.elapsed:.0f}s")
+    for name, status in list(job.stages.items()):
+        st.markdown(f"{STAGE_ICONS[status]} {name.replace('_', ' ').title()}")
+    
+    streams = dict(job.streams)
+    if 'thesis' in streams:
+        parser = IncrementalJSONParser("{")
+        parser.feed(streams['thesis'])
+        partial = parser.partial()
+        if partial:
+            st.json(partial)
+        else:
+            st.code(streams['thesis'], language="json")
+    if 'summary' in streams:
+        st.markdown(streams['summary'])
+
+def _poll_job(job_id: str):
+    """Progress panel of the session's running job; reruns the whole app once the job finishes"""
+    jobs = get_jobs()
+    job = jobs.get(job_id)
+    if job is None:
+        return
+    if job.finished:
+        st.rerun()
+    _render_job_progress(job)
+    if st.button("🛑 Cancel Analysis", key=f"cancel_{job_id}", disabled=job.cancel_event.is_set()):
+        jobs.cancel(job_id)
+
+# Streamlit 1.37+ reruns just the progress panel on a timer; older versions rerun the whole script
+_poll_job_fragment = st.fragment(run_every=JOB_POLL_SECONDS)(_poll_job) if hasattr(st, "fragment") else None
+
+def _render_stage_timing(results: Dict[str, Any]):
+    """Timing panel: latency, wait, tokens (and tokens saved by compaction), retries, cache hits and cost per stage"""
+    instrumentation = results['instrumentation']
+    totals = instrumentation['totals']
+    
+    with st.expander(f"⏱️ Stage Timing — {results['processing_seconds']:.1f}s, "
+                     f"{totals['prompt_tokens'] + totals['response_tokens']:,} tokens, "
+                     f"${totals['cost_usd']:.4f}"):
+        import pandas as pd
+        timing_df = pd.DataFrame.from_dict(instrumentation['stages'], orient='index')
+        st.dataframe(timing_df[['wall_seconds', 'queue_seconds', 'first_token_seconds', 'calls', 'wait_seconds',
+                                'prompt_tokens', 'tokens_saved', 'response_tokens', 'retries', 'cache_hits',
+                                'cost_usd']])
+        if totals['tokens_saved']:
+            st.caption(f"Prompt compaction saved {totals['tokens_saved']:,} input tokens "
+                       f"({totals['tokens_saved'] / (totals['prompt_tokens'] + totals['tokens_saved']):.0%})")
+        quality = get_ai().quality_stats.report()
+        if quality['checks']:
+            always = [document_type for document_type, stats in quality['by_document_type'].items()
+                      if stats['checked_always']]
+            st.caption(f"Sampled quality checks (live) — {quality['passed']} of {quality['checks']} passed"
+                       + (f"; now checking every {', '.join(always)}" if always else ""))
+        routing = get_ai().router.report()
+        st.caption(f"Model health (live) — {routing['hedges']} hedged requests, "
+                   f"{routing['hedge_wins']} won by the backup model")
+        if routing['models']:
+            st.dataframe(pd.DataFrame(routing['models']).set_index('model'))
+        st.caption("Prometheus metrics for this process")
+        st.code(REGISTRY.to_prometheus(), language="text")
+
+def _render_results(results: Dict[str, Any]):
+    """Classification, metrics, risks, thesis, quality check, summary, timing and download"""
+    for stage, error in results['errors'].items():
+        st.error(f"❌ {stage.replace('_', ' ').title()}: {error}")
+    if results.get('early_exit'):
+        st.warning(f"⏭️ Stopped early as a low-value document: {results['early_exit']}. "
+                   f"Skipped: {', '.join(stage.replace('_', ' ') for stage in results['skipped'])}")
+
+    # Display results
+    col1, col2 = st.columns(2)
+
+    with col1:
+        st.subheader("📊 Document Classification")
+        st.info(f"**Type:** {results['document_type'].replace('_', ' ').title()}")
+        if results.get('document_type_source') == 'local':
+            st.caption(f"Classified locally ({results['document_type_confidence']:.0%} confidence)")
+
+        st.subheader("💰 Financial Metrics")
+        if results['metrics']:
+            import pandas as pd
+            metrics_df = pd.DataFrame([results['metrics']])
+            st.dataframe(metrics_df)
+
+            sources = results.get('metric_sources') or {}
+            local_fields = [field for field, source in sources.items() if source['source'] == 'local']
+            if local_fields:
+                st.caption(f"{len(local_fields)} of {len(sources)} metrics read directly from the document; "
+                           f"the rest from Gemini")
+
+            # Show raw response if available
+            if 'raw_response' in results['metrics']:
+                with st.expander("📝 Raw AI Response"):
+                    st.text(results['metrics']['raw_response'])
+
+        st.subheader("⚠️ Risk Analysis")
+        if results['risks']:
+            st.json(results['risks'])
+
+            # Show raw response if available
+            if 'raw_response' in results['risks']:
+                with st.expander("📝 Raw AI Response"):
+                    st.text(results['risks']['raw_response'])
+
+    with col2:
+        if results.get('market_data'):
+            st.subheader("📈 Price Context")
+            st.text(results['market_data']['context'])
+        
+        st.subheader("🎯 Investment Thesis")
+        if results['thesis']:
+            st.json(results['thesis'])
+
+            # Show raw response if available
+            if 'raw_response' in results['thesis']:
+                with st.expander("📝 Raw AI Response"):
+                    st.text(results['thesis']['raw_response'])
+
+        st.subheader("✅ Quality Check")
+        if results['quality_check']:
+            st.info(results['quality_check'])
+        elif results.get('skipped', {}).get('quality_check') == QUALITY_NOT_SAMPLED:
+            st.caption(f"Not sampled for a quality check in the {results['pipeline_profile']} profile")
+
+    st.subheader("📋 Executive Summary")
+    if results['summary']:
+        st.markdown(results['summary'])
+
+    _render_stage_timing(results)
+
+    # Download results
+    st.download_button(
+        label="📥 Download Analysis Report",
+        data=json.dumps(results, indent=2),
+        file_name=f"terminal_x_gemini_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+        mime="application/json"
+    )
+
+def _render_history(store: AnalysisStore, document_types: List[str]):
+    """Sidebar search over past analyses; opening one shows it without any Gemini calls"""
+    with st.sidebar.expander(f"🗂️ Analysis History ({store.count()})"):
+        query = st.text_input("Search past analyses", key="history_query")
+        document_type = st.selectbox("Document type", ["All"] + document_types, key="history_type")
+        recommendation = st.selectbox("Recommendation", ["All", "POSITIVE", "NEUTRAL", "NEGATIVE"],
+                                      key="history_recommendation")
+        matches = store.search(query,
+                               document_type=None if document_type == "All" else document_type,
+                               recommendation=None if recommendation == "All" else recommendation,
+                               limit=10)
+        for match in matches:
+            when = datetime.fromtimestamp(match['created_at']).strftime('%Y-%m-%d %H:%M')
+            if st.button(f"{match['title'][:40]} · {when}", key=f"history_{match['id']}"):
+                st.session_state['analysis'] = {'results': store.get(match['id']), 'source': 'history'}
+            if match['snippet']:
+                st.caption(match['snippet'])
+
+def _render_portfolio(ai: TerminalXGeminiAI, store: AnalysisStore) -> bool:
+    """Upload several company documents and rank them; returns True if a comparison ran"""
+    st.header("📊 Portfolio Comparison")
+    st.markdown("Rank any number of companies: one profile per document plus a single narrative call")
+    
+    uploaded_files = st.file_uploader("Upload one document per company", type=['txt', 'pdf', 'docx'],
+                                      accept_multiple_files=True, key="portfolio_files")
+    compared = False
+    if uploaded_files and len(uploaded_files) > 1 and st.button("📊 Compare Companies"):
+        compared = True
+        companies = {}
+        for uploaded_file in uploaded_files:
+            try:
+                companies[os.path.splitext(uploaded_file.name)[0]] = read_upload(uploaded_file)
+            except IngestionError as e:
+                st.error(f"❌ {uploaded_file.name}: {e}")
+        with st.spinner(f"Profiling {len(companies)} companies..."):
+            st.session_state['portfolio'] = ai.compare_portfolio(companies, store=store)
+    
+    comparison = st.session_state.get('portfolio')
+    if not comparison:
+        return compared
+    
+    import pandas as pd
+    for name, error in comparison['errors'].items():
+        st.error(f"❌ {name}: {error}")
+    
+    totals = comparison['instrumentation']['totals']
+    st.caption(f"{len(comparison['companies'])} companies compared with {totals['calls']} Gemini calls "
+               f"({totals['cache_hits']} cached) in {comparison['processing_seconds']:.1f}s")
+    
+    st.subheader("🏆 Ranking")
+    st.dataframe(pd.DataFrame(comparison['ranking']).set_index('company'))
+    st.subheader("⚔️ Head-to-Head")
+    st.caption("Share of commonly reported metrics on which the row company beats the column company")
+    st.dataframe(pd.DataFrame(comparison['win_matrix']).set_index('company'))
+    with st.expander("📋 Metric Table"):
+        st.dataframe(pd.DataFrame(comparison['metric_table']).set_index('company'))
+    if comparison['narrative']:
+        st.subheader("🧭 Portfolio Narrative")
+        st.markdown(comparison['narrative'])
+    return compared
+
+def _render_qa(ai: TerminalXGeminiAI, document: str, results: Dict[str, Any]) -> bool:
+    """Follow-up questions on the shown analysis; returns True if a question was answered on this rerun"""
+    st.subheader("💬 Ask About This Document")
+    # One session per document per browser session; the cached context is shared server-wide
+    sessions = st.session_state.setdefault('qa_sessions', {})
+    session = sessions.get(results['document_hash'])
+    if session is None:
+        session = sessions[results['document_hash']] = ai.open_session(document, results)
+    
+    for turn in session.turns:
+        st.markdown(f"**Q:** {turn['question']}")
+        st.markdown(turn['answer'])
+        st.caption(f"{turn['prompt_tokens']:,} prompt tokens ({turn['cached_tokens']:,} from the "
+                   f"{turn['context']['source']} context cache) · {turn['processing_seconds']:.1f}s")
+    
+    with st.form("qa_form", clear_on_submit=True):
+        question = st.text_input("Follow-up question", placeholder="e.g. What drove services growth?")
+        asked = st.form_submit_button("Ask") and bool(question and question.strip())
+    if not asked:
+        return False
+    
+    st.markdown(f"**Q:** {question}")
+    answer = st.empty()
+    try:
+        turn = ai.ask(session, question, on_text=answer.markdown)
+    except GeminiError as e:
+        st.error(f"❌ Could not answer: {e}")
+        return True
+    totals = session.totals()
+    st.caption(f"{turn['prompt_tokens']:,} prompt tokens ({turn['cached_tokens']:,} from the "
+               f"{turn['context']['source']} context cache) · {totals['questions']} questions, "
+               f"${totals['cost_usd']:.4f} so far")
+    return True
+
+def _render_timings(rerun_seconds: float, analyzed: bool):
+    """Show import and rerun times against their budgets and log any overrun"""
+    over_import = IMPORT_SECONDS > IMPORT_TIME_BUDGET
+    # Reruns that ran an analysis are dominated by API calls, not by the script itself
+    over_rerun = not analyzed and rerun_seconds > RERUN_TIME_BUDGET
+    
+    with st.sidebar.expander("⏱️ App Performance", expanded=over_import or over_rerun):
+        st.caption(f"{'⚠️' if over_import else '✅'} Imports: {IMPORT_SECONDS * 1000:.0f} ms "
+                   f"(budget {IMPORT_TIME_BUDGET * 1000:.0f} ms)")
+        st.caption(f"{'⚠️' if over_rerun else '✅'} Rerun: {rerun_seconds * 1000:.0f} ms "
+                   f"(budget {RERUN_TIME_BUDGET * 1000:.0f} ms)")
+    
+    if over_import:
+        logger.warning("Import time %.3fs exceeds budget of %.3fs", IMPORT_SECONDS, IMPORT_TIME_BUDGET)
+    if over_rerun:
+        logger.warning("Rerun time %.3fs exceeds budget of %.3fs", rerun_seconds, RERUN_TIME_BUDGET)
+
 def main():
     st.set_page_config(
         page_title="Terminal X AI - Financial Research Assistant",
@@ -431,8 +1563,19 @@ def main():
     st.title("🚀 Terminal X AI - Financial Research Assistant")
     st.markdown("**Advanced AI-powered financial document analysis using Google Gemini**")
     
-    # Initialize AI system
-    ai = TerminalXGeminiAI()
+    # Initialize AI system (built once per process, not on every rerun)
+    ai = get_ai()
+    
+    if ai.cache is not None:
+        cache_stats = ai.cache.stats()
+        st.sidebar.caption(
+            f"💾 Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['entries']} entries)"
+        )
+    
+    active_jobs = get_jobs().active()
+    if active_jobs:
+        st.sidebar.caption(f"🧵 {active_jobs} analyses running on this server")
     
     st.header("📄 Document Analysis")
     st.markdown("Upload or paste financial documents for AI-powered analysis")
@@ -441,81 +1584,106 @@ def main():
     doc_input = st.radio("Document Input Method", ["Upload File", "Paste Text", "Use Sample"])
     
     document_text = ""
+    document_title = None
     
     if doc_input == "Upload File":
         uploaded_file = st.file_uploader("Upload financial document", type=['txt', 'pdf', 'docx'])
         if uploaded_file:
-            document_text = uploaded_file.read().decode()
+            document_title = uploaded_file.name
+            try:
+                document_text = read_upload(uploaded_file)
+            except IngestionError as e:
+                st.error(f"❌ {e}")
     
     elif doc_input == "Paste Text":
         document_text = st.text_area("Paste document text here", height=200)
     
     else:  # Use Sample
-        sample_choice = st.selectbox("Choose sample document", ["Investment Memo", "Quarterly Report", "Financial Model"])
-        
-        if sample_choice == "Investment Memo":
-            with open("data/raw/investment_memo.txt", "r") as f:
-                document_text = f.read()
-        elif sample_choice == "Quarterly Report":
-            with open("data/raw/quarterly_report.txt", "r") as f:
-                document_text = f.read()
+        sample_choice = st.selectbox("Choose sample document", list(SAMPLE_DOCUMENTS))
+        document_text = load_sample(SAMPLE_DOCUMENTS[sample_choice])
+        document_title = f"Sample: {sample_choice}"
+    
+    pipeline_mode = st.sidebar.radio(
+        "Pipeline mode",
+        ["Multi-call", "Fused single-call"],
+        help="Fused mode extracts metrics, risks and thesis in one JSON-schema call (~3x fewer tokens)"
+    )
+    
+    profile = st.sidebar.selectbox(
+        "Pipeline profile", list(PIPELINE_PROFILES), index=list(PIPELINE_PROFILES).index(DEFAULT_PROFILE),
+        format_func=lambda name: PIPELINE_PROFILES[name].label,
+        help="\n\n".join(f"**{p.label}**: {p.description}" for p in PIPELINE_PROFILES.values())
+    )
+    
+    ticker = st.sidebar.text_input(
+        "Ticker (optional)",
+        help="Adds recent returns, volatility and drawdowns from daily market data to the thesis"
+    )
+    
+    stream_output = st.sidebar.checkbox(
+        "Stream thesis & summary", value=True,
+        help="Show text as it is generated instead of waiting for the full response"
+    )
+    
+    store = get_store()
+    _render_history(store, list(ai.document_types))
+    
+    # Re-opening a document analyzed before is an index lookup, not a new analysis
+    doc_hash = document_hash(document_text) if document_text else None
+    previous = store.latest_for_document(doc_hash) if doc_hash else None
+    if previous:
+        when = datetime.fromtimestamp(previous['created_at']).strftime('%Y-%m-%d %H:%M')
+        st.info(f"🗂️ This document was analyzed on {when}")
+        if st.button("📂 Open Previous Analysis"):
+            st.session_state['analysis'] = {'results': previous['result'], 'source': 'history'}
+    
+    # The analysis runs as a background job; reruns only look up its state by id
+    jobs = get_jobs()
+    job = jobs.get(st.session_state.get('job_id'))
+    running = job is not None and not job.finished
+    if document_text and st.button("🚀 Analyze Document", disabled=running):
+        job = jobs.submit(_analysis_job(ai, store, document_text, document_title,
+                                        fused=pipeline_mode == "Fused single-call", stream=stream_output,
+                                        ticker=(ticker or "").strip() or None, profile=profile),
+                          title=document_title or "pasted document")
+        st.session_state['job_id'] = job.id
+        running = True
+    
+    polling = False
+    if running:
+        if _poll_job_fragment is not None:
+            _poll_job_fragment(job.id)
         else:
-            with open("data/raw/financial_model.txt", "r") as f:
-                document_text = f.read()
+            _poll_job(job.id)
+            polling = True
+    elif job is not None and st.session_state.get('job_shown') != job.id:
+        # First rerun after the job finished: keep its results in session state so they survive
+        # widget interactions such as the download button
+        st.session_state['job_shown'] = job.id
+        if job.status == 'done':
+            st.session_state['analysis'] = {'results': job.result, 'source': 'analysis'}
+    if job is not None and job.status == 'failed':
+        st.error(f"❌ Analysis failed: {job.error}")
+    elif job is not None and job.status == 'cancelled':
+        st.warning("🛑 Analysis cancelled")
     
-    if document_text and st.button("🚀 Analyze Document"):
-        # Process document
-        results = ai.process_document(document_text)
-        
-        # Display results
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("📊 Document Classification")
-            st.info(f"**Type:** {results['document_type'].replace('_', ' ').title()}")
-
-            st.subheader("💰 Financial Metrics")
-            if results['metrics']:
-                metrics_df = pd.DataFrame([results['metrics']])
-                st.dataframe(metrics_df)
-                
-                # Show raw response if available
-                if 'raw_response' in results['metrics']:
-                    with st.expander("📝 Raw AI Response"):
-                        st.text(results['metrics']['raw_response'])
-
-            st.subheader("⚠️ Risk Analysis")
-            if results['risks']:
-                st.json(results['risks'])
-                
-                # Show raw response if available
-                if 'raw_response' in results['risks']:
-                    with st.expander("📝 Raw AI Response"):
-                        st.text(results['risks']['raw_response'])
-        
-        with col2:
-            st.subheader("🎯 Investment Thesis")
-            if results['thesis']:
-                st.json(results['thesis'])
-                
-                # Show raw response if available
-                if 'raw_response' in results['thesis']:
-                    with st.expander("📝 Raw AI Response"):
-                        st.text(results['thesis']['raw_response'])
-            
-            st.subheader("✅ Quality Check")
-            st.info(results['quality_check'])
-        
-        st.subheader("📋 Executive Summary")
-        st.markdown(results['summary'])
-        
-        # Download results
-        st.download_button(
-            label="📥 Download Analysis Report",
-            data=json.dumps(results, indent=2),
-            file_name=f"terminal_x_gemini_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
-            mime="application/json"
-        )
+    asked = False
+    shown = st.session_state.get('analysis')
+    if shown and (shown['source'] == 'history' or shown['results'].get('document_hash') == doc_hash):
+        if shown['source'] == 'history':
+            st.caption(f"🗂️ Showing a stored analysis (document {shown['results'].get('document_hash', '')[:12]})")
+        _render_results(shown['results'])
+        # The store keeps results, not documents, so Q&A needs the document loaded above
+        if shown['results'].get('document_hash') == doc_hash:
+            asked = _render_qa(ai, document_text, shown['results'])
+    
+    compared = _render_portfolio(ai, store)
+    
+    _render_timings(time.perf_counter() - _SCRIPT_STARTED, compared or asked)
+    
+    if polling:
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+from analysis_store import AnalysisStore
+from llm_backends import StubBackend
+from terminal_x_gemini import TerminalXGeminiAI
+
+DOCUMENT = "Acme Corp annual report. Revenue: $12.5 billion. Net income: $1.2 billion. EPS: $2.40."
+
+STORED_METRICS = {"revenue": "$99 billion"}
+STORED_RISKS = {"market_risks": ["Stored risk"], "overall_risk_level": "LOW"}
+
+def _ai() -> TerminalXGeminiAI:
+    return TerminalXGeminiAI(use_cache=False, backend=StubBackend())
+
+def _store(tmp_path, result) -> AnalysisStore:
+    store = AnalysisStore(str(tmp_path / "analyses.sqlite3"))
+    store.save(DOCUMENT, result)
+    return store
+
+def test_successful_stored_analysis_is_reused(tmp_path):
+    store = _store(tmp_path, {"metrics": STORED_METRICS, "risks": STORED_RISKS, "errors": {}})
+
+    profile = _ai().company_profile(DOCUMENT, store)
+
+    assert profile['source'] == "history"
+    assert profile['metrics'] == STORED_METRICS
+
+@pytest.mark.parametrize("result", [
+    {"metrics": STORED_METRICS, "risks": None, "errors": {"risks": "RateLimitError: quota"}},
+    {"metrics": None, "risks": None, "errors": {"analysis": "GeminiError: no response"}},
+    # Exited early after triage: the analysis stages never ran
+    {"metrics": None, "risks": None, "errors": {}, "skipped": {"metrics": "low value", "risks": "low value"}},
+])
+def test_incomplete_stored_analysis_is_extracted_again(tmp_path, result):
+    store = _store(tmp_path, result)
+
+    profile = _ai().company_profile(DOCUMENT, store)
+
+    assert profile['source'] == "analysis"
+    assert profile['metrics'] != STORED_METRICS
+    assert profile['risks']
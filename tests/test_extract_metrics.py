@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+from gemini_client import GeminiClient, GeminiError
+from llm_backends import StubBackend
+from model_router import ModelRouter
+from terminal_x_gemini import TerminalXGeminiAI
+
+def _failing_ai() -> TerminalXGeminiAI:
+    backend = StubBackend(error_rate=1.0)
+    router = ModelRouter.single(GeminiClient(backend, max_retries=0, base_delay=0.0))
+    return TerminalXGeminiAI(use_cache=False, router=router)
+
+def test_local_values_survive_a_failed_fallback():
+    metrics = _failing_ai().extract_metrics("Revenue: $12.5 billion\nEPS: $2.40\n")
+
+    assert metrics['revenue'] == "$12.5 billion"
+    assert metrics['eps'] == "$2.40"
+    assert metrics['pe_ratio'] is None
+    assert set(metrics['_sources']) == {'revenue', 'eps'}
+
+def test_failed_fallback_with_nothing_local_fails_the_stage():
+    with pytest.raises(GeminiError):
+        _failing_ai().extract_metrics("The company discussed its strategy at length.")
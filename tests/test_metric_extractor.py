@@ -0,0 +1,35 @@
+import pytest
+
+from metric_extractor import extract_metrics_locally, parse_metric_value
+
+@pytest.mark.parametrize("line, field, value, unit", [
+    ("Revenue: $12.5 billion", 'revenue', 12.5e9, 'USD'),
+    ("Revenue: €3.2 billion", 'revenue', 3.2e9, 'EUR'),
+    ("Revenue: £850 million", 'revenue', 850e6, 'GBP'),
+    ("Revenue: EUR 3.2 billion", 'revenue', 3.2e9, 'EUR'),
+    ("Net income: ($120 million)", 'net_income', -120e6, 'USD'),
+    ("Net income: -$5 billion", 'net_income', -5e9, 'USD'),
+    ("EPS: $(0.12)", 'eps', -0.12, 'USD'),
+    ("EPS: €1.85", 'eps', 1.85, 'EUR'),
+])
+def test_local_extraction_keeps_currency_and_sign(line, field, value, unit):
+    metric = extract_metrics_locally(line)[field]
+
+    assert metric.value == pytest.approx(value)
+    assert metric.unit == unit
+    assert line[metric.span[0]:metric.span[1]] == metric.text
+
+@pytest.mark.parametrize("field, text, value", [
+    ('net_income', "($120 million)", -120e6),
+    ('net_income', "-$5 billion", -5e9),
+    ('eps', "$(0.12)", -0.12),
+    ('revenue', "EUR 3.2 billion", 3.2e9),
+])
+def test_parse_metric_value_keeps_sign(field, text, value):
+    assert parse_metric_value(field, text) == pytest.approx(value)
+
+def test_unclosed_parenthesis_is_not_negative():
+    metric = extract_metrics_locally("Revenue: $12.5 billion (up 10% YoY)")['revenue']
+
+    assert metric.value == pytest.approx(12.5e9)
+    assert metric.text == "$12.5 billion"
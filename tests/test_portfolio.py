@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from portfolio import rank_companies
+
+def test_percentiles_span_zero_to_one():
+    table = pd.DataFrame({'revenue': [1.0, 2.0, 3.0]}, index=['a', 'b', 'c'])
+
+    ranking = rank_companies(table)
+
+    assert ranking['score'].to_dict() == {'a': 0.0, 'b': 0.5, 'c': 1.0}
+
+def test_metric_reported_by_one_company_is_not_compared():
+    table = pd.DataFrame({
+        'revenue': [1.0, 2.0, np.nan],
+        'eps': [np.nan, np.nan, 5.0],
+        'pe_ratio': [20.0, np.nan, 10.0]
+    }, index=['a', 'b', 'c'])
+
+    ranking = rank_companies(table)
+
+    # c's EPS has nothing to beat, so only its P/E (lower than a's) counts
+    assert ranking.loc['c', 'score'] == 1.0
+    assert ranking.loc['c', 'metrics_compared'] == 1
+    assert ranking.loc['c', 'best_metric'] == 'pe_ratio'
+    assert ranking.loc['a', 'score'] == 0.0
+    assert ranking.loc['a', 'metrics_compared'] == 2
+    assert ranking.loc['b', 'score'] == 1.0
+
+def test_nothing_comparable():
+    table = pd.DataFrame({'revenue': [1.0, np.nan], 'eps': [np.nan, 2.0]}, index=['a', 'b'])
+
+    ranking = rank_companies(table)
+
+    assert ranking['score'].isna().all()
+    assert (ranking['metrics_compared'] == 0).all()
+    assert ranking['best_metric'].isna().all()
@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+from gemini_client import GeminiClient, ModelNotFoundError
+from llm_backends import StubBackend
+from model_router import ModelRouter
+from response_cache import ResponseCache
+from terminal_x_gemini import RISKS_SCHEMA, TerminalXGeminiAI
+
+class MissingModelBackend(StubBackend):
+    """A routed model the API key has no access to"""
+
+    def __init__(self, model_name: str):
+        super().__init__(model_name=model_name)
+        self.calls = 0
+
+    def generate(self, prompt, *args, **kwargs):
+        self.calls += 1
+        raise ModelNotFoundError(f"{self.model_name} not found")
+
+def _ai(tmp_path, primary: StubBackend, backup: StubBackend) -> TerminalXGeminiAI:
+    clients = {backend.model_name: GeminiClient(backend, max_retries=0, base_delay=0.0)
+               for backend in (primary, backup)}
+    ai = TerminalXGeminiAI(router=ModelRouter(clients, hedging=False))
+    ai.cache = ResponseCache(str(tmp_path / "responses.sqlite3"))
+    return ai
+
+def test_failover_answer_is_served_from_cache(tmp_path):
+    primary = MissingModelBackend("gemini-2.5-pro")
+    backup = StubBackend(model_name="gemini-1.5-pro")
+    ai = _ai(tmp_path, primary, backup)
+    prompt = ai.prompts['risk_analyzer'].format(document="Revenue fell 10% on weaker demand.")
+
+    first = ai._call_gemini(prompt, 'risk_analyzer')
+    second = ai._call_gemini(prompt, 'risk_analyzer')
+
+    assert second == first
+    assert primary.calls == 1
+    assert ai.cache.stats()['hits'] == 1
+
+def test_malformed_answer_is_not_cached(tmp_path):
+    primary = StubBackend(model_name="gemini-2.5-pro", malformed_rate=1.0)
+    ai = _ai(tmp_path, primary, StubBackend(model_name="gemini-1.5-pro"))
+    prompt = ai.prompts['risk_analyzer'].format(document="Revenue fell 10% on weaker demand.")
+
+    ai._call_gemini(prompt, 'risk_analyzer', schema=RISKS_SCHEMA)
+    ai._call_gemini(prompt, 'risk_analyzer', schema=RISKS_SCHEMA)
+
+    assert ai.cache.stats()['hits'] == 0
+
+def test_parsed_answer_is_cached(tmp_path):
+    ai = _ai(tmp_path, StubBackend(model_name="gemini-2.5-pro"), StubBackend(model_name="gemini-1.5-pro"))
+    prompt = ai.prompts['risk_analyzer'].format(document="Revenue fell 10% on weaker demand.")
+
+    ai._call_gemini(prompt, 'risk_analyzer', schema=RISKS_SCHEMA)
+    ai._call_gemini(prompt, 'risk_analyzer', schema=RISKS_SCHEMA)
+
+    assert ai.cache.stats()['hits'] == 1